@@ -1,6 +1,6 @@
 #!/bin/bash
 
-for cdir in results/CEMiTool tmp/modules_symbols tmp/modules tmp/modules_biomart/ results/CEMiTool_joined/enrichment/do_ora/ results/CEMiTool_joined/enrichment/enrichr results/CEMiTool_joined/fgsea figures/enrichment_cemitool_modules/fgsea/ results/CEMiTool_joined/corr_lnc/ results/CEMiTool_joined/corr_stats_lnc/ results/CEMiTool_joined/corr_pvalue_lnc/ results/CEMiTool_joined/corr_padj_lnc/ results/graphs/; do
+for cdir in results/CEMiTool tmp/modules_symbols tmp/modules tmp/modules_biomart/ results/CEMiTool_joined/enrichment/do_ora/ results/CEMiTool_joined/enrichment/enrichr results/CEMiTool_joined/fgsea figures/enrichment_cemitool_modules/fgsea/ results/CEMiTool_joined/corr_lnc/ results/CEMiTool_joined/corr_stats_lnc/ results/CEMiTool_joined/corr_pvalue_lnc/ results/CEMiTool_joined/corr_padj_lnc/ results/CEMiTool_joined/activity/ results/CEMiTool_joined/activity_class/ results/graphs/; do
 	echo "Creating $cdir ..."
 	if [ -d $cdir ]; then
 		echo "$cdir already exists !"
@@ -19,13 +19,13 @@ echo  "Joining cemitool results ..."
 module_tables=$(find "results/CEMiTool/" -name "module.tsv")
 names=$(echo $module_tables | sed "s/\S*\(GSE[0-9]\+\)\S*/--names=\1/g")
 input=$(echo $module_tables | sed "s/\(\S\+\)/--input=\1/g")
-src/microarrayAnalysis/join_cemitool.R $input $names --output results/CEMiTool_joined.tsv # || { echo "Unable to join CEMiTool"; exit 1; }
+src/microarrayAnalysis/join_cemitool.py $input $names --output results/CEMiTool_joined.tsv # || { echo "Unable to join CEMiTool"; exit 1; }
 
 echo "Getting connected components in joined cemitool results ..."
 #src/microarrayAnalysis/get_modules.py --input results/CEMiTool_joined.tsv --from-col Gene1 --to-col Gene2 --filter-col Sum --filter-val 3 --output results/CEMiTool_joined_modules.txt
 src/microarrayAnalysis/get_modules_CEMiTool_joined.R --input results/CEMiTool_joined.tsv --tsv=results/CEMiTool_joined_modules.tsv --graphml=results/CEMiTool_joined_modules.graphml --gmt results/CEMiTool_joined_modules.gmt --chosen-method=walktrap --min-studies=1 --algorithms=fast_greedy --algorithms=label_prop --algorithms=leading_eigen --algorithms=louvain --algorithms=walktrap || { echo "Unable to get modules for CEMiTool joined"; exit 1; }
 
-docker run -ti --rm -e DISPLAY=$DISPLAY -v `pwd`:`pwd` -w `pwd` -v /tmp/.X11-unix:/tmp/.X11-unix tiagopeixoto/graph-tool python3 src/plot_CEMiTool_joined.py results/CEMiTool_joined_modules.graphml results/graphs/clustering_sum_squared_ || echo "Unable to plot graph"
+docker run --rm -v `pwd`:`pwd` -w `pwd` tiagopeixoto/graph-tool python3 src/plot_CEMiTool_joined.py results/CEMiTool_joined_modules.graphml results/graphs/clustering_sum_squared_ || echo "Unable to plot graph"
 
 #echo "Generating a GMT file based on connected components ..."
 #cat  results/CEMiTool_joined_modules.txt | awk '{ print "Mod"NR"\t\t"$0 }' > results/CEMiTool_joined_modules.gmt
@@ -41,13 +41,13 @@ echo "Extracting Gene Symbols ..."
 parallel "csvcut -t -c hgnc_symbol {} | sed 1d > tmp/modules_symbols/{/.}.txt" ::: tmp/modules_biomart/*.tsv || { echo "Unable to extract gene symbols"; exit 1; }
 
 echo "Running do_ora for the BTMs ..."
-parallel -j 20 "src/microarrayAnalysis/do_ora.R results/CEMiTool_joined/enrichment/do_ora/BTM_{/.}.tsv --genes {} --gmt config/pathways/BTM.gmt" ::: tmp/modules_symbols/*.txt || { echo "Unable to run ORA for CEMiTool joined modules"; exit 1; }
+src/microarrayAnalysis/ora.py --gmt config/pathways/BTM.gmt --output "results/CEMiTool_joined/enrichment/do_ora/BTM_{list}.tsv" tmp/modules_symbols/*.txt || { echo "Unable to run ORA for CEMiTool joined modules"; exit 1; }
 
 echo "Getting all genesets in enrichr ..."
 genesets=$(cat config/libraries_enrichr.txt | sed "s/^/--gs=/" | tr "\n" " ")
 
 echo "Running enrichr ..."
-# parallel -j 20 "src/microarrayAnalysis/enrichr.py --input {} --output results/CEMiTool_joined/enrichment/enrichr/{/.}.tsv $genesets" ::: tmp/modules_symbols/*.txt || { echo "Unable to run EnrichR for CemiTool modules"; exit 1; }
+# src/microarrayAnalysis/enrichr.py --input-dir tmp/modules_symbols --output-dir results/CEMiTool_joined/enrichment/enrichr --jobs 20 $genesets || { echo "Unable to run EnrichR for CemiTool modules"; exit 1; }
 
 
 echo "Comparisons to GSEA input ..."
@@ -57,8 +57,11 @@ echo "Running FGSEA ..."
 parallel --progress -j 10 "src/microarrayAnalysis/fgsea.R --input {} --output results/CEMiTool_joined/fgsea/{/} --gmt results/CEMiTool_joined_modules.gmt --symbols Symbol" ::: tmp/fgsea/Log2FC/*.tsv || { echo "Unable to run fgsea"; exit 1; }
 parallel --progress -j 10 "src/microarrayAnalysis/corrplot_fgsea.R {} figures/enrichment_cemitool_modules/fgsea/{/.}.pdf" ::: results/CEMiTool_joined/fgsea/*.tsv || { echo "Unable to get corrplot"; exit 1; }
 
+echo "Module activity in each sample ..."
+parallel -j 4 "src/microarrayAnalysis/module_scores.py --expression {} --gmt results/CEMiTool_joined_modules.gmt --output results/CEMiTool_joined/activity/{/} --sample-annotation config/sample_annotation/{/} --output-class results/CEMiTool_joined/activity_class/{/} --class-col Class" ::: data/processed/collapsed/GSE*.tsv || { echo "Unable to score modules"; exit 1; }
+
 echo "Correlation between lncRNAs and genes in modules ..."
-parallel -j 10 "src/microarrayAnalysis/lnc_cor_modules.R --modules results/CEMiTool_joined_modules.gmt --expression={} --gencode config/reannotation/gencode_annotation.tsv --biotype config/reannotation/biotypes.tsv --output-corr=results/CEMiTool_joined/corr_lnc/{/} --output-pvalue=results/CEMiTool_joined/corr_pvalue_lnc/{/} --output-padj=results/CEMiTool_joined/corr_padj_lnc/{/} --output-stats=results/CEMiTool_joined/corr_stats_lnc/{/}" ::: data/processed/collapsed/GSE*.tsv || { echo "Unable to calculate correlation between lncRNAs and mRNAs"; exit 1; }
+parallel -j 1 "src/microarrayAnalysis/cor_lnc.py modules --modules results/CEMiTool_joined_modules.gmt --expression={} --gencode config/reannotation/gencode_annotation.tsv --biotype config/reannotation/biotypes.tsv --output-corr=results/CEMiTool_joined/corr_lnc/{/} --output-pvalue=results/CEMiTool_joined/corr_pvalue_lnc/{/} --output-padj=results/CEMiTool_joined/corr_padj_lnc/{/} --output-stats=results/CEMiTool_joined/corr_stats_lnc/{/}" ::: data/processed/collapsed/GSE*.tsv || { echo "Unable to calculate correlation between lncRNAs and mRNAs"; exit 1; }
 
 echo "Joining correlation files ..."
 src/microarrayAnalysis/join_lnc_cor_modules.R --output results/CEMiTool_joined/corr_lnc_joined.tsv results/CEMiTool_joined/corr_stats_lnc/GSE*.tsv || { echo "Unable to join correlations"; exit 1; }
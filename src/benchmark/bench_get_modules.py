@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Benchmark get_modules.py: Graph/depth_search against union-find
+
+A synthetic edge table is written in the same layout as
+results/CEMiTool_joined.tsv (Gene1, Gene2, Sum) and both engines are timed on
+it. Both must return the same modules.
+
+Usage:
+  bench_get_modules.py [--nodes=<n>] [--edges=<n>] [--seed=<n>] [--skip-graph]
+  bench_get_modules.py (-h | --help)
+
+Options:
+  -h --help                 Show this screen.
+  --nodes=<n>               number of distinct genes [default: 5000]
+  --edges=<n>               number of edges [default: 20000]
+  --seed=<n>                random seed [default: 42]
+  --skip-graph              do not run the Graph/depth_search engine
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "microarrayAnalysis"))
+import get_modules
+import synthetic
+
+
+def run_graph(fname):
+    graph = get_modules.Graph()
+    with open(fname) as fh:
+        for a, b in get_modules.read_edges(fh, "Gene1", "Gene2"):
+            graph.add_edge(a, b)
+    return(get_modules.get_modules(graph))
+
+
+def run_uf(fname):
+    with open(fname) as fh:
+        return(get_modules.get_modules_uf(
+            get_modules.read_edges(fh, "Gene1", "Gene2")))
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return(time.perf_counter() - start, result)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    n_nodes = int(args["--nodes"])
+    n_edges = int(args["--edges"])
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "edges.tsv")
+        synthetic.write_edges(fname, n_nodes, n_edges, int(args["--seed"]))
+        print("nodes=%d edges=%d" % (n_nodes, n_edges))
+        t_uf, mods_uf = timeit(run_uf, fname)
+        print("union-find\t%.3fs\t%d modules" % (t_uf, len(mods_uf)))
+        if not args["--skip-graph"]:
+            t_graph, mods_graph = timeit(run_graph, fname)
+            print("graph\t%.3fs\t%d modules" % (t_graph, len(mods_graph)))
+            same = sorted(map(sorted, mods_uf)) == \
+                sorted(map(sorted, mods_graph))
+            print("speedup\t%.1fx\tsame modules: %s" %
+                  (t_graph / t_uf, same))
+            if not same:
+                sys.exit("Engines returned different modules")
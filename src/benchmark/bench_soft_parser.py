@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Benchmark the SOFT parser of get_sample_annot.py
+
+Synthetic series SOFT documents with an increasing number of samples are
+parsed from disk by the line oriented parser (get_sample_info over the file
+lines) and by the previous approach (whole document read in one string and
+parsed with a multiline regex). Time and peak memory (tracemalloc) are
+reported for each size.
+
+Usage:
+  bench_soft_parser.py [--samples=<n>...] [--fields=<n>]
+  bench_soft_parser.py (-h | --help)
+
+Options:
+  -h --help                 Show this screen.
+  --samples=<n>             number of samples in a document [default: 1000 10000 50000]
+  --fields=<n>              number of characteristics per sample [default: 20]
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "microarrayAnalysis"))
+import get_sample_annot
+import synthetic
+
+
+def parse_regex(fname):
+    """
+    Previous approach: one string and a multiline regex
+    """
+    block_re = re.compile(r"^\^SAMPLE\s*=\s*(?P<sample>\S+)\n"
+                          r"(?P<info>(\!.+\n)+)", flags=re.MULTILINE)
+    field_re = re.compile(r"^\!(\S+)\s*=\s*(.*)$", flags=re.MULTILINE)
+    with open(fname) as fh:
+        soft = fh.read()
+    n = 0
+    for block in block_re.finditer(soft):
+        get_sample_annot.create_dict(field_re.findall(block.group("info")))
+        n += 1
+    return(n)
+
+
+def parse_stream(fname):
+    n = 0
+    with open(fname) as fh:
+        for sample_info in get_sample_annot.get_sample_info(fh):
+            n += 1
+    return(n)
+
+
+def measure(func, fname):
+    tracemalloc.start()
+    start = time.perf_counter()
+    n = func(fname)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return(n, elapsed, peak)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    sizes = [int(s) for v in args["--samples"] for s in v.split()]
+    print("parser\tsamples\tMB\tseconds\tpeak_MB")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_samples in sizes:
+            fname = os.path.join(tmp, "series.soft")
+            synthetic.write_soft(fname, n_samples, int(args["--fields"]))
+            mb = os.path.getsize(fname) / 2**20
+            for name, func in (("stream", parse_stream), ("regex", parse_regex)):
+                n, elapsed, peak = measure(func, fname)
+                if n != n_samples:
+                    sys.exit("%s parsed %d of %d samples" % (name, n, n_samples))
+                print("%s\t%d\t%.1f\t%.3f\t%.2f" %
+                      (name, n_samples, mb, elapsed, peak / 2**20))
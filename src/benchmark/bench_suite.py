@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Benchmark suite of the Python tools on synthetic data
+
+Each case writes synthetic inputs (see synthetic.py) at a multiple of the
+size of the current data (the four GEO series: SCALE_1) and runs the tool as
+the pipeline does, in its own process, measured by stagestats (wall time and
+peak resident memory). The throughput is reported in rows and input MB per
+second.
+
+The results can be stored as a baseline (--save-baseline, one entry per case
+and scale); a case slower or bigger than its baseline by more than the
+tolerance is flagged as a REGRESSION and the suite exits with status 1.
+
+Usage:
+  bench_suite.py [--scale=<n>...] [--case=<name>...] [--baseline=<file>] [--save-baseline] [--tolerance=<x>] [--repeat=<n>] [--seed=<n>] [--keep=<dir>]
+  bench_suite.py --list
+  bench_suite.py (-h | --help)
+
+Options:
+  -h --help                 Show this screen.
+  --list                    list the cases and the sizes at scale 1
+  --scale=<n>               multiple of the current data size [default: 1 10 100]
+  --case=<name>             run only these cases (all by default)
+  --baseline=<file>         baseline results, baseline.json next to this script by default
+  --save-baseline           store the results as the baseline
+  --tolerance=<x>           slowdown or memory growth flagged as a regression [default: 0.25]
+  --repeat=<n>              runs of each case, the fastest is reported [default: 1]
+  --seed=<n>                random seed [default: 42]
+  --keep=<dir>              write the inputs and outputs to this directory instead of a temporary one
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import json
+import os
+import shlex
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, os.path.join(SRC_DIR, "microarrayAnalysis"))
+import stagestats
+import synthetic
+
+# size of the current data (scale 1)
+SCALE_1 = {
+    "probes": 54675,          # GPL570
+    "samples": 56,            # GSE51808
+    "illumina_probes": 24350,  # GPL2700
+    "illumina_samples": 93,   # GSE28405
+    "reannotation": 130000,   # annotation_long.tsv
+    "genes": 8000,            # genes in the joined CEMiTool modules
+    "edges": 200000,
+    "soft_samples": 93,
+    "soft_fields": 15,
+    "gmt_sets": 1900,         # ReactomePathways.gmt
+    "gmt_genes": 11000,
+    "gene_lists": 20,
+}
+# differences smaller than this are noise, not regressions
+MIN_SECONDS = 0.1
+MIN_RSS_MB = 5.0
+
+
+def python_cmd(script, *args):
+    return(" ".join([shlex.quote(sys.executable),
+                     shlex.quote(os.path.join(SRC_DIR, script))] +
+                    [shlex.quote(a) for a in args]))
+
+
+def case_remove_columns(scale, seed):
+    """
+    remove_columns.py on a probes x samples expression matrix
+    """
+    n = SCALE_1["probes"] * scale
+    samples = synthetic.write_expression("expression.tsv", n,
+                                         SCALE_1["samples"], seed)
+    cmd = python_cmd("microarrayAnalysis/remove_columns.py", "expression.tsv",
+                     "--columns", samples[1], "--columns", samples[-1]) + \
+        " > expression_filtered.tsv"
+    return(cmd, ["expression.tsv"], n)
+
+
+def case_get_annotation(scale, seed):
+    """
+    get_annotation.py for two platforms, building its index from scratch
+    """
+    n = SCALE_1["reannotation"] * scale
+    synthetic.write_reannotation("annotation_long.tsv", n, seed)
+    cmd = "rm -rf index out && " + \
+        python_cmd("get_annotation.py", "--reannotation=annotation_long.tsv",
+                   "--platform=GPL570", "--platform=GPL2700", "--out-dir=out",
+                   "--index-dir=index")
+    os.makedirs("out", exist_ok=True)
+    return(cmd, ["annotation_long.tsv"], n)
+
+
+def case_get_modules(scale, seed):
+    """
+    get_modules.py sweeping the Sum thresholds of a joined CEMiTool table
+    """
+    n = SCALE_1["edges"] * scale
+    synthetic.write_edges("CEMiTool_joined.tsv", SCALE_1["genes"] * scale, n,
+                          seed)
+    cmd = python_cmd("microarrayAnalysis/get_modules.py",
+                     "--input=CEMiTool_joined.tsv", "--from-col=Gene1",
+                     "--to-col=Gene2", "--sweep-col=Sum", "--sweep-val=1",
+                     "--sweep-val=2", "--sweep-val=3",
+                     "--output=modules.tsv")
+    return(cmd, ["CEMiTool_joined.tsv"], n)
+
+
+def case_getDataGSE28405(scale, seed):
+    """
+    getDataGSE28405.py splitting an Illumina non-normalized file
+    """
+    n = SCALE_1["illumina_probes"] * scale
+    non_norm = "data/geo_raw/supplemental_data/GSE28405/" \
+        "GSE28405_non-normalized.txt.gz"
+    annot = "config/sample_annotation/with_outliers/GSE28405.tsv"
+    for fname in (non_norm, annot):
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+    titles = synthetic.write_non_normalized(non_norm, n,
+                                            SCALE_1["illumina_samples"], seed)
+    synthetic.write_sample_annotation(annot, titles)
+    cmd = python_cmd("getDataGSE28405.py", "detection_pval.tsv", "signal.tsv",
+                     "sample2gsm.tsv")
+    return(cmd, [non_norm], n)
+
+
+def case_get_sample_info(scale, seed):
+    """
+    get_sample_annot.get_sample_info on a series SOFT document
+    """
+    n = SCALE_1["soft_samples"] * scale
+    synthetic.write_soft("series.soft", n, SCALE_1["soft_fields"])
+    code = "import sys; sys.path.insert(0, %r); import get_sample_annot; " \
+        "fh = open('series.soft'); " \
+        "n = sum(1 for s in get_sample_annot.get_sample_info(fh)); " \
+        "assert n == %d" % (os.path.join(SRC_DIR, "microarrayAnalysis"), n)
+    cmd = " ".join([shlex.quote(sys.executable), "-c", shlex.quote(code)])
+    return(cmd, ["series.soft"], n)
+
+
+def case_ora(scale, seed):
+    """
+    ora.py on a GMT file and gene lists of DEGs
+    """
+    n = SCALE_1["gene_lists"] * scale
+    synthetic.write_gmt("pathways.gmt", SCALE_1["gmt_sets"],
+                        SCALE_1["gmt_genes"], seed=seed)
+    os.makedirs("genes", exist_ok=True)
+    os.makedirs("ora", exist_ok=True)
+    lists = ["genes/list%d.txt" % i for i in range(n)]
+    for i, fname in enumerate(lists):
+        synthetic.write_gene_list(fname, SCALE_1["gmt_genes"], 300, seed + i)
+    cmd = python_cmd("microarrayAnalysis/ora.py", "--gmt=pathways.gmt",
+                     "--output=ora/{list}.tsv") + " genes/*.txt"
+    return(cmd, ["pathways.gmt"] + lists, n)
+
+
+CASES = [("remove_columns", case_remove_columns),
+         ("get_annotation", case_get_annotation),
+         ("get_modules", case_get_modules),
+         ("getDataGSE28405", case_getDataGSE28405),
+         ("get_sample_info", case_get_sample_info),
+         ("ora", case_ora)]
+
+
+def run_case(func, wd, scale, seed, repeat):
+    """
+    Writes the inputs of a case in wd (its working directory) and runs it
+    repeat times
+    Returns the record of the fastest run, with the rows and input size
+    """
+    os.makedirs(wd, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(wd)
+    try:
+        cmd, inputs, n_rows = func(scale, seed)
+        input_mb = sum(os.path.getsize(f) for f in inputs) / stagestats.MB
+    finally:
+        os.chdir(cwd)
+    best = None
+    for i in range(repeat):
+        with open(os.path.join(wd, "bench.log"), "w") as out:
+            status, record = stagestats.run_command(
+                "cd %s && %s" % (shlex.quote(wd), cmd), out)
+        if status != 0:
+            raise Exception("Case failed, see %s" %
+                            os.path.join(wd, "bench.log"))
+        if best is None or record["wall"] < best["wall"]:
+            best = record
+    best.update(rows=n_rows, input_mb=round(input_mb, 1))
+    return(best)
+
+
+def check(record, base, tolerance):
+    """
+    Returns the status of a result compared to its baseline
+    """
+    if base is None:
+        return("new")
+    slower = record["wall"] > base["wall"] * (1 + tolerance) and \
+        record["wall"] - base["wall"] > MIN_SECONDS
+    bigger = record["max_rss_mb"] > base["max_rss_mb"] * (1 + tolerance) and \
+        record["max_rss_mb"] - base["max_rss_mb"] > MIN_RSS_MB
+    if slower or bigger:
+        return("REGRESSION (%s)" % ", ".join(
+            (["time"] if slower else []) + (["memory"] if bigger else [])))
+    return("ok")
+
+
+def run_suite(names, scales, wd, baseline, tolerance, repeat, seed):
+    """
+    Runs the cases at each scale printing their results
+    Returns the results (case:scale -> record) and whether any regressed
+    """
+    results = {}
+    regression = False
+    print("\t".join(["case", "scale", "rows", "input_mb", "seconds",
+                     "rows/s", "MB/s", "max_rss_mb", "baseline_s",
+                     "baseline_rss_mb", "status"]))
+    for scale in scales:
+        for name, func in CASES:
+            if name not in names:
+                continue
+            key = "%s:%d" % (name, scale)
+            record = run_case(func, os.path.join(wd, key.replace(":", "_")),
+                              scale, seed, repeat)
+            results[key] = {k: record[k] for k in
+                            ("wall", "cpu", "max_rss_mb", "rows", "input_mb")}
+            base = baseline.get(key)
+            status = check(record, base, tolerance)
+            regression = regression or status.startswith("REGRESSION")
+            wall = max(record["wall"], 1e-6)
+            print("%s\t%d\t%d\t%.1f\t%.3f\t%.0f\t%.1f\t%.1f\t%s\t%s\t%s" %
+                  (name, scale, record["rows"], record["input_mb"],
+                   record["wall"], record["rows"] / wall,
+                   record["input_mb"] / wall, record["max_rss_mb"],
+                   "%.3f" % base["wall"] if base else "NA",
+                   "%.1f" % base["max_rss_mb"] if base else "NA", status),
+                  flush=True)
+    return(results, regression)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    if args["--list"]:
+        for name, func in CASES:
+            print("%s\t%s" % (name, func.__doc__.strip()))
+        for k, v in SCALE_1.items():
+            print("%s\t%d" % (k, v))
+        sys.exit(0)
+    names = args["--case"] or [name for name, func in CASES]
+    for name in names:
+        if name not in dict(CASES):
+            sys.exit("Unknown case %s" % name)
+    scales = [int(s) for v in args["--scale"] for s in v.split()]
+    baseline_fname = args["--baseline"] or os.path.join(BENCH_DIR,
+                                                        "baseline.json")
+    try:
+        with open(baseline_fname) as fh:
+            baseline = json.load(fh)
+    except OSError:
+        baseline = {}
+    tolerance = float(args["--tolerance"])
+    repeat = int(args["--repeat"])
+    seed = int(args["--seed"])
+    if args["--keep"]:
+        results, regression = run_suite(names, scales,
+                                        os.path.abspath(args["--keep"]),
+                                        baseline, tolerance, repeat, seed)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results, regression = run_suite(names, scales, tmp, baseline,
+                                            tolerance, repeat, seed)
+    if args["--save-baseline"]:
+        baseline.update(results)
+        with open(baseline_fname, "w") as fh:
+            json.dump(baseline, fh, indent=1, sort_keys=True)
+        print("Baseline saved in %s" % baseline_fname)
+    elif regression:
+        sys.exit("Regressions found (tolerance %.0f%%)" % (100 * tolerance))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Benchmark tsvio against the per-script TSV loops it replaced
+
+Synthetic tables are written with the layouts read by remove_columns.py (a
+wide numeric table), get_annotation.py (reannotation file), get_modules.py
+(Gene1, Gene2, Sum) and getDataGSE28405.py (probe, signal and Detection Pval
+columns). Each script's former loop (header.index, full split and one print
+per row) and its tsvio counterpart are timed on the same table and must
+write the same output.
+
+Usage:
+  bench_tsvio.py [--rows=<n>] [--cols=<n>] [--seed=<n>] [--gzip]
+  bench_tsvio.py (-h | --help)
+
+Options:
+  -h --help                 Show this screen.
+  --rows=<n>                number of rows of each table [default: 200000]
+  --cols=<n>                number of columns of the wide table [default: 40]
+  --seed=<n>                random seed [default: 42]
+  --gzip                    gzip the input tables
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "microarrayAnalysis"))
+import remove_columns
+import tsvio
+import synthetic
+
+
+def write_tables(tmp, n_rows, n_cols, seed, compress):
+    """
+    Writes the synthetic tables and returns their file names and the sample
+    names of the wide table
+    """
+    suffix = ".tsv.gz" if compress else ".tsv"
+    fnames = {name: os.path.join(tmp, name + suffix)
+              for name in ("wide", "reannotation", "edges", "non_norm")}
+    samples = synthetic.write_expression(fnames["wide"], n_rows, n_cols, seed)
+    synthetic.write_reannotation(fnames["reannotation"], n_rows, seed)
+    synthetic.write_edges(fnames["edges"], 20000, n_rows, seed)
+    synthetic.write_non_normalized(fnames["non_norm"], n_rows,
+                                   max(n_cols // 2, 1), seed)
+    return(fnames, samples)
+
+
+def remove_columns_before(fname, out_fname, columns):
+    with tsvio.open_tsv(fname) as fh, open(out_fname, "w") as out:
+        header = fh.readline().strip("\n").split("\t")
+        idx = [i for i, v in enumerate(header) if v in columns]
+        print("\t".join([v for i, v in enumerate(header) if i not in idx]),
+              file=out)
+        for line in fh:
+            values = line.strip("\n").split("\t")
+            print("\t".join([v for i, v in enumerate(values) if i not in idx]),
+                  file=out)
+
+
+def remove_columns_after(fname, out_fname, columns):
+    remove_columns.remove_columns(fname, out_fname, columns)
+
+
+def annotation_before(fname, out_fname, platform):
+    with tsvio.open_tsv(fname) as fh, open(out_fname, "w") as out:
+        header = fh.readline().strip("\n").split("\t")
+        nannot_idx = header.index("NumAnnot")
+        hits_idx = header.index("Hits")
+        platform_idx = header.index("Platform")
+        gene_idx = header.index("Gene")
+        probe_idx = header.index("Probe")
+        print("ProbeName\tSymbol", file=out)
+        for line in fh:
+            values = [v.strip() for v in line.strip("\n").split("\t")]
+            if int(values[hits_idx]) == 1 and int(values[nannot_idx]) == 1 \
+                    and values[platform_idx] == platform:
+                print(values[probe_idx] + "\t" + values[gene_idx], file=out)
+
+
+def annotation_after(fname, out_fname, platform):
+    def unique(v):
+        return(int(v) == 1)
+    with tsvio.open_tsv(fname) as fh, \
+            tsvio.TsvWriter(out_fname, ["ProbeName", "Symbol"]) as out:
+        rows = tsvio.TsvReader(fh).rows(
+            ["Probe", "Gene"], strip=True,
+            where=[("Hits", unique), ("NumAnnot", unique),
+                   ("Platform", lambda v: v.strip() == platform)])
+        out.write_rows(rows)
+
+
+def edges_before(fname, out_fname, min_sum):
+    with tsvio.open_tsv(fname) as fh, open(out_fname, "w") as out:
+        header = fh.readline().strip("\n").split("\t")
+        g1_idx = header.index("Gene1")
+        g2_idx = header.index("Gene2")
+        filter_idx = header.index("Sum")
+        for line in fh:
+            values = line.strip("\n").split("\t")
+            if float(values[filter_idx]) < min_sum:
+                continue
+            print(values[g1_idx], values[g2_idx], sep="\t", file=out)
+
+
+def edges_after(fname, out_fname, min_sum):
+    with tsvio.open_tsv(fname) as fh, tsvio.TsvWriter(out_fname) as out:
+        out.write_rows(tsvio.TsvReader(fh).rows(
+            ["Gene1", "Gene2"], where=[("Sum", lambda v: float(v) >= min_sum)]))
+
+
+def detection_before(fname, out_fname):
+    with tsvio.open_tsv(fname) as fh, open(out_fname, "w") as out:
+        header = fh.readline().strip().split("\t")
+        det = [i for i, v in enumerate(header) if v == "Detection Pval"]
+        print("ProbeName\t" + "\t".join(header[d-1] for d in det), file=out)
+        for line in fh:
+            values = line.strip().split("\t")
+            print(values[0] + "\t" + "\t".join(values[d] for d in det),
+                  file=out)
+
+
+def detection_after(fname, out_fname):
+    with tsvio.open_tsv(fname) as fh:
+        reader = tsvio.TsvReader(fh)
+        det = [i for i, v in enumerate(reader.header) if v == "Detection Pval"]
+        with tsvio.TsvWriter(out_fname, ["ProbeName"] +
+                             [reader.header[d-1] for d in det]) as out:
+            out.write_rows(reader.rows([0] + det, strip=True))
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return(time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    n_rows = int(args["--rows"])
+    n_cols = int(args["--cols"])
+    with tempfile.TemporaryDirectory() as tmp:
+        fnames, samples = write_tables(tmp, n_rows, n_cols,
+                                       int(args["--seed"]), args["--gzip"])
+        cases = [
+            ("remove_columns", remove_columns_before, remove_columns_after,
+             fnames["wide"], ([samples[1], samples[n_cols // 2]],)),
+            ("get_annotation", annotation_before, annotation_after,
+             fnames["reannotation"], ("GPL570",)),
+            ("get_modules", edges_before, edges_after, fnames["edges"], (2,)),
+            ("getDataGSE28405", detection_before, detection_after,
+             fnames["non_norm"], ())]
+        print("rows=%d cols=%d gzip=%s" % (n_rows, n_cols, args["--gzip"]))
+        print("script\tbefore\tafter\tspeedup\tMB/s after\tsame output")
+        failed = False
+        for name, before, after, fname, extra in cases:
+            out_before = os.path.join(tmp, name + ".before")
+            out_after = os.path.join(tmp, name + ".after")
+            t_before = timeit(before, fname, out_before, *extra)
+            t_after = timeit(after, fname, out_after, *extra)
+            same = filecmp.cmp(out_before, out_after, shallow=False)
+            failed = failed or not same
+            mb = os.path.getsize(fname) / 2**20
+            print("%s\t%.3fs\t%.3fs\t%.1fx\t%.1f\t%s" %
+                  (name, t_before, t_after, t_before / t_after, mb / t_after,
+                   same))
+        if failed:
+            sys.exit("tsvio returned different output")
@@ -0,0 +1,174 @@
+# vim:fileencoding=utf8
+
+"""Synthetic inputs for the benchmarks
+
+Each generator writes a file in the layout read by one of the tools, with
+its size given by the parameters: expression matrices (probes x samples),
+Illumina non-normalized files with paired Detection Pval columns and the
+sample annotation naming their columns, reannotation tables, joined CEMiTool
+edge lists, series SOFT documents, GMT files and gene lists. Values are
+random (seeded); the rows of big tables are drawn from a pool of
+POOL_SIZE lines so that writing them is not slower than reading them.
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+import gzip
+import random
+
+POOL_SIZE = 10000
+PLATFORMS = ("GPL570", "GPL2700", "GPL13158")
+
+
+def open_out(fname):
+    """
+    Opens a file for writing, gzip compressed (fast) if it ends in .gz
+    """
+    if fname.endswith(".gz"):
+        return(gzip.open(fname, "wt", compresslevel=1))
+    return(open(fname, "w"))
+
+
+def value_pool(rnd, n_values, fmt, scale=1.0, pool_size=POOL_SIZE):
+    """
+    Returns a list of lines of n_values random tab separated values
+    """
+    return(["\t".join(fmt % (rnd.random() * scale) for j in range(n_values))
+            for i in range(pool_size)])
+
+
+def write_expression(fname, n_probes, n_samples, seed=42):
+    """
+    Writes a ProbeName x samples table of log2 expression values
+    Returns the sample names
+    """
+    rnd = random.Random(seed)
+    samples = ["GSM%d" % (100000 + i) for i in range(n_samples)]
+    pool = value_pool(rnd, n_samples, "%.4f", 16.0)
+    with open_out(fname) as fh:
+        fh.write("ProbeName\t" + "\t".join(samples) + "\n")
+        for i in range(n_probes):
+            fh.write("%d_at\t%s\n" % (i, pool[i % len(pool)]))
+    return(samples)
+
+
+def sample_titles(n_samples):
+    """
+    Returns the titles (GSE28405 style) and column names of n_samples
+    samples, a fifth of them controls and the others patients in 3 time points
+    """
+    titles = []
+    names = []
+    n_controls = max(n_samples // 5, 1)
+    for i in range(n_samples):
+        if i < n_controls:
+            titles.append("Control_sample  %d" % (i + 1))
+            names.append("C%d" % (i + 1))
+        else:
+            pat, time = divmod(i - n_controls, 3)
+            titles.append("Patient_Timepoint%d  %d" % (time + 1, pat + 1))
+            names.append("P%dT%d" % (pat + 1, time + 1))
+    return(titles, names)
+
+
+def write_non_normalized(fname, n_probes, n_samples, seed=42):
+    """
+    Writes an Illumina non-normalized table: ID_REF followed by a signal and
+    a Detection Pval column for each sample
+    Returns the sample titles (see sample_titles)
+    """
+    rnd = random.Random(seed)
+    titles, names = sample_titles(n_samples)
+    pool = ["\t".join("%.2f\t%.5f" % (rnd.random() * 1000, rnd.random())
+                      for j in range(n_samples))
+            for i in range(POOL_SIZE)]
+    with open_out(fname) as fh:
+        fh.write("ID_REF\t" + "\t".join("%s\tDetection Pval" % n
+                                        for n in names) + "\n")
+        for i in range(n_probes):
+            fh.write("ILMN_%d\t%s\n" % (i, pool[i % len(pool)]))
+    return(titles)
+
+
+def write_sample_annotation(fname, titles, study="GSE28405",
+                            platform="GPL2700"):
+    """
+    Writes a sample annotation table with the given sample titles
+    """
+    with open_out(fname) as fh:
+        fh.write("Sample_series_id\tSample_geo_accession\tSample_platform_id"
+                 "\tSample_title\tClass\n")
+        for i, title in enumerate(titles):
+            fh.write("%s\tGSM%d\t%s\t%s\t%s\n" %
+                     (study, 700000 + i, platform, title,
+                      "Control" if title.startswith("Control") else "Dengue"))
+
+
+def write_reannotation(fname, n_rows, seed=42, platforms=PLATFORMS):
+    """
+    Writes a reannotation table (annotation_long.tsv layout): Probe,
+    Platform, Gene, Hits, NumAnnot, Chr and Start
+    """
+    rnd = random.Random(seed)
+    with open_out(fname) as fh:
+        fh.write("Probe\tPlatform\tGene\tHits\tNumAnnot\tChr\tStart\n")
+        for i in range(n_rows):
+            fh.write("%d_at\t%s\tENSG%011d\t%d\t%d\tchr%d\t%d\n" %
+                     (i, rnd.choice(platforms), rnd.randrange(20000),
+                      rnd.choice((1, 1, 2)), rnd.choice((1, 1, 3)),
+                      rnd.randint(1, 22), rnd.randrange(10**8)))
+
+
+def write_edges(fname, n_nodes, n_edges, seed=42):
+    """
+    Writes a joined CEMiTool edge table (Gene1, Gene2, Sum between 1 and 4)
+    """
+    rnd = random.Random(seed)
+    with open_out(fname) as fh:
+        fh.write("Gene1\tGene2\tSum\n")
+        for i in range(n_edges):
+            fh.write("ENSG%011d\tENSG%011d\t%d\n" %
+                     (rnd.randrange(n_nodes), rnd.randrange(n_nodes),
+                      rnd.randint(1, 4)))
+
+
+def write_soft(fname, n_samples, n_fields):
+    """
+    Writes a series SOFT document with n_samples ^SAMPLE blocks
+    """
+    with open_out(fname) as fh:
+        for i in range(n_samples):
+            fh.write("^SAMPLE = GSM%d\n" % i)
+            fh.write("!Sample_title = Sample %d\n" % i)
+            fh.write("!Sample_geo_accession = GSM%d\n" % i)
+            fh.write("!Sample_series_id = GSE1\n")
+            for j in range(n_fields):
+                fh.write("!Sample_characteristics_ch1 = field %d: %d\n" % (j, i))
+
+
+def gene_names(n_genes):
+    return(["GENE%d" % i for i in range(n_genes)])
+
+
+def write_gmt(fname, n_sets, n_genes, min_size=5, max_size=300, seed=42):
+    """
+    Writes a GMT file of n_sets random gene sets over n_genes genes
+    """
+    rnd = random.Random(seed)
+    genes = gene_names(n_genes)
+    with open_out(fname) as fh:
+        for i in range(n_sets):
+            size = min(rnd.randint(min_size, max_size), n_genes)
+            fh.write("SET%d\thttp://example.org/SET%d\t%s\n" %
+                     (i, i, "\t".join(rnd.sample(genes, size))))
+
+
+def write_gene_list(fname, n_genes, size, seed=42):
+    """
+    Writes a list of size random genes, one per line
+    """
+    rnd = random.Random(seed)
+    with open_out(fname) as fh:
+        fh.write("\n".join(rnd.sample(gene_names(n_genes), size)) + "\n")
@@ -11,7 +11,10 @@ for cdir in results/correlation/bygene results/correlation/byprobe; do
 done
 
 # Calcula correlacao
-parallel -j 4 "src/microarrayAnalysis/cor_lnc.R --ovlp config/reannotation/ovlp_lnc.tsv --exp {} --output results/correlation/byprobe/{/} --method spearman 2> log/correlation/correlation_{/.}.txt" ::: data/processed/filtered/GSE*.tsv || { echo "Unable to calculate correlation between lncRNAs e mRNAs"; exit 1; }
+for exp in data/processed/filtered/GSE*.tsv; do
+	study=$(basename $exp .tsv)
+	src/microarrayAnalysis/cor_lnc.py pairs --ovlp config/reannotation/ovlp_lnc.tsv --exp $exp --output results/correlation/byprobe/$study.tsv --method spearman 2> log/correlation/correlation_$study.txt || { echo "Unable to calculate correlation between lncRNAs e mRNAs"; exit 1; }
+done
 
 # Junta correlacao dos 4 estudos
 R CMD BATCH src/join_corr.R || { echo "Unable to join correlation"; exit 1; }
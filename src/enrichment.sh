@@ -33,11 +33,9 @@ csvgrep -t -i -c HasDiscordantDEGs -m "TRUE" results/joined_DEG.tsv |  # get onl
 
 parallel "sort {} | uniq > results/joined_degs/genes/{/}" ::: tmp/joined_degs/*.txt || { echo "Unable to sort and write DEG list"; exit 1; }
 
-for database in config/pathways/*.gmt; do
-    db=$(basename $database .gmt)
-	echo "Running do_ora for the BTMs ..."
-	parallel -j 20 "src/microarrayAnalysis/do_ora.R results/enrichment/do_ora/$db/{/.}.tsv --genes {} --gmt ${database}" ::: results/joined_degs/genes/*.txt || { echo "Unable to run ORA for $db"; exit 1; }
-done
+gmts=$(ls config/pathways/*.gmt | sed "s/^/--gmt=/" | tr "\n" " ")
+echo "Running ORA for all pathway databases ..."
+src/microarrayAnalysis/ora.py $gmts --output "results/enrichment/do_ora/{gmt}/{list}.tsv" results/joined_degs/genes/*.txt || { echo "Unable to run ORA"; exit 1; }
 
 
 #echo "Getting all genesets in enrichr ..."
@@ -16,16 +16,14 @@ done
 # pegar somente hits unicos ( Hits == 1 )
 # pegar somente anotacao unica (NumAnnot == 1)
 # pegar somente coluna de Probe e Gene 
-echo "Getting reannotation for GPL2700 ..."
-src/get_annotation.py --reannotation config/reannotation/annotation_long.tsv --platform GPL2700 > tmp/reannotation_GPL2700.tsv || { echo "Unable to get annotation for GPL2700"; exit 1; }
+echo "Getting reannotation for GPL2700 and GPL570 ..."
+src/get_annotation.py --reannotation config/reannotation/annotation_long.tsv --platform GPL2700 --platform GPL570 --out-dir tmp || { echo "Unable to get annotation for GPL2700 and GPL570"; exit 1; }
 echo "Annotating GSE13052 ..."
 src/microarrayAnalysis/annotate_probes.R data/processed/normalized/GSE13052.tsv data/processed/annotated/GSE13052.tsv --annotation-file=tmp/reannotation_GPL2700.tsv || { echo "Unable to annotate probes for GSE13052"; exit 1; }
 echo "Annotating GSE28405 ..."
 src/microarrayAnalysis/annotate_probes.R data/processed/normalized/GSE28405.tsv data/processed/annotated/GSE28405.tsv --annotation-file=tmp/reannotation_GPL2700.tsv || { echo "Unable to annotate probes for GSE28405"; exit 1; }
 
 # GPL570
-echo "Getting reannotation for GPL570 ..."
-src/get_annotation.py --reannotation config/reannotation/annotation_long.tsv --platform GPL570 > tmp/reannotation_GPL570.tsv || { echo "Unable to get annotation for GPL570"; exit 1; }
 echo "Annotating GSE43777 ..."
 src/microarrayAnalysis/annotate_probes.R data/processed/normalized/GSE43777.tsv data/processed/annotated/GSE43777.tsv --annotation-file=tmp/reannotation_GPL570.tsv || { echo "Unable to annotate probes for GSE43777"; exit 1; }
 echo "Annotating GSE51808 ..."
@@ -38,11 +36,17 @@ src/microarrayAnalysis/annotate_probes.R data/processed/normalized/GSE51808.tsv
 # Filter
 echo "Filtering ..."
 
-parallel -j 10 "src/microarrayAnalysis/filter.R {} data/processed/filtered/{/} --method=mean --prop=0.8 --annotation-cols ProbeName --annotation-cols=Symbol" ::: data/processed/annotated/GSE*.tsv || { echo "Unable to filter expression data by mean"; exit 1; }
+parallel -j 10 "src/microarrayAnalysis/filter.py {} data/processed/filtered/{/} --method=mean --prop=0.8 --annotation-cols ProbeName --annotation-cols=Symbol" ::: data/processed/annotated/GSE*.tsv || { echo "Unable to filter expression data by mean"; exit 1; }
 
 # Collapse
 echo "Collapsing ..."
 
-parallel -j 10 "src/microarrayAnalysis/collapse.R {} data/processed/collapsed/{/} --by-col=Symbol --method=maxmean --annotation-cols=ProbeName --annotation-cols=Symbol" ::: data/processed/filtered/GSE*.tsv || { echo "Unable to collapse data"; exit 1; }
+parallel -j 10 "src/microarrayAnalysis/collapse.py {} data/processed/collapsed/{/} --by-col=Symbol --method=maxmean --annotation-cols=ProbeName --annotation-cols=Symbol" ::: data/processed/filtered/GSE*.tsv || { echo "Unable to collapse data"; exit 1; }
+
+# Matrix stores
+echo "Building matrix stores ..."
+
+parallel -j 10 "src/microarrayAnalysis/matrixstore.py build {} --annotation-cols=ProbeName --annotation-cols=Symbol" ::: data/processed/filtered/GSE*.tsv || { echo "Unable to build matrix stores of filtered data"; exit 1; }
+parallel -j 10 "src/microarrayAnalysis/matrixstore.py build {} --annotation-cols=Symbol" ::: data/processed/collapsed/GSE*.tsv || { echo "Unable to build matrix stores of collapsed data"; exit 1; }
 
 echo "Done."
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-for cdir in log data/raw_data data/geo_raw/author data/geo_raw/supplemental_data data/geo_raw/raw_data data/geo_raw/sample_annotation data/geo_raw/probe_annotation; do
+for cdir in log/getdata data/raw_data data/geo_raw/author data/geo_raw/supplemental_data data/geo_raw/series_matrix data/geo_raw/raw_data data/geo_raw/sample_annotation data/geo_raw/probe_annotation; do
 	echo "Creating $cdir ..."
 	if [ -d $cdir ]; then
 		echo "$cdir already exists !"
@@ -11,23 +11,29 @@ for cdir in log data/raw_data data/geo_raw/author data/geo_raw/supplemental_data
 done
 
 
+# Series matrices and supplementary files, downloaded concurrently, resumed
+# when interrupted and recorded in data/geo_raw/manifest.json (files already
+# downloaded are not downloaded again)
+echo "Downloading series matrices and supplementary files ..."
+src/microarrayAnalysis/geo_download.py GSE43777 GSE51808 GSE13052 GSE28405 --matrix-dir=data/geo_raw/series_matrix/ --sup-dir=data/geo_raw/supplemental_data/ --manifest=data/geo_raw/manifest.json 2> log/getdata/geo_download.log || { echo "Unable to download files from GEO"; exit 1; }
+
 # $? eh o status do ultimo comando
 GetGEO() {
-	echo "Downloading $1 ..."
-	src/microarrayAnalysis/get_geo.R $1 $2 --author-dir=data/geo_raw/author/ --sup-dir=data/geo_raw/supplemental_data/ --sample-annot-dir=data/geo_raw/sample_annotation/ --probe-annot-dir=data/geo_raw/probe_annotation/ --raw-dir=data/geo_raw/raw_data/ 1>&2 2> log/getdata/get_geo_$1.log 
-	while [ $? -ne 0 ]; do
+	echo "Getting $1 ..."
+	for try in 1 2 3; do
+		src/microarrayAnalysis/get_geo.R $1 $2 --author-dir=data/geo_raw/author/ --sup-dir=data/geo_raw/supplemental_data/ --sample-annot-dir=data/geo_raw/sample_annotation/ --probe-annot-dir=data/geo_raw/probe_annotation/ --raw-dir=data/geo_raw/raw_data/ --matrix-dir=data/geo_raw/series_matrix/ --no-sup-download 1>&2 2> log/getdata/get_geo_$1.log
+		[ $? -eq 0 ] && return 0
 		echo "Trying again ..."
-		src/microarrayAnalysis/get_geo.R $1 $2 --author-dir=data/geo_raw/author/ --sup-dir=data/geo_raw/supplemental_data/ --sample-annot-dir=data/geo_raw/sample_annotation/ --probe-annot-dir=data/geo_raw/probe_annotation/ --raw-dir=data/geo_raw/raw_data/ 1>&2 2> log/getdata/get_geo_$1.log 
-	done	
+	done
+	return 1
 }
 
 
-GetGEO GSE43777 GPL570 
-GetGEO GSE51808 GPL13158 
-GetGEO GSE13052 GPL2700
-GetGEO GSE28405 GPL2700
+GetGEO GSE43777 GPL570 || { echo "Unable to get GSE43777"; exit 1; }
+GetGEO GSE51808 GPL13158 || { echo "Unable to get GSE51808"; exit 1; }
+GetGEO GSE13052 GPL2700 || { echo "Unable to get GSE13052"; exit 1; }
+GetGEO GSE28405 GPL2700 || { echo "Unable to get GSE28405"; exit 1; }
 
-src/getDataGSE28405.py data/raw_data/GSE28405_detection_pval.tsv data/raw_data/GSE28405_signal.tsv data/raw_data/GSE28405_samplename2gsm.tsv || { echo "Unable to extract data for GSE28405"; exit 1; }
-src/getDataGSE13052.py data/raw_data/GSE13052_detection_pval.tsv data/raw_data/GSE13052_signal.tsv data/raw_data/GSE13052_samplename2gsm.tsv || { echo "Unable to extract data for GSE13052"; exit 1; }
+src/getSupplementaryData.py --studies config/studies.tsv --out-dir data/raw_data || { echo "Unable to extract supplementary data"; exit 1; }
 
 echo "getData.sh Done."
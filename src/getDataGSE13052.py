@@ -1,76 +1,140 @@
 #!/usr/bin/env python3
 # vim:fileencoding=utf8
 
+"""Split GSE13052 raw data in signal and detection p-value tables
+
+Only the first sheet of the workbook is loaded and only the probe,
+AVG_Signal-* and Detection-* columns are converted. These columns are cached
+in --cache-dir keyed by the hash of the workbook, so reruns on an unchanged
+workbook do not parse the XLS file again.
+
+Usage:
+  getDataGSE13052.py <detection_pval_file> <expression_file> <sample2gsm_file> [--cache-dir=<dir> | --no-cache]
+  getDataGSE13052.py (-h | --help)
+
+Options:
+  -h --help                Show this screen.
+  --cache-dir=<dir>        directory of the extracted columns cache [default: tmp/cache]
+  --no-cache               always parse the workbook
+"""
+
 __author__ = "Matheus Carvalho Bürger"
 __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
-import xlrd
+from docopt import docopt
+import os
 import sys
 
-if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        sys.exit('Usage: %s <detection_pval_file> <expression_file> <sample2gsm_file>' % sys.argv[0])
-    det_fname = sys.argv[1]
-    signal_fname = sys.argv[2]
-    # sample2gsm
-    s2gsm_fname = sys.argv[3]
-    s2gsm_file = open(s2gsm_fname, "w")
-    # pegar arquivo de anotacao
-    sample_annot_fname = "config/sample_annotation/with_outliers/GSE13052.tsv"
-    with open(sample_annot_fname) as sannot:
-        header = sannot.readline().strip().split("\t")
-        sample_title_idx = header.index("Sample_title")
-        sample_geo_acc_idx = header.index("Sample_geo_accession")
-        to_geo = dict()
-        s2gsm_file.write("SampleName\tGSM\n")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "microarrayAnalysis"))
+import filecache
+import tsvio
+import stagestats
+
+SAMPLE_ANNOT_FNAME = "config/sample_annotation/with_outliers/GSE13052.tsv"
+NON_NORM_FNAME = "data/geo_raw/supplemental_data/GSE13052/GSE13052_illumina_raw.xls"
+PREFIXES = ("AVG_Signal-", "Detection-")
+
+
+def get_sample_names(sample_annot_fname, s2gsm_fname):
+    """
+    Reads the sample annotation, writes the SampleName -> GSM table and
+    returns it as a dictionary
+    """
+    to_geo = dict()
+    with tsvio.open_tsv(sample_annot_fname) as sannot, \
+            tsvio.TsvWriter(s2gsm_fname, ["SampleName", "GSM"]) as s2gsm_file:
         # ler arquivo e guardar as colunas Sample_title e Sample_geo_accession
-        for line in sannot:
-            line = line.strip("\n")
-            values = line.split("\t")
-            sample_name = values[sample_title_idx].split("-")[-1]
-            s2gsm_file.write(sample_name+"\t"+values[sample_geo_acc_idx]+"\n")
-            to_geo[sample_name] = values[sample_geo_acc_idx]
-    s2gsm_file.close()
-
-    # pegar arquivo bruto GSE13052_illumina_raw.xls
-    non_norm_fname = "data/geo_raw/supplemental_data/GSE13052/GSE13052_illumina_raw.xls"
-    # abre arquivos de output
-    detection_file = open(det_fname, "w")
-    signal_file = open(signal_fname, "w")
-    tab = xlrd.open_workbook(non_norm_fname)
-    ws = tab.sheet_by_index(0)
-    num_rows = ws.nrows
-    curr_row = 1
-    header = [str(v.value) for v in ws.row(0)]
+        rows = tsvio.TsvReader(sannot).rows(["Sample_title",
+                                             "Sample_geo_accession"])
+        for title, gsm in rows:
+            sample_name = title.split("-")[-1]
+            s2gsm_file.write_row((sample_name, gsm))
+            to_geo[sample_name] = gsm
+    return(to_geo)
+
+
+def read_workbook(xls_fname):
+    """
+    Returns the header and the columns (as strings) of the probe column and
+    of the AVG_Signal-* and Detection-* columns of the first sheet
+    """
+    import xlrd
+    tab = xlrd.open_workbook(xls_fname, on_demand=True)
+    try:
+        ws = tab.sheet_by_index(0)
+        header = [str(v) for v in ws.row_values(0)]
+        indexes = [0] + [i for i, h in enumerate(header) if h.startswith(PREFIXES)]
+        columns = [[str(v) for v in ws.col_values(i, start_rowx=1)]
+                   for i in indexes]
+    finally:
+        tab.release_resources()
+    return([header[i] for i in indexes], columns)
+
+
+def write_columns(fname, header, columns):
+    with filecache.atomic_write(fname, "w") as fh, \
+            tsvio.TsvWriter(fh, header) as out:
+        out.write_rows(zip(*columns))
+
+
+def read_columns(fname):
+    with tsvio.open_tsv(fname) as fh:
+        reader = tsvio.TsvReader(fh)
+        rows = list(reader.rows())
+    columns = [list(col) for col in zip(*rows)] or [[] for h in reader.header]
+    return(reader.header, columns)
+
+
+def get_columns(xls_fname, cache_dir=None):
+    """
+    read_workbook with a cache keyed by the workbook's hash
+    """
+    if not cache_dir:
+        return(read_workbook(xls_fname))
+    name = os.path.basename(xls_fname)
+    digest = filecache.file_digest(xls_fname, cache_dir)
+    cache_fname = filecache.cache_path("xls", name, digest, ".tsv", cache_dir)
+    if os.path.exists(cache_fname):
+        return(read_columns(cache_fname))
+    header, columns = read_workbook(xls_fname)
+    write_columns(cache_fname, header, columns)
+    filecache.remove_stale(cache_fname, "xls", name, cache_dir)
+    return(header, columns)
+
+
+def split_raw(xls_fname, to_geo, det_fname, signal_fname, cache_dir=None):
+    """
+    Writes the detection p-value and signal tables with GSMs as column names
+    """
+    header, columns = get_columns(xls_fname, cache_dir)
+    probes = columns[0]
     signal_gsms = []
     pval_gsms = []
-    signal_indexes = []
-    pval_indexes = []
-    for i, h in enumerate(header):
+    signal_cols = []
+    pval_cols = []
+    for h, col in zip(header, columns):
         if h.startswith("AVG_Signal-"):
             sample_name = h.replace("AVG_Signal-", "")
-            gsm = to_geo[sample_name]
-            signal_gsms.append(gsm)
-            signal_indexes.append(i)
+            signal_gsms.append(to_geo[sample_name])
+            signal_cols.append(col)
         if h.startswith("Detection-"):
             sample_name = h.replace("Detection-", "")
-            gsm = to_geo[sample_name]
-            pval_gsms.append(gsm)
-            pval_indexes.append(i)
-    signal_file.write("ProbeName\t"+"\t".join(signal_gsms)+"\n")
-    detection_file.write("ProbeName\t"+"\t".join(pval_gsms)+"\n")
-    while curr_row < num_rows:
-        row = ws.row(curr_row)
-        str_row = [str(v.value) for v in row]
-        # get and print signal values
-        signal_values = [str_row[idx] for idx in signal_indexes]
-        signal_values.insert(0, str_row[0])
-        signal_file.write("\t".join(signal_values)+"\n")
-        # get and print detection p-values
-        detection_values = [str_row[idx] for idx in pval_indexes]
-        detection_values.insert(0, str_row[0])
-        detection_file.write("\t".join(detection_values)+"\n")
-        curr_row += 1
-    detection_file.close()
-    signal_file.close()
+            pval_gsms.append(to_geo[sample_name])
+            pval_cols.append(col)
+    for fname, gsms, cols in ((signal_fname, signal_gsms, signal_cols),
+                              (det_fname, pval_gsms, pval_cols)):
+        with tsvio.TsvWriter(fname, ["ProbeName"] + gsms) as out:
+            out.write_rows(zip(probes, *cols))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    stagestats.track()
+    det_fname = args["<detection_pval_file>"]
+    signal_fname = args["<expression_file>"]
+    s2gsm_fname = args["<sample2gsm_file>"]
+    to_geo = get_sample_names(SAMPLE_ANNOT_FNAME, s2gsm_fname)
+    cache_dir = None if args["--no-cache"] else args["--cache-dir"]
+    split_raw(NON_NORM_FNAME, to_geo, det_fname, signal_fname, cache_dir)
@@ -1,89 +1,170 @@
 #!/usr/bin/env python3
 # vim:fileencoding=utf8
 
+"""Split GSE28405 non-normalized data in signal and detection p-value tables
+
+The signal and Detection Pval columns of each line of the supplementary file
+are picked with one itemgetter call each and joined back into lines, written
+in blocks of --chunk-size lines (values are copied as they are, without
+conversion), so memory depends only on the chunk size. With --binary the
+tables are also written as float32 row-major matrices (<table>.f32) with the
+probe (<table>.rows.txt) and sample (<table>.cols.txt) index files.
+
+Usage:
+  getDataGSE28405.py <detection_pval_file> <expression_file> <sample2gsm_file> [--binary] [--chunk-size=<n>]
+  getDataGSE28405.py (-h | --help)
+
+Options:
+  -h --help                Show this screen.
+  --binary                 also write float32 binary matrices
+  --chunk-size=<n>         number of rows read at once [default: 10000]
+"""
+
 __author__ = "Matheus Carvalho Bürger"
 __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
+from docopt import docopt
+from operator import itemgetter
+import numpy as np
+import os
 import re
-import gzip
 import sys
 
-if __name__ == "__main__":
-    # parametros
-    if len(sys.argv) < 4:
-            sys.exit('Usage: %s <detection_pval_file> <expression_file> <sample2gsm_file>' % sys.argv[0])
-    # det_fname = "detection_pvalue.tsv"
-    det_fname = sys.argv[1]
-    # signal_fname = "expression.tsv"
-    signal_fname = sys.argv[2]
-    # sample2gsm
-    s2gsm_fname = sys.argv[3]
-    s2gsm_file = open(s2gsm_fname, "w")
-    # pegar arquivo de anotacao
-    sample_annot_fname = "config/sample_annotation/with_outliers/GSE28405.tsv"
-    control_re = re.compile("Control_sample\s+(?P<n>\d+)")
-    patient_re = re.compile("Patient_Timepoint(?P<time>\d+)\s+(?P<pat>\d+)")
-    with open(sample_annot_fname) as sannot:
-        header = sannot.readline().strip().split("\t")
-        sample_title_idx = header.index("Sample_title")
-        sample_geo_acc_idx = header.index("Sample_geo_accession")
-        to_geo = dict()
-        s2gsm_file.write("SampleName\tGSM\n")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "microarrayAnalysis"))
+import tsvio
+import stagestats
+
+SAMPLE_ANNOT_FNAME = "config/sample_annotation/with_outliers/GSE28405.tsv"
+NON_NORM_FNAME = "data/geo_raw/supplemental_data/GSE28405/GSE28405_non-normalized.txt.gz"
+
+
+def get_sample_names(sample_annot_fname, s2gsm_fname):
+    """
+    Reads the sample annotation, writes the SampleName -> GSM table and
+    returns it as a dictionary
+    """
+    control_re = re.compile(r"Control_sample\s+(?P<n>\d+)")
+    patient_re = re.compile(r"Patient_Timepoint(?P<time>\d+)\s+(?P<pat>\d+)")
+    to_geo = dict()
+    with tsvio.open_tsv(sample_annot_fname) as sannot, \
+            tsvio.TsvWriter(s2gsm_fname, ["SampleName", "GSM"]) as s2gsm_file:
         # ler arquivo e guardar as colunas Sample_title e Sample_geo_accession
-        for line in sannot:
-            line = line.strip("\n")
-            values = line.split("\t")
+        rows = tsvio.TsvReader(sannot).rows(["Sample_title",
+                                             "Sample_geo_accession"])
+        for title, gsm in rows:
             # Pegar Sample_name que sera chave e Sample_geo_accession sera valor
             # Se Control_sample\s+(?P<n>\d+)
-            mtch = control_re.search(values[sample_title_idx])
+            mtch = control_re.search(title)
             if mtch:
                 # Sample_name sera C\n
                 sample_name = "C"+mtch.group("n")
             else:
                 # Senão - .*Patient_Timepoint(?P<time>\d+)\s+(?P<pat>\d+)
-                mtch = patient_re.search(values[sample_title_idx])
+                mtch = patient_re.search(title)
                 if mtch:
                     # Sample_name sera P\patT\time
                     sample_name = "P" + mtch.group("pat") + \
                         "T" + mtch.group("time")
                 else:  # panic
                     raise Exception("Sample title do not follow the pattern.")
-            s2gsm_file.write(sample_name+"\t"+values[sample_geo_acc_idx]+"\n")
-            to_geo[sample_name] = values[sample_geo_acc_idx]
-    s2gsm_file.close()
-
-    # pegar arquivo GSE28405_non-normalized.txt.gz
-    non_norm_fname = "data/geo_raw/supplemental_data/GSE28405/GSE28405_non-normalized.txt.gz"
-    # descompacta-lo
-    # ler e ignorar linhas ate chegar em ^ID_REF esse é o header
-    detection_file = open(det_fname, "w")
-    signal_file = open(signal_fname, "w")
-    with gzip.open(non_norm_fname) as non_norm:
-        header = ""
+            s2gsm_file.write_row((sample_name, gsm))
+            to_geo[sample_name] = gsm
+    return(to_geo)
+
+
+class MatrixWriter():
+    """
+    Writes a probes x samples table as TSV and, optionally, as a float32
+    binary matrix with index files
+    """
+    def __init__(self, fname, samples, binary=False):
+        self.tsv = tsvio.open_tsv(fname, "w")
+        self.tsv.write("\t".join(["ProbeName"] + samples) + "\n")
+        self.binary = binary
+        if binary:
+            base = os.path.splitext(fname)[0]
+            with open(base + ".cols.txt", "w") as cols:
+                cols.write("\n".join(samples) + "\n")
+            self.f32 = open(base + ".f32", "wb")
+            self.rows = open(base + ".rows.txt", "w")
+
+    def write(self, lines):
+        """
+        Writes a block of lines (tab separated values, the probe first,
+        without the line break)
+        """
+        if not lines:
+            return
+        self.tsv.write("\n".join(lines) + "\n")
+        tsvio.rows_written += len(lines)
+        if self.binary:
+            block = np.array([line.split("\t") for line in lines])
+            values = np.where(block[:, 1:] == "", "nan", block[:, 1:])
+            values.astype(np.float32).tofile(self.f32)
+            self.rows.write("\n".join(block[:, 0].tolist()) + "\n")
+
+    def close(self):
+        self.tsv.close()
+        if self.binary:
+            self.f32.close()
+            self.rows.close()
+
+
+def split_non_normalized(non_norm_fname, to_geo, det_fname, signal_fname,
+                         binary=False, chunk_size=10000):
+    """
+    Splits the non-normalized file in detection p-value and signal tables
+    Columns named 'Detection Pval' are p-values of the sample in the column
+    before them, other named columns are signal
+    """
+    with tsvio.open_tsv(non_norm_fname) as non_norm:
+        # ler e ignorar linhas ate chegar em ^ID_REF esse é o header
         for line in non_norm:
-            line = line.decode("utf-8").strip()
-            values = line.split("\t")
-            if header:
-                signal_values = [values[n] for n in non_det]
-                signal_values.insert(0, values[0])
-                signal_file.write("\t".join(signal_values)+"\n")
-                det_values = [values[d] for d in det]
-                det_values.insert(0, values[0])
-                detection_file.write("\t".join(det_values)+"\n")
-            if not header and values[0] == "ID_REF":
-                header = values
-                det = [i for i, v in enumerate(header) if v == 'Detection Pval']
-                non_det = set(range(1, len(header))) - set(det)
-                non_det = [n for n in non_det if header[n]]  # remove vazios
-
-                signal_header = [to_geo[header[n]] for n in non_det]
-                signal_header.insert(0, "ProbeName")
-                signal_file.write("\t".join(signal_header)+"\n")
-                det_header = [to_geo[header[d-1]] for d in det]
-                det_header.insert(0, "ProbeName")
-                detection_file.write("\t".join(det_header)+"\n")
-    detection_file.close()
-    signal_file.close()
+            header = line.strip().split("\t")
+            if header[0] == "ID_REF":
+                break
+        else:
+            raise Exception("ID_REF header not found in %s" % non_norm_fname)
+        det = [i for i, v in enumerate(header) if v == 'Detection Pval']
+        non_det = set(range(1, len(header))) - set(det)
+        non_det = [n for n in sorted(non_det) if header[n]]  # remove vazios
+        signal = MatrixWriter(signal_fname, [to_geo[header[n]] for n in non_det],
+                              binary)
+        detection = MatrixWriter(det_fname, [to_geo[header[d-1]] for d in det],
+                                 binary)
+        get_signal = itemgetter(0, *non_det)
+        get_det = itemgetter(0, *det)
+        signal_lines = []
+        det_lines = []
+        for line in non_norm:
+            values = line.strip().split("\t")
+            if values == [""]:
+                continue
+            signal_lines.append("\t".join(get_signal(values)))
+            det_lines.append("\t".join(get_det(values)))
+            if len(signal_lines) == chunk_size:
+                tsvio.rows_read += len(signal_lines)
+                signal.write(signal_lines)
+                detection.write(det_lines)
+                signal_lines = []
+                det_lines = []
+        tsvio.rows_read += len(signal_lines)
+        signal.write(signal_lines)
+        detection.write(det_lines)
+        signal.close()
+        detection.close()
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    stagestats.track()
+    det_fname = args["<detection_pval_file>"]
+    signal_fname = args["<expression_file>"]
+    s2gsm_fname = args["<sample2gsm_file>"]
     # descobrir o Sample_geo_accession de cada coluna
+    to_geo = get_sample_names(SAMPLE_ANNOT_FNAME, s2gsm_fname)
     # Imprimir tabelas de detection_pval e expression
+    split_non_normalized(NON_NORM_FNAME, to_geo, det_fname, signal_fname,
+                         args["--binary"], int(args["--chunk-size"]))
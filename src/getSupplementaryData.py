@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Extract signal and detection p-value tables from supplementary files
+
+Each study in the studies table (config/studies.tsv) names in its Extractor
+column the layout of its supplementary data (NA if there is nothing to
+extract). Layouts are registered with @register; a layout that is not
+registered is an error (the other studies are still extracted). Studies are
+extracted concurrently, each one writing to --out-dir:
+<GEO>_detection_pval.tsv, <GEO>_signal.tsv and <GEO>_samplename2gsm.tsv.
+
+Usage:
+  getSupplementaryData.py [--studies=<file>] [--sample-annot-dir=<dir>] [--sup-dir=<dir>] [--out-dir=<dir>] [--cores=<n>] [<geo-id>...]
+  getSupplementaryData.py --list
+  getSupplementaryData.py (-h | --help)
+
+Options:
+  -h --help                   Show this screen.
+  --list                      list the registered layouts
+  --studies=<file>            studies table [default: config/studies.tsv]
+  --sample-annot-dir=<dir>    sample annotation directory [default: config/sample_annotation/with_outliers]
+  --sup-dir=<dir>             supplementary data directory [default: data/geo_raw/supplemental_data]
+  --out-dir=<dir>             output directory [default: data/raw_data]
+  --cores=<n>                 number of processes, all cores by default
+  <geo-id>                    extract only these studies
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from docopt import docopt
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "microarrayAnalysis"))
+import tsvio
+import stagestats
+
+EXTRACTORS = {}
+
+
+def register(layout, pattern):
+    """
+    Decorator that registers an extractor for a supplementary data layout
+    pattern is the glob (inside the study's supplementary directory) of the
+    file the extractor reads
+    The extractor is called as func(study, sample_annot_fname, input_fname,
+    det_fname, signal_fname, s2gsm_fname)
+    """
+    def decorator(func):
+        EXTRACTORS[layout] = (pattern, func)
+        return(func)
+    return(decorator)
+
+
+@register("illumina_gz_pval", "*_non-normalized.txt.gz")
+def extract_illumina_gz_pval(study, sample_annot_fname, input_fname,
+                             det_fname, signal_fname, s2gsm_fname):
+    """
+    Gzipped TSV, each sample column followed by a 'Detection Pval' column
+    (GSE28405)
+    """
+    import getDataGSE28405
+    to_geo = getDataGSE28405.get_sample_names(sample_annot_fname, s2gsm_fname)
+    getDataGSE28405.split_non_normalized(input_fname, to_geo, det_fname,
+                                         signal_fname)
+
+
+@register("illumina_xls_prefixed", "*_illumina_raw.xls")
+def extract_illumina_xls_prefixed(study, sample_annot_fname, input_fname,
+                                  det_fname, signal_fname, s2gsm_fname):
+    """
+    XLS workbook with AVG_Signal-<sample> and Detection-<sample> columns
+    (GSE13052)
+    """
+    import getDataGSE13052
+    to_geo = getDataGSE13052.get_sample_names(sample_annot_fname, s2gsm_fname)
+    getDataGSE13052.split_raw(input_fname, to_geo, det_fname, signal_fname,
+                              getDataGSE13052.filecache.DEFAULT_DIR)
+
+
+def read_studies(studies_fname):
+    """
+    Returns a list of (GEO, layout) from the studies table
+    """
+    with tsvio.open_tsv(studies_fname) as studies:
+        rows = tsvio.TsvReader(studies).rows(["GEO", "Extractor"])
+        return([(geo, layout) for geo, layout in rows])
+
+
+def extract(study, layout, sample_annot_dir, sup_dir, out_dir):
+    """
+    Runs the extractor registered for layout on a study
+    """
+    pattern, func = EXTRACTORS[layout]
+    inputs = sorted(glob.glob(os.path.join(sup_dir, study, pattern)))
+    if len(inputs) != 1:
+        raise Exception("Expected one file %s for %s, found %d" %
+                        (pattern, study, len(inputs)))
+    func(study, os.path.join(sample_annot_dir, study + ".tsv"), inputs[0],
+         os.path.join(out_dir, study + "_detection_pval.tsv"),
+         os.path.join(out_dir, study + "_signal.tsv"),
+         os.path.join(out_dir, study + "_samplename2gsm.tsv"))
+    return(study)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    stagestats.track()
+    if args["--list"]:
+        for layout, (pattern, func) in sorted(EXTRACTORS.items()):
+            print("%s\t%s" % (layout, pattern))
+        sys.exit(0)
+    jobs = []
+    failed = []
+    for study, layout in read_studies(args["--studies"]):
+        if args["<geo-id>"] and study not in args["<geo-id>"]:
+            continue
+        if layout == "NA":
+            continue
+        if layout not in EXTRACTORS:
+            print("No extractor for %s (unknown layout %s, see --list)" %
+                  (study, layout), file=sys.stderr)
+            failed.append(study)
+            continue
+        jobs.append((study, layout))
+    os.makedirs(args["--out-dir"], exist_ok=True)
+    cores = int(args["--cores"]) if args["--cores"] else None
+    with ProcessPoolExecutor(max_workers=cores) as pool:
+        futures = {pool.submit(extract, study, layout,
+                               args["--sample-annot-dir"], args["--sup-dir"],
+                               args["--out-dir"]): study
+                   for study, layout in jobs}
+        for future in as_completed(futures):
+            study = futures[future]
+            try:
+                future.result()
+                print("%s extracted" % study, file=sys.stderr)
+            except Exception as e:
+                print("Unable to extract data for %s: %s" % (study, e),
+                      file=sys.stderr)
+                failed.append(study)
+    if failed:
+        sys.exit(1)
@@ -3,8 +3,18 @@
 
 """Get Sample Annotation
 
+The rows with Hits == 1 and NumAnnot == 1 are stored once in a SQLite index
+partitioned by Platform and keyed by the hash of the reannotation file, so
+later calls only read the rows of the requested platform. The index is
+rebuilt automatically when the reannotation file changes.
+
+With --out-dir the annotation of several platforms (given with --platform or
+taken from the GPL column of --studies) is written in one pass to
+<out-dir>/reannotation_<GPL>.tsv.
+
 Usage:
-  get_annotation.py --reannotation=<file> --platform=<GPL>
+  get_annotation.py --reannotation=<file> --platform=<GPL> [--index-dir=<dir> | --no-index]
+  get_annotation.py --reannotation=<file> (--platform=<GPL>... | --studies=<file>) --out-dir=<dir> [--index-dir=<dir> | --no-index]
   get_annotation.py (-h | --help)
   get_annotation.py --version
 
@@ -13,6 +23,10 @@ Options:
   --version                Show version.
   --reannotation=<file>    Probe Annotation file
   --platform=<GPL>         Platform ID
+  --studies=<file>         studies table with a GPL column (config/studies.tsv)
+  --out-dir=<dir>          output directory, one file per platform
+  --index-dir=<dir>        directory of the platform index [default: tmp/cache]
+  --no-index               scan the reannotation file instead of using the index
 
 """
 
@@ -21,23 +35,150 @@ __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
 from docopt import docopt
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "microarrayAnalysis"))
+import filecache
+import tsvio
+import stagestats
+
+BATCH_SIZE = 100000
+
+
+def scan_annotation(reannotation_file):
+    """
+    Yields (platform, probe, gene) for the rows with unique hits and unique
+    annotation
+    Only the columns up to the last one needed are split and stripped
+    """
+    def unique(v):
+        return(int(v) == 1)
+    reader = tsvio.TsvReader(reannotation_file)
+    yield from reader.rows(["Platform", "Probe", "Gene"],
+                           where=[("Hits", unique), ("NumAnnot", unique)],
+                           strip=True)
+
+
+def build_index(reannotation_filename, index_fname):
+    """
+    Creates a SQLite database with the table annot(platform, probe, gene)
+    indexed by platform
+    Rows keep the order of the reannotation file
+    The database is built in a temporary file of its own (concurrent builders
+    do not share it) and renamed to index_fname when complete
+    """
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(index_fname) or ".",
+                                     suffix=".tmp")
+    os.close(fd)
+    con = sqlite3.connect(tmp_fname)
+    try:
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute("CREATE TABLE annot (platform TEXT, probe TEXT, gene TEXT)")
+        insert = "INSERT INTO annot VALUES (?, ?, ?)"
+        with tsvio.open_tsv(reannotation_filename) as reannotation_file:
+            batch = []
+            for row in scan_annotation(reannotation_file):
+                batch.append(row)
+                if len(batch) == BATCH_SIZE:
+                    con.executemany(insert, batch)
+                    batch = []
+            con.executemany(insert, batch)
+        con.execute("CREATE INDEX annot_platform ON annot (platform)")
+        con.commit()
+    except:
+        con.close()
+        os.remove(tmp_fname)
+        raise
+    con.close()
+    os.replace(tmp_fname, index_fname)
+
+
+def get_index(reannotation_filename, index_dir):
+    """
+    Returns the path of the index of a reannotation file, building it (and
+    removing indexes of older versions of the file) if needed
+    Indexes are named by the base name and the absolute path of the file, so
+    files with the same name in different directories have their own index
+    """
+    path = os.path.abspath(reannotation_filename)
+    name = "%s.%s" % (os.path.basename(path),
+                      hashlib.sha1(path.encode()).hexdigest()[:12])
+    digest = filecache.file_digest(reannotation_filename, index_dir)
+    index_fname = filecache.cache_path("reannotation", name, digest,
+                                       ".sqlite", index_dir)
+    if not os.path.exists(index_fname):
+        build_index(reannotation_filename, index_fname)
+        filecache.remove_stale(index_fname, "reannotation", name, index_dir)
+    return(index_fname)
+
+
+def query_index(index_fname, platforms):
+    """
+    Yields (platform, probe, gene) for a list of platforms, in file order
+    """
+    con = sqlite3.connect(index_fname)
+    marks = ", ".join("?" * len(platforms))
+    try:
+        cursor = con.execute("SELECT platform, probe, gene FROM annot "
+                             "WHERE platform IN (%s) ORDER BY rowid" % marks,
+                             platforms)
+        yield from cursor
+    finally:
+        con.close()
+
+
+def read_platforms(studies_fname):
+    """
+    Returns the platforms in the GPL column of the studies table
+    """
+    with tsvio.open_tsv(studies_fname) as studies:
+        platforms = [gpl for gpl, in tsvio.TsvReader(studies).rows(["GPL"])]
+    return(list(dict.fromkeys(platforms)))
+
+
+def write_annotation(rows, outs):
+    """
+    Writes (platform, probe, gene) rows to the file handle of each platform
+    Lines are buffered and written in batches
+    """
+    writers = {platform: tsvio.TsvWriter(out, ["ProbeName", "Symbol"],
+                                         BATCH_SIZE)
+               for platform, out in outs.items()}
+    for platform, probe, gene in rows:
+        writer = writers.get(platform)
+        if writer is not None:
+            writer.write_row((probe, gene))
+    for writer in writers.values():
+        writer.close()
+
 
 if __name__ == "__main__":
     args = docopt(__doc__, version='Get annotation')
+    stagestats.track()
     reannotation_filename = args["--reannotation"]
-    platform = args["--platform"]
-    with open(reannotation_filename) as reannotation_file:
-        header = reannotation_file.readline().strip("\n").split("\t")
-        nannot_idx = header.index("NumAnnot")
-        hits_idx = header.index("Hits")
-        platform_idx = header.index("Platform")
-        gene_idx = header.index("Gene")
-        probe_idx = header.index("Probe")
-        # Header
-        print("ProbeName\tSymbol")
-        for line in reannotation_file:
-            line = line.strip("\n")
-            values = [v.strip() for v in line.split("\t")]
-            if int(values[hits_idx]) == 1 and int(values[nannot_idx]) == 1 and \
-                    values[platform_idx] == platform:
-                print("%s\t%s" % (values[probe_idx], values[gene_idx]))
+    if args["--studies"]:
+        platforms = read_platforms(args["--studies"])
+    else:
+        platforms = args["--platform"]
+    if args["--no-index"]:
+        reannotation_file = tsvio.open_tsv(reannotation_filename)
+        rows = scan_annotation(reannotation_file)
+    else:
+        index_fname = get_index(reannotation_filename, args["--index-dir"])
+        rows = query_index(index_fname, platforms)
+    if args["--out-dir"]:
+        os.makedirs(args["--out-dir"], exist_ok=True)
+        outs = {p: open(os.path.join(args["--out-dir"],
+                                     "reannotation_%s.tsv" % p), "w")
+                for p in platforms}
+    else:
+        outs = {platforms[0]: sys.stdout}
+    write_annotation(rows, outs)
+    for out in outs.values():
+        out.close()
@@ -27,7 +27,7 @@ echo "Ensembl to Gene Symbols  ..."
 parallel -j 10 "src/microarrayAnalysis/ensembl2symbol.R --input {} --output tmp/fgsea/annotated/{/} --ensembl-col Symbol"  ::: data/processed/filtered/*.tsv || { echo "Unable to get gene symbols from EnsemblIDs"; exit 1; }
 
 echo "Collapsing by external_gene_name ..."
-parallel -j 10 "src/microarrayAnalysis/collapse.R {} tmp/fgsea/colapsed/{/} --by-col external_gene_name --method maxmean --annotation-cols  hgnc_symbol --annotation-cols ensembl_gene_id --annotation-cols ProbeName" ::: tmp/fgsea/annotated/*.tsv || { echo "Unable to collapse data for GSEA"; exit 1; }
+parallel -j 10 "src/microarrayAnalysis/collapse.py {} tmp/fgsea/colapsed/{/} --by-col external_gene_name --method maxmean --annotation-cols  hgnc_symbol --annotation-cols ensembl_gene_id --annotation-cols ProbeName" ::: tmp/fgsea/annotated/*.tsv || { echo "Unable to collapse data for GSEA"; exit 1; }
 
 echo "Scaling data (row z-score) ..."
 parallel -j 10 "src/microarrayAnalysis/scale.R --expr-file {} --output tmp/fgsea/scaled/{/} --annotation-cols external_gene_name" ::: tmp/fgsea/colapsed/*.tsv || { echo "Unable to calculate Z-score for GSEA"; exit 1; }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Collapse the rows of an expression matrix by a column (probes to genes)
+
+Counterpart of collapse.R: the rows with the same value of --by-col (missing
+values, NA, are dropped) are collapsed into one row by --method:
+
+  maxmean     the row with the largest mean
+  minmean     the row with the smallest mean
+  colMeans    the mean of each column
+  colMedian   the median of each column
+
+The rows are sorted by the --by-col value once (stable), so each group is a
+contiguous block of rows, and every method is a segmented reduction over the
+blocks for all of the groups at once. The output has the --by-col column
+followed by the values (annotation columns are dropped), one row per group
+in sorted order. The groups are sorted by code point (C1QA before C1orf21),
+while collapse.R's tapply sorts them in the collation of the locale, so the
+rows can come in another order than collapse.R's (the values are the same).
+
+Usage:
+  collapse.py INPUT OUTPUT --by-col=<value> [--method=<value>] [--annotation-cols=<value>...]
+  collapse.py (-h | --help)
+  collapse.py --version
+
+Options:
+  INPUT                      the input file containing expression values with samples in columns and genes/probes in rows
+  OUTPUT                     output file
+  -h --help                  show this help message
+  --version                  show program version
+  --annotation-cols=<value>  annotation columns [default: ProbeName]
+  --method=<value>           method (maxmean, minmean, colMedian, colMeans) [default: maxmean]
+  --by-col=<value>           column to group by
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import numpy as np
+from exprio import format_numbers
+import stagestats
+import tsvio
+
+
+def read_matrix(fname, by_col, annotation_cols):
+    """
+    Returns the --by-col values, the names of the value columns and the
+    rows x values matrix (NA as NaN), rows with a missing key are dropped
+    """
+    with tsvio.open_tsv(fname) as fh:
+        reader = tsvio.TsvReader(fh)
+        blocks = list(reader.chunks(size=20000))
+    header = reader.header
+    table = np.concatenate(blocks) if blocks else \
+        np.empty((0, len(header)), dtype=str)
+    by_idx = reader.index([by_col])[0]
+    value_idx = [i for i, c in enumerate(header)
+                 if i != by_idx and c not in annotation_cols]
+    keys = table[:, by_idx]
+    table = table[keys != "NA"]
+    values = table[:, value_idx]
+    try:
+        values = np.where(np.isin(values, ("", "NA")), "nan",
+                          values).astype(float)
+    except ValueError:
+        raise ValueError("Values are not numeric!")
+    return(table[:, by_idx], [header[i] for i in value_idx], values)
+
+
+def group_blocks(keys):
+    """
+    Returns the order that sorts the keys (stable), the first row of each
+    group in this order and the distinct keys
+    """
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) \
+        if len(keys) else np.empty(0, dtype=np.int64)
+    return(order, starts, keys[starts])
+
+
+def pick_by_mean(values, starts, largest=True):
+    """
+    Rows with the largest (or smallest) mean of each group, the first of the
+    group on ties or if every mean is missing
+    """
+    means = values.mean(axis=1)
+    group = np.repeat(np.arange(len(starts)),
+                      np.diff(np.r_[starts, len(values)]))
+    rank = -means if largest else means
+    rank = np.where(np.isnan(rank), np.inf, rank)
+    order = np.lexsort((np.arange(len(values)), rank, group))
+    return(values[order[starts]])
+
+
+def col_medians(values, starts):
+    """
+    Median of each column in each group, NaN if a value is missing
+    """
+    sizes = np.diff(np.r_[starts, len(values)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+    low = starts + (sizes - 1) // 2
+    high = starts + sizes // 2
+    res = np.empty((len(starts), values.shape[1]))
+    for j in range(values.shape[1]):
+        col = values[np.lexsort((values[:, j], group)), j]
+        res[:, j] = (col[low] + col[high]) / 2
+    missing = np.add.reduceat(np.isnan(values), starts, axis=0) > 0 \
+        if len(starts) else np.zeros(res.shape, dtype=bool)
+    res[missing] = np.nan
+    return(res)
+
+
+def collapse(values, starts, method):
+    """
+    Collapses the groups of rows (sorted matrix, a group starts at each
+    position of starts)
+    """
+    if not len(starts):
+        return(np.empty((0, values.shape[1])))
+    if method == "maxmean":
+        return(pick_by_mean(values, starts, True))
+    if method == "minmean":
+        return(pick_by_mean(values, starts, False))
+    if method == "colMeans":
+        sizes = np.diff(np.r_[starts, len(values)])
+        return(np.add.reduceat(values, starts, axis=0) / sizes[:, None])
+    if method in ("colMedian", "median"):
+        return(col_medians(values, starts))
+    raise Exception("Unknown method %s" % method)
+
+
+def main_collapse(in_fname, out_fname, by_col, method="maxmean",
+                  annotation_cols=["ProbeName"]):
+    keys, names, values = read_matrix(in_fname, by_col, annotation_cols)
+    order, starts, groups = group_blocks(keys)
+    res = collapse(values[order], starts, method)
+    columns = [groups.tolist()] + [format_numbers(res[:, j])
+                                   for j in range(res.shape[1])]
+    with tsvio.TsvWriter(out_fname, [by_col] + names) as out:
+        out.write_rows(zip(*columns))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    main_collapse(args["INPUT"], args["OUTPUT"], args["--by-col"],
+                  args["--method"], args["--annotation-cols"])
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Correlation between lncRNAs and coding genes
+
+pairs: correlation of every pair of probes of the lncRNA and coding genes in
+each row of the overlap table (like cor_lnc.R). The overlap table is read in
+chunks of --chunk-size rows, so memory depends on the chunk size and on the
+number of pairs (one p-value each), not on the size of the table. Output
+rows follow the overlap table.
+
+modules: correlation of every lncRNA with every gene in the modules (GMT)
+and with the mean expression of each module, and the number of genes of
+each module correlated with each lncRNA (like lnc_cor_modules.R).
+
+The expression matrix (float64, from the matrix store of the table when it
+is up to date, see matrixstore.py, else parsed from it) is rank transformed
+(spearman) and standardized once, saved as a memory mapped file and shared
+by the --cores processes, which compute the correlations of blocks of pairs
+(or of lncRNAs) as dot products. P-values come from the t distribution with
+n - 2 degrees of freedom (n samples) and are adjusted on all of the pairs at
+once.
+
+Usage:
+  cor_lnc.py pairs --ovlp=<file> --exp=<file> --output=<file> [--method=<value>] [--lnc-col=<value>] [--coding-col=<value>] [--symbol-col=<value>] [--probe-col=<value>] [--correction=<method>] [--annotation-cols=<value>...] [--cores=<n>] [--chunk-size=<n>]
+  cor_lnc.py modules --modules=<file> --expression=<file> --gencode=<file> --biotype=<file> --output-corr=<file> --output-pvalue=<file> --output-padj=<file> --output-stats=<file> [--method=<value>] [--cutoff-cor=<value>] [--cutoff-pvalue=<value>] [--cutoff-padj=<value>] [--ensembl-col=<value>] [--dont-add-others-lncs] [--annotation-cols=<value>...] [--cores=<n>] [--chunk-size=<n>]
+  cor_lnc.py (-h | --help)
+  cor_lnc.py --version
+
+Options:
+  -h --help                   Show this screen.
+  --version                   Show version.
+  --ovlp=<file>               file with overlaps between lncRNAs and coding
+  --exp=<file>                expression file name
+  --output=<file>             output file name
+  --method=<value>            correlation method, pearson or spearman (spearman for pairs and pearson for modules by default)
+  --lnc-col=<value>           column on ovlp containing the lncRNA name [default: lnc_id]
+  --coding-col=<value>        column on ovlp containing the coding [default: mrn_id]
+  --symbol-col=<value>        names should match with lnc_col and coding_col [default: Symbol]
+  --probe-col=<value>         column with probe names [default: ProbeName]
+  --correction=<method>       method of correction p-value (BH, fdr, bonferroni, none) [default: fdr]
+  --annotation-cols=<value>   annotation columns
+  --modules=<file>            a file containing the gene modules (GMT format)
+  --expression=<file>         a expression file (format: TSV)
+  --gencode=<file>            gencode annotation, should have ensembl gene ids and biotype name
+  --biotype=<file>            a file from Gencode database, should have object_type, name and biotype_group
+  --output-corr=<file>        output file to write correlations between lncRNAs and genes in all modules
+  --output-pvalue=<file>      output file to write p-values calculated from correlation values
+  --output-padj=<file>        output file to write adjusted p-values
+  --output-stats=<file>       output file to write results
+  --cutoff-cor=<value>        correlation cutoff [default: 0.6]
+  --cutoff-pvalue=<value>     p-value cutoff [default: 0.05]
+  --cutoff-padj=<value>       adjusted p-value [default: 0.1]
+  --ensembl-col=<value>       column containing ENSEMBL ID [default: Symbol]
+  --dont-add-others-lncs      do not add lncRNAs that are no present in gencode file
+  --cores=<n>                 number of processes, all cores by default
+  --chunk-size=<n>            overlap rows (pairs, 100000 by default) or lncRNAs (modules, 500 by default) per block
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from docopt import docopt
+from itertools import islice
+import numpy as np
+import os
+import re
+import tempfile
+from scipy.special import stdtr
+import exprio
+from exprio import format_numbers, p_adjust, read_gmt
+import tsvio
+import stagestats
+
+PAIRS_CHUNK_SIZE = 100000
+MODULES_CHUNK_SIZE = 500
+
+# standardized expression matrix of each process
+matrix = None
+
+
+def read_expression(fname, annotation_cols):
+    """
+    Returns the annotation columns (dictionary of lists) and the expression
+    matrix (probes x samples, float64, see exprio.read_expression)
+    """
+    annot, samples, mat = exprio.read_expression(fname, annotation_cols)
+    return({col: annot[col].tolist() for col in annotation_cols}, mat)
+
+
+def standardize(mat, method="pearson"):
+    """
+    Centers each row and scales it to unit norm (after ranking it, for
+    spearman), so the correlation of two rows is their dot product
+    Rows with missing values or no variance become NaN
+    """
+    if method == "spearman":
+        from scipy.stats import rankdata
+        mat = rankdata(mat, axis=1)
+    elif method != "pearson":
+        raise ValueError("Unknown correlation method %s" % method)
+    mat = mat - mat.mean(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mat /= np.sqrt((mat ** 2).sum(axis=1, keepdims=True))
+    return(mat)
+
+
+def save_matrix(mat, dirname):
+    """
+    Saves a matrix to be memory mapped by the worker processes
+    """
+    fname = os.path.join(dirname, "matrix.npy")
+    np.save(fname, mat)
+    return(fname)
+
+
+def cor_pvalue(r, n):
+    """
+    Two sided p-value of correlations r between vectors of size n
+    Correlations equal to 1 (up to all.equal's tolerance) have p-value 0
+    """
+    r = np.abs(r)
+    r[np.abs(r - 1) < 1.5e-8 * r] = 1
+    df = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt(df) / np.sqrt(1 - r ** 2)
+    return(2 * stdtr(df, -t))
+
+
+def init_worker(fname):
+    global matrix
+    matrix = np.load(fname, mmap_mode="r")
+
+
+def pair_correlation(a, b, n):
+    """
+    Correlations and p-values between rows a[i] and b[i] of the matrix
+    """
+    r = np.einsum("ij,ij->i", matrix[a], matrix[b])
+    return(r, cor_pvalue(r, n))
+
+
+def block_correlation(rows, cols, n):
+    """
+    Correlations and p-values between the rows and the cols of the matrix
+    """
+    r = matrix[rows] @ matrix[cols].T
+    return(r, cor_pvalue(r, n))
+
+
+def run_bounded(func, tasks, matrix_fname, cores=None):
+    """
+    Runs func(*task[1:]) for every task in a process pool sharing the
+    matrix in matrix_fname and yields (task, result) in task order
+    At most two tasks per process are pending at once, so tasks are only
+    generated as results are consumed
+    """
+    cores = cores or os.cpu_count()
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=cores, initializer=init_worker,
+                             initargs=(matrix_fname,)) as pool:
+        for task in tasks:
+            pending.append((task, pool.submit(func, *task[1:])))
+            if len(pending) >= 2 * cores:
+                task, future = pending.popleft()
+                yield task, future.result()
+        while pending:
+            task, future = pending.popleft()
+            yield task, future.result()
+
+
+def pair_tasks(rows, probes, lnc_idx, coding_idx, n, chunk_size):
+    """
+    Yields (rows, lnc probes, coding probes, n) for chunks of overlap rows
+    Each row is repeated for every pair of lncRNA and coding probes; rows
+    without probes are dropped
+    """
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        out_rows = []
+        a = []
+        b = []
+        for row in chunk:
+            lnc_probes = probes.get(row[lnc_idx], ())
+            coding_probes = probes.get(row[coding_idx], ())
+            for i in lnc_probes:
+                for j in coding_probes:
+                    out_rows.append(row)
+                    a.append(i)
+                    b.append(j)
+        yield(out_rows, np.array(a, dtype=np.int64),
+              np.array(b, dtype=np.int64), n)
+
+
+def correlate_pairs(ovlp_fname, exp_fname, out_fname, method, lnc_col,
+                    coding_col, symbol_col, probe_col, correction,
+                    annotation_cols, cores=None, chunk_size=PAIRS_CHUNK_SIZE):
+    annotation_cols = list(dict.fromkeys([symbol_col, probe_col] +
+                                         annotation_cols))
+    annot, mat = read_expression(exp_fname, annotation_cols)
+    n = mat.shape[1]
+    probes = {}
+    for i, symbol in enumerate(annot[symbol_col]):
+        probes.setdefault(symbol, []).append(i)
+    extra_cols = [c for c in annotation_cols if c != symbol_col]
+    suffixed = [c + "_lnc" for c in extra_cols] + \
+        [c + "_mrn" for c in extra_cols]
+    probe_annot = list(zip(*[annot[c] for c in extra_cols]))
+    pvalues = []
+    out_dir = os.path.dirname(os.path.abspath(out_fname))
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp, \
+            tsvio.open_tsv(ovlp_fname) as ovlp:
+        matrix_fname = save_matrix(standardize(mat, method), tmp)
+        del mat
+        reader = tsvio.TsvReader(ovlp)
+        lnc_idx, coding_idx = reader.index([lnc_col, coding_col])
+        others = [i for i in range(len(reader.header))
+                  if i not in (lnc_idx, coding_idx)]
+        header = [coding_col, lnc_col] + [reader.header[i] for i in others] + \
+            suffixed + ["correlation", "p.value"]
+        tasks = pair_tasks(reader.rows(), probes, lnc_idx, coding_idx, n,
+                           chunk_size)
+        part_fname = os.path.join(tmp, "pairs.tsv")
+        with tsvio.TsvWriter(part_fname, header) as part:
+            results = run_bounded(pair_correlation, tasks, matrix_fname, cores)
+            for (rows, a, b, n), (r, p) in results:
+                pvalues.append(p)
+                for row, i, j, cor, pvalue in zip(rows, a, b, format_numbers(r),
+                                                  format_numbers(p)):
+                    part.write_row([row[coding_idx], row[lnc_idx]] +
+                                   [row[k] for k in others] +
+                                   list(probe_annot[i] + probe_annot[j]) +
+                                   [cor, pvalue])
+        adj = p_adjust(np.concatenate(pvalues or [np.array([])]), correction)
+        del pvalues
+        # the adjusted p-value is appended to each line of the first pass
+        with tsvio.open_tsv(part_fname) as part, \
+                tsvio.open_tsv(out_fname, "w") as out:
+            out.write(part.readline().rstrip("\n") + "\tadj.p.value\n")
+            for start in range(0, len(adj), chunk_size):
+                block = format_numbers(adj[start:start+chunk_size])
+                out.writelines(line[:-1] + "\t" + p + "\n" for line, p in
+                               zip(islice(part, len(block)), block))
+
+
+def read_lncs(gencode_fname, biotypes_fname):
+    """
+    Returns the ENSEMBL ids of lnoncoding genes and all annotated ids
+    """
+    with tsvio.open_tsv(biotypes_fname) as fh:
+        rows = tsvio.TsvReader(fh).rows(
+            ["name", "biotype_group"],
+            where=[("object_type", lambda v: v == "gene")])
+        groups = {}
+        for name, group in rows:
+            groups.setdefault(name, []).append(group)
+    lncs = []
+    annotated = set()
+    with tsvio.open_tsv(gencode_fname) as fh:
+        for ens_id, name in tsvio.TsvReader(fh, ["ENS_ID", "name"]).rows():
+            ens_id = re.sub(r"\.\d+$", "", ens_id)
+            for group in groups.get(name, ()):
+                annotated.add(ens_id)
+                if group == "lnoncoding":
+                    lncs.append(ens_id)
+    return(lncs, annotated)
+
+
+def write_matrix(out, rownames, names, block):
+    for name, values in zip(rownames, block):
+        out.write_row([name] + format_numbers(values))
+
+
+def correlate_modules(modules_fname, exp_fname, gencode_fname, biotypes_fname,
+                      corr_fname, pvalue_fname, padj_fname, stats_fname,
+                      method, cutoff_cor, cutoff_p, cutoff_padj, ensembl_col,
+                      add_others_lncs, annotation_cols, cores=None,
+                      chunk_size=MODULES_CHUNK_SIZE):
+    annot, mat = read_expression(exp_fname, annotation_cols + [ensembl_col])
+    genes = annot[ensembl_col]
+    n = mat.shape[1]
+    lncs, annotated = read_lncs(gencode_fname, biotypes_fname)
+    if add_others_lncs:
+        lncs = [g for g in genes if "ENSG" not in g and g not in annotated
+                and g != "unannotated"] + lncs
+    lncs = set(lncs)
+    modules = read_gmt(modules_fname)
+    in_modules = set(g for mod in modules.values() for g in mod)
+    mod_rows = [i for i, g in enumerate(genes) if g in in_modules]
+    lnc_rows = [i for i, g in enumerate(genes) if g in lncs]
+    row_of = {}
+    col_of = {}
+    for j, i in enumerate(mod_rows):
+        row_of.setdefault(genes[i], i)
+        col_of.setdefault(genes[i], j)
+    modules = {m: [g for g in mod if g in row_of] for m, mod in modules.items()}
+    with np.errstate(invalid="ignore"):
+        means = np.array([np.nanmean(mat[[row_of[g] for g in mod]], axis=0)
+                          if mod else np.full(n, np.nan)
+                          for mod in modules.values()]).reshape(-1, n)
+    lnc_names = [genes[i] for i in lnc_rows]
+    mod_names = [genes[i] for i in mod_rows]
+    cor_mean = standardize(mat[lnc_rows], method) @ \
+        standardize(means, method).T
+    out_dir = os.path.dirname(os.path.abspath(stats_fname))
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp:
+        matrix_fname = save_matrix(standardize(mat, method), tmp)
+        del mat
+        shape = (len(lnc_rows), len(mod_rows))
+        cors = np.lib.format.open_memmap(os.path.join(tmp, "cor.npy"), "w+",
+                                         shape=shape)
+        ps = np.lib.format.open_memmap(os.path.join(tmp, "p.npy"), "w+",
+                                       shape=shape)
+        header = [""] + mod_names
+        tasks = ((start, lnc_rows[start:start+chunk_size], mod_rows, n)
+                 for start in range(0, len(lnc_rows), chunk_size))
+        with tsvio.TsvWriter(corr_fname, header) as out_cor, \
+                tsvio.TsvWriter(pvalue_fname, header) as out_p:
+            results = run_bounded(block_correlation, tasks, matrix_fname,
+                                  cores)
+            for (start, rows, cols, n), (r, p) in results:
+                end = start + len(rows)
+                cors[start:end] = r
+                ps[start:end] = p
+                write_matrix(out_cor, lnc_names[start:end], mod_names, r)
+                write_matrix(out_p, lnc_names[start:end], mod_names, p)
+        padj = p_adjust(np.asarray(ps).ravel(), "fdr").reshape(shape)
+        with tsvio.TsvWriter(padj_fname, header) as out:
+            write_matrix(out, lnc_names, mod_names, padj)
+        stats_header = ["lncRNA", "module", "N_Correlated", "N_Module",
+                        "Proportion", "corr_with_mean",
+                        "mean_correlation_all_genes", "genes"]
+        with tsvio.TsvWriter(stats_fname, stats_header) as out:
+            for m, (mod, mod_genes) in enumerate(modules.items()):
+                if len(mod_genes) < 2:
+                    continue
+                cols = [col_of[g] for g in mod_genes]
+                cor_mod = cors[:, cols]
+                with np.errstate(invalid="ignore"):
+                    above = (np.abs(cor_mod) > cutoff_cor) & \
+                        (ps[:, cols] < cutoff_p) & (padj[:, cols] < cutoff_padj)
+                count = above.sum(axis=1)
+                order = np.argsort(-count, kind="stable")
+                order = order[count[order] > 0]
+                size = len(mod_genes)
+                mean_cor = cor_mod[order].mean(axis=1)
+                out.write_rows(
+                    [lnc_names[i], mod, str(count[i]), str(size), prop,
+                     corr_mean, mean_all,
+                     ",".join(g for g, a in zip(mod_genes, above[i]) if a)]
+                    for i, prop, corr_mean, mean_all in zip(
+                        order, format_numbers(count[order] / size),
+                        format_numbers(cor_mean[order, m]),
+                        format_numbers(mean_cor)))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    cores = int(args["--cores"]) if args["--cores"] else None
+    if args["pairs"]:
+        chunk_size = int(args["--chunk-size"] or PAIRS_CHUNK_SIZE)
+        correlate_pairs(args["--ovlp"], args["--exp"], args["--output"],
+                        args["--method"] or "spearman", args["--lnc-col"],
+                        args["--coding-col"], args["--symbol-col"],
+                        args["--probe-col"], args["--correction"],
+                        args["--annotation-cols"], cores, chunk_size)
+    else:
+        chunk_size = int(args["--chunk-size"] or MODULES_CHUNK_SIZE)
+        correlate_modules(args["--modules"], args["--expression"],
+                          args["--gencode"], args["--biotype"],
+                          args["--output-corr"], args["--output-pvalue"],
+                          args["--output-padj"], args["--output-stats"],
+                          args["--method"] or "pearson",
+                          float(args["--cutoff-cor"]),
+                          float(args["--cutoff-pvalue"]),
+                          float(args["--cutoff-padj"]), args["--ensembl-col"],
+                          not args["--dont-add-others-lncs"],
+                          args["--annotation-cols"], cores, chunk_size)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Differential expression of every comparison of a study
+
+Vectorized counterpart of do_comparisons.R: the normalized matrix is read
+once (memory mapped from its matrix store when it is up to date, see
+exprio.read_expression) and, for each comparison of --comp-file (title, test and control sample
+selections like "(Class, 'Dengue') AND (Stage, 'Early')"), the statistics of
+all probes are computed at once as whole-matrix operations:
+
+  Average          mean of the control and test samples
+  Log2FC           mean(test) - mean(control)
+  Ttest            Welch two sample t-test (R's t.test)
+  Wilcoxon         Wilcoxon rank sum test (R's wilcox.test: exact p-values
+                   below 50 samples per group without ties, otherwise the
+                   normal approximation with tie and continuity corrections)
+  LIMMA            moderated t-test (limma's lmFit, contrasts.fit and eBayes
+                   with a test - control contrast)
+
+The p-values are adjusted by FDR (BH) within each comparison. Probes with
+missing values use the samples they have (tests with too few samples are
+NA). For LIMMA, such probes have fewer residual degrees of freedom; the
+prior of the variances is fitted with fitFDist over the unequal df, as
+eBayes(legacy=TRUE) and limma releases before fitFDistUnequalDF1 do, so in a
+study with missing values the LIMMA p-values of all probes can differ
+slightly from those of the current eBayes default. fixtures/limma has a
+table with missing values and check.sh, which compares the LIMMA p-values
+with those of inmoose's port of limma (limma_port.tsv, committed) and of
+limma itself (limma.tsv, written by limma.R where R is installed).
+The output has the columns of do_comparisons.R: title, the annotation
+columns, Average, Log2FC, Ttest.rawp, Ttest.adjp, Wilcoxon.rawp,
+Wilcoxon.adjp, LIMMA.rawp and LIMMA.adjp.
+
+Usage:
+  do_comparisons.py --comp-file=<file> --norm-file=<file> --sample-annot=<file> --stat=<file> [--sample-name-col=<value>] [--annotation-cols=<value>...]
+  do_comparisons.py (-h | --help)
+  do_comparisons.py --version
+
+Options:
+  -h --help                   Show this screen.
+  --version                   Show version.
+  --sample-annot=<file>       sample annotation file
+  --stat=<file>               file to write statistics
+  --norm-file=<file>          normalized expression values
+  --comp-file=<file>          file describing all comparisons
+  --annotation-cols=<value>   annotation columns [default: ProbeName]
+  --sample-name-col=<value>   name of the column containing the sample names [default: Sample_geo_accession]
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+from functools import lru_cache
+import numpy as np
+import re
+import sys
+from scipy.special import digamma, ndtr, polygamma, stdtr
+from scipy.stats import rankdata
+from exprio import (format_numbers, p_adjust, read_expression,
+                    read_sample_annot)
+import stagestats
+import tsvio
+
+STATS = ["Average", "Log2FC", "Ttest.rawp", "Ttest.adjp", "Wilcoxon.rawp",
+         "Wilcoxon.adjp", "LIMMA.rawp", "LIMMA.adjp"]
+EPS = np.finfo(float).eps
+ATOM_RE = re.compile(r"^\(\s*([A-Za-z0-9_.]+),\s+('?)([A-Za-z0-9_.]+)\2\s*\)$")
+FORBIDDEN_RE = re.compile(r"[^()\s'A-Za-z0-9_.,]")
+
+
+def select_samples(sample_annot, expr, sample_name_col):
+    """
+    Returns the samples (in the order of the annotation) selected by an
+    expression like "(Class, 'Dengue') AND (Stage, 'Early') OR (col, 'x')"
+    (AND binds tighter than OR, as in do_comparisons.R)
+    A quoted value is compared to the column, an unquoted one is another
+    column (or a value if there is no column with this name)
+    """
+    if FORBIDDEN_RE.search(expr):
+        raise Exception("Forbidden character in %s" % expr)
+    selected = np.zeros(len(sample_annot[sample_name_col]), dtype=bool)
+    for term in re.split(r"\s*\bOR\b\s*", expr.strip()):
+        match = np.ones(len(selected), dtype=bool)
+        for atom in re.split(r"\s*\bAND\b\s*", term):
+            mtch = ATOM_RE.match(atom)
+            if not mtch:
+                raise Exception("Invalid selection %s" % atom)
+            col, quote, value = mtch.groups()
+            if col not in sample_annot:
+                raise Exception("Column %s not found in sample annotation" %
+                                col)
+            values = sample_annot[col]
+            if not quote and value in sample_annot:
+                other = sample_annot[value]
+            else:
+                other = np.full(len(values), value, dtype=object)
+            # NA never matches (which() drops NA in R)
+            match &= (values == other) & (values != "NA") & (other != "NA")
+        selected |= match
+    return(sample_annot[sample_name_col][selected].tolist())
+
+
+def group_stats(x):
+    """
+    Number of values, mean and variance (n - 1) of each row ignoring NaN
+    """
+    ok = ~np.isnan(x)
+    n = ok.sum(axis=1)
+    s = np.where(ok, x, 0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = s / n
+        ss = np.where(ok, (x - mean[:, None]) ** 2, 0).sum(axis=1)
+        var = ss / (n - 1)
+    return(n, mean, var, ss)
+
+
+def welch_test(nx, mx, vx, ny, my, vy):
+    """
+    p-values of the Welch two sample t-test (NA where t.test fails: less
+    than 2 values in a group or constant data)
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sex = vx / nx
+        sey = vy / ny
+        stderr = np.sqrt(sex + sey)
+        df = (sex + sey) ** 2 / (sex ** 2 / (nx - 1) + sey ** 2 / (ny - 1))
+        t = (mx - my) / stderr
+        p = 2 * stdtr(df, -np.abs(t))
+    constant = stderr < 10 * EPS * np.maximum(np.abs(mx), np.abs(my))
+    p[(nx < 2) | (ny < 2) | constant] = np.nan
+    return(p)
+
+
+@lru_cache(maxsize=None)
+def wilcox_dist(m, n):
+    """
+    Lower (P[W <= w]) and upper (P[W >= w]) tails of the distribution of the
+    Wilcoxon rank sum statistic W (0 to m * n) for groups of m and n values
+    The counts are the coefficients of the Gaussian binomial [m + n, n],
+    computed exactly with integers
+    """
+    counts = [1] + [0] * (m * n)
+    for i in range(1, n + 1):
+        # multiply by (1 - q^(m + i)) and divide by (1 - q^i)
+        for k in range(m * n, m + i - 1, -1):
+            counts[k] -= counts[k - m - i]
+        for k in range(i, m * n + 1):
+            counts[k] += counts[k - i]
+    total = sum(counts)
+    lower = []
+    acc = 0
+    for c in counts:
+        acc += c
+        lower.append(acc / total)
+    upper = []
+    acc = 0
+    for c in reversed(counts):
+        acc += c
+        upper.append(acc / total)
+    return(np.array(lower), np.array(upper[::-1]))
+
+
+def tie_sums(x):
+    """
+    sum(t^3 - t) over the groups of t tied values of each row
+    """
+    s = np.sort(x, axis=1)
+    rows, cols = s.shape
+    start = np.ones((rows, cols), dtype=bool)
+    start[:, 1:] = s[:, 1:] != s[:, :-1]
+    run = np.cumsum(start.ravel()) - 1
+    length = np.bincount(run).astype(float)
+    run_row = np.repeat(np.arange(rows), cols)[start.ravel()]
+    return(np.bincount(run_row, weights=length ** 3 - length, minlength=rows))
+
+
+def wilcox_test(x, y):
+    """
+    p-values of the Wilcoxon rank sum test of the rows of x and y (without
+    missing values)
+    """
+    m = x.shape[1]
+    n = y.shape[1]
+    p = np.full(x.shape[0], np.nan)
+    if m < 1 or n < 1 or x.shape[0] == 0:
+        return(p)
+    ranks = rankdata(np.hstack((x, y)), axis=1)
+    w = ranks[:, :m].sum(axis=1) - m * (m + 1) / 2
+    ties = tie_sums(np.hstack((x, y)))
+    exact = (ties == 0) & (m < 50) & (n < 50)
+    if exact.any():
+        lower, upper = wilcox_dist(m, n)
+        we = np.rint(w[exact]).astype(int)
+        tail = np.where(we > m * n / 2, upper[we], lower[we])
+        p[exact] = np.minimum(2 * tail, 1)
+    approx = ~exact
+    if approx.any():
+        z = w[approx] - m * n / 2
+        sigma = np.sqrt((m * n / 12) *
+                        ((m + n + 1) - ties[approx] / ((m + n) * (m + n - 1))))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (z - np.sign(z) * 0.5) / sigma
+        p[approx] = 2 * np.minimum(ndtr(z), ndtr(-z))
+    return(p)
+
+
+def wilcox_by_pattern(x, y):
+    """
+    Wilcoxon p-values of rows with missing values, the rows with the same
+    missing values are tested at once
+    """
+    p = np.full(x.shape[0], np.nan)
+    missing = np.hstack((np.isnan(x), np.isnan(y)))
+    patterns, inverse = np.unique(missing, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    m = x.shape[1]
+    for i, pattern in enumerate(patterns):
+        rows = inverse == i
+        p[rows] = wilcox_test(x[rows][:, ~pattern[:m]],
+                              y[rows][:, ~pattern[m:]])
+    return(p)
+
+
+def trigamma_inverse(x):
+    """
+    Solves trigamma(y) = x for y (limma's trigammaInverse)
+    """
+    if x > 1e7:
+        return(1 / np.sqrt(x))
+    if x < 1e-6:
+        return(1 / x)
+    y = 0.5 + 1 / x
+    for i in range(50):
+        tri = polygamma(1, y)
+        dif = tri * (1 - tri / x) / polygamma(2, y)
+        y += dif
+        if -dif / y < 1e-8:
+            break
+    return(y)
+
+
+def fit_f_dist(s2, df):
+    """
+    Scale and degrees of freedom of the prior of the variances (limma's
+    fitFDist without covariate)
+    """
+    ok = np.isfinite(df) & (df > 1e-15) & np.isfinite(s2)
+    x = np.maximum(s2[ok], 0)
+    df = df[ok]
+    if len(x) == 0:
+        return(np.nan, np.nan)
+    if len(x) == 1:
+        return(x[0], 0)
+    med = np.median(x)
+    if med == 0:
+        med = 1
+    x = np.maximum(x, 1e-5 * med)
+    e = np.log(x) - digamma(df / 2) + np.log(df / 2)
+    emean = e.mean()
+    evar = ((e - emean) ** 2).sum() / (len(e) - 1) - polygamma(1, df / 2).mean()
+    if evar > 0:
+        df2 = 2 * trigamma_inverse(evar)
+        s20 = np.exp(emean + digamma(df2 / 2) - np.log(df2 / 2))
+    else:
+        df2 = np.inf
+        s20 = np.exp(emean)
+    return(s20, df2)
+
+
+def limma_test(nx, mx, ssx, ny, my, ssy):
+    """
+    p-values of the moderated t-test of test - control (limma's lmFit with a
+    group means design, contrasts.fit and eBayes(legacy=TRUE))
+    Rows with missing values keep their own residual df (n - groups with
+    values) in the posterior variance and the t distribution, and enter the
+    prior fit with them (fitFDist, not fitFDistUnequalDF1)
+    """
+    rank = (nx > 0).astype(int) + (ny > 0)
+    df = (nx + ny - rank).astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s2 = (np.where(nx > 0, ssx, 0) + np.where(ny > 0, ssy, 0)) / df
+        coef = my - mx
+        unscaled = np.sqrt(1 / nx + 1 / ny)
+    s2[df == 0] = 0
+    if len(s2) == 1:
+        s20, df0 = s2[0], 0
+    else:
+        s20, df0 = fit_f_dist(s2, df)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if np.isfinite(df0):
+            s2_post = (df * s2 + df0 * s20) / (df + df0)
+        else:
+            s2_post = np.full(len(s2), s20)
+        df_total = np.minimum(df + df0, np.nansum(df))
+        t = coef / unscaled / np.sqrt(s2_post)
+        p = 2 * stdtr(df_total, -np.abs(t))
+    return(p)
+
+
+def compare(values, control, test):
+    """
+    Returns the statistics (columns of STATS) of a comparison, control and
+    test are column indexes of values
+    """
+    x = values[:, control]
+    y = values[:, test]
+    nx, mx, vx, ssx = group_stats(x)
+    ny, my, vy, ssy = group_stats(y)
+    n = nx + ny
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = (np.where(nx > 0, mx * nx, 0) +
+                   np.where(ny > 0, my * ny, 0)) / n
+    ttest = welch_test(nx, mx, vx, ny, my, vy)
+    if np.isnan(x).any() or np.isnan(y).any():
+        wilcox = wilcox_by_pattern(x, y)
+    else:
+        wilcox = wilcox_test(x, y)
+    limma = limma_test(nx, mx, ssx, ny, my, ssy)
+    return([average, my - mx, ttest, p_adjust(ttest), wilcox,
+            p_adjust(wilcox), limma, p_adjust(limma)])
+
+
+def read_comparisons(fname):
+    with tsvio.open_tsv(fname) as fh:
+        return(list(tsvio.TsvReader(fh).rows(["title", "control", "test"])))
+
+
+def do_comparisons(comp_fname, norm_fname, sample_annot_fname, stat_fname,
+                   annotation_cols, sample_name_col):
+    sample_annot = read_sample_annot(sample_annot_fname)
+    if sample_name_col not in sample_annot:
+        raise Exception("Column %s not found in %s" %
+                        (sample_name_col, sample_annot_fname))
+    annot, samples, values = read_expression(norm_fname, annotation_cols)
+    col_idx = {s: i for i, s in enumerate(samples)}
+    with tsvio.TsvWriter(stat_fname, ["title"] + annotation_cols + STATS) as out:
+        for title, control_expr, test_expr in read_comparisons(comp_fname):
+            control = select_samples(sample_annot, control_expr,
+                                     sample_name_col)
+            test = select_samples(sample_annot, test_expr, sample_name_col)
+            print("Comparison name: %s" % title, file=sys.stderr)
+            print("Control samples: %s" % ", ".join(control), file=sys.stderr)
+            print("Test samples: %s" % ", ".join(test), file=sys.stderr)
+            missing = [s for s in control + test if s not in col_idx]
+            if missing:
+                raise Exception("Samples not found in %s: %s" %
+                                (norm_fname, ", ".join(missing)))
+            stats = compare(values, [col_idx[s] for s in control],
+                            [col_idx[s] for s in test])
+            columns = [[title] * len(values)] + \
+                [annot[c].tolist() for c in annotation_cols] + \
+                [format_numbers(s) for s in stats]
+            out.write_rows(zip(*columns))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    do_comparisons(args["--comp-file"], args["--norm-file"],
+                   args["--sample-annot"], args["--stat"],
+                   args["--annotation-cols"], args["--sample-name-col"])
@@ -3,8 +3,21 @@
 
 """Enrichr
 
+With --input-dir every gene list (*.txt) in the directory is analyzed and
+written to <output-dir>/<list name>.tsv. Lists and libraries are processed
+concurrently through a pool of HTTP connections, with at most --jobs requests
+at the same time. Failed requests are retried --retries times with
+exponential backoff.
+
+Exported results are cached in --cache-dir by the normalized gene list
+(unique genes, sorted) and the library, so lists and libraries already
+analyzed do not touch the network. Entries older than --cache-max-days or
+beyond --cache-max-mb (least recently used first) are evicted at the end of
+the run, and cache statistics are written to stderr.
+
 Usage:
-  enrichr.py --input=<file> --output=<file> (--gs=<geneset>...)
+  enrichr.py --input=<file> --output=<file> (--gs=<geneset>...) [--url=<url>] [--jobs=<n>] [--retries=<n>] [--cache-dir=<dir> | --no-cache] [--cache-max-mb=<n>] [--cache-max-days=<n>]
+  enrichr.py --input-dir=<dir> --output-dir=<dir> (--gs=<geneset>...) [--url=<url>] [--jobs=<n>] [--retries=<n>] [--cache-dir=<dir> | --no-cache] [--cache-max-mb=<n>] [--cache-max-days=<n>]
   enrichr.py (-h | --help)
   enrichr.py --version
 
@@ -13,66 +26,203 @@ Options:
   --version                 Show version.
   --output=<file>           output file
   --input=<file>            input file, each gene in one row
+  --input-dir=<dir>         directory of input files
+  --output-dir=<dir>        directory of output files
+  --url=<url>               Enrichr URL [default: http://amp.pharm.mssm.edu/]
+  --jobs=<n>                maximum number of concurrent requests [default: 8]
+  --retries=<n>             number of retries of a failed request [default: 5]
+  --cache-dir=<dir>         directory of the results cache [default: tmp/cache]
+  --no-cache                do not cache results
+  --cache-max-mb=<n>        maximum size of the cache in MB
+  --cache-max-days=<n>      maximum age of cached results in days
 """
 
 __author__ = "Matheus Carvalho Bürger"
 __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
+from concurrent.futures import ThreadPoolExecutor
+import glob
 import json
+import os
 import requests
+from requests.adapters import HTTPAdapter
 from docopt import docopt
+import threading
 import time
 import sys
+import filecache
+import stagestats
+
+ENRICHR_URL = "http://amp.pharm.mssm.edu/"
+
+
+class EnrichrClient():
+    """
+    Enrichr HTTP client
+    A single session pools the connections, a semaphore limits the number of
+    concurrent requests to jobs
+    """
+    def __init__(self, enrichr_url=ENRICHR_URL, jobs=8, retries=5,
+                 backoff=1, max_backoff=60):
+        self.url = enrichr_url
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.slots = threading.BoundedSemaphore(jobs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=jobs)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a request, retrying on connection errors and on 429 and 5xx
+        responses with exponential backoff
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.slots:
+                    response = self.session.request(method, self.url + path,
+                                                    **kwargs)
+                if response.status_code != 429 and response.status_code < 500:
+                    return(response)
+                error = "HTTP %d" % response.status_code
+            except requests.exceptions.RequestException as e:
+                error = e
+            if attempt == self.retries:
+                break
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+            print("%s, retrying in %gs ..." % (error, delay), file=sys.stderr)
+            time.sleep(delay)
+        raise Exception("Unable to request %s: %s" % (path, error))
+
+
+def normalize_genes(genes):
+    """
+    Returns the gene list as sorted unique genes, one per line
+    """
+    return("\n".join(sorted(set(g.strip() for g in genes.split("\n")
+                                 if g.strip()))))
+
 
-def getResultsFile(output, genesets, userlistid,
-                   enrichr_url="http://amp.pharm.mssm.edu/",
+def getResultsFile(output, genesets, userlistid, client, pool=None,
+                   cache=None, list_key=None,
                    query_string="Enrichr/export?userListId=%s&filename=%s&backgroundType=%s"):
+    """
+    Exports the results of all genesets, concurrently if pool is given
+    Results are written in the order of genesets as soon as they arrive
+    If cache is given, results are taken from and stored in the cache under
+    the key (list_key, geneset)
+    userlistid may be a function returning the id, called only when a result
+    is not cached
+    """
+    def export(gs):
+        if cache:
+            key = cache.key(list_key, gs)
+            data = cache.get(key)
+            if data is not None:
+                return(data.decode("utf-8"))
+        list_id = userlistid() if callable(userlistid) else userlistid
+        response = client.request("GET", query_string % (list_id, output, gs))
+        if not response.ok:
+            raise Exception("Unable to export %s results of %s: HTTP %d" %
+                            (gs, output, response.status_code))
+        if cache:
+            cache.put(key, response.content)
+        return(response.text)
+    if pool:
+        results = [pool.submit(export, gs) for gs in genesets]
     flagHeader = False
     with open(output, "w") as f:
-        for gs in genesets:
-            url = enrichr_url + query_string % \
-                (userlistid, output, gs)
-            success = False
-            while not success:
-                try:
-                    response = requests.get(url, stream=True)
-                    success = True
-                except requests.exceptions.RequestException as e:
-                    print(e, file=sys.stderr)
-                    print("Sleep(1) ...", file=sys.stderr)
-                    time.sleep(1)
-                    print("Next loop ...", file=sys.stderr)
-            lines = response.text.strip("\n").split("\n")
+        for i, gs in enumerate(genesets):
+            text = results[i].result() if pool else export(gs)
+            lines = text.strip("\n").split("\n")
             header = "GeneSet\t"+lines.pop(0)
             if not flagHeader:
                 print(header, file=f)
                 flagHeader = True
             lines = [gs+"\t"+l+"\n" for l in lines]
             f.writelines(lines)
+            f.flush()
 
 
-def addList(genes, description, enrichr_url="http://amp.pharm.mssm.edu/",
-            addList_url="Enrichr/addList"):
+def addList(genes, description, client, addList_url="Enrichr/addList"):
     payload = {
-        "list": (None, genes_str),
+        "list": (None, genes),
         "description": (None, description)
     }
-    response = requests.post(enrichr_url + addList_url, files=payload)
+    response = client.request("POST", addList_url, files=payload)
     if not response.ok:
         raise Exception("Error analyzing gene list")
     return(json.loads(response.text))
 
 
+def enrich(genes_fname, outfname, genesets, client, pool=None, cache=None):
+    """
+    Adds the gene list in genes_fname and exports its results to outfname
+    The list is added when the first result not cached is exported (never if
+    all results are cached)
+    """
+    with open(genes_fname) as genes_fh:
+        genes_str = genes_fh.read()
+    list_key = normalize_genes(genes_str)
+    lock = threading.Lock()
+    added = []
+
+    def userlistid():
+        with lock:
+            if not added:
+                added.append(addList(genes_str, "", client)["userListId"])
+            return(added[0])
+
+    getResultsFile(outfname, genesets, userlistid, client, pool, cache,
+                   list_key)
+    return(outfname)
+
+
 if __name__ == "__main__":
     args = docopt(__doc__, version='1.0')
+    stagestats.track()
 
-    genes_fname = args["--input"]
-    outfname = args["--output"]
     genesets = args["--gs"]
+    jobs = int(args["--jobs"])
+    client = EnrichrClient(args["--url"], jobs, int(args["--retries"]))
+    cache = None
+    if not args["--no-cache"]:
+        max_bytes = max_age = None
+        if args["--cache-max-mb"]:
+            max_bytes = float(args["--cache-max-mb"]) * 2**20
+        if args["--cache-max-days"]:
+            max_age = float(args["--cache-max-days"]) * 86400
+        cache = filecache.ResultCache("enrichr", args["--cache-dir"],
+                                      max_bytes, max_age)
 
-    with open(genes_fname) as genes_fh:
-        genes_str = genes_fh.read()
-
-    list_dict = addList(genes_str, "")
-    getResultsFile(outfname, genesets, list_dict["userListId"])
+    with ThreadPoolExecutor(max_workers=jobs) as exports:
+        if args["--input"]:
+            enrich(args["--input"], args["--output"], genesets, client,
+                   exports, cache)
+        else:
+            os.makedirs(args["--output-dir"], exist_ok=True)
+            inputs = sorted(glob.glob(os.path.join(args["--input-dir"], "*.txt")))
+            failed = []
+            with ThreadPoolExecutor(max_workers=jobs) as lists:
+                futures = {}
+                for genes_fname in inputs:
+                    name = os.path.splitext(os.path.basename(genes_fname))[0]
+                    outfname = os.path.join(args["--output-dir"], name + ".tsv")
+                    futures[genes_fname] = lists.submit(
+                        enrich, genes_fname, outfname, genesets, client,
+                        exports, cache)
+                for genes_fname, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print("Unable to run enrichr for %s: %s" %
+                              (genes_fname, e), file=sys.stderr)
+                        failed.append(genes_fname)
+    if cache:
+        cache.evict()
+        print("enrichr cache: " + cache.report(), file=sys.stderr)
+    if args["--input-dir"] and failed:
+        sys.exit(1)
@@ -0,0 +1,118 @@
+# vim:fileencoding=utf8
+
+"""Tables and numbers shared by the Python analysis tools.
+
+Readers of expression tables, sample annotations and GMT files, p-value
+adjustment (R's p.adjust) and number formatting as written by R's
+write.table. The command line tools import these from here instead of from
+each other.
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+import numpy as np
+import matrixstore
+import tsvio
+
+
+def read_expression(fname, annotation_cols):
+    """
+    Returns the annotation columns (dictionary of arrays), the sample names
+    and the probes x samples matrix (float64, NA as NaN)
+    Columns that are not annotation columns nor numeric are ignored
+    The matrix is a read only memory map of the store of the table
+    (matrixstore.py) when it is up to date and has the same annotation
+    columns, the values are the same as parsed from the table
+    """
+    store = matrixstore.open_table(fname, annotation_cols)
+    if store is not None:
+        annot = store.annotation()
+        return({c: annot[c] for c in annotation_cols}, store.cols,
+               store.values)
+    with tsvio.open_tsv(fname) as fh:
+        reader = tsvio.TsvReader(fh)
+        blocks = list(reader.chunks(size=20000))
+    header = reader.header
+    table = np.concatenate(blocks) if blocks else \
+        np.empty((0, len(header)), dtype=str)
+    annot_idx = reader.index(annotation_cols)
+    annot = {c: table[:, i] for c, i in zip(annotation_cols, annot_idx)}
+    samples = []
+    columns = []
+    for i, name in enumerate(header):
+        if i in annot_idx:
+            continue
+        col = table[:, i]
+        try:
+            columns.append(np.where(np.isin(col, ("", "NA")), "nan",
+                                    col).astype(float))
+        except ValueError:
+            continue
+        samples.append(name)
+    values = np.column_stack(columns) if columns else \
+        np.empty((len(table), 0))
+    return(annot, samples, values)
+
+
+def read_sample_annot(fname):
+    """
+    Returns the sample annotation as a dictionary column -> array
+    """
+    with tsvio.open_tsv(fname) as fh:
+        reader = tsvio.TsvReader(fh)
+        rows = list(reader.rows())
+    cols = list(zip(*rows)) if rows else [[] for h in reader.header]
+    return({h: np.array(c, dtype=object) for h, c in zip(reader.header, cols)})
+
+
+def read_gmt(fname):
+    """
+    Returns a dictionary of module -> list of genes
+    """
+    modules = {}
+    with open(fname) as gmt:
+        for line in gmt:
+            values = line.rstrip("\n").split("\t")
+            modules[values[0]] = values[2:]
+    return(modules)
+
+
+def p_adjust_bh(p):
+    """
+    Benjamini-Hochberg adjusted p-values (R's p.adjust(p, "BH"))
+    """
+    m = len(p)
+    if m == 0:
+        return(p)
+    o = np.argsort(-p, kind="stable")
+    adj = np.minimum.accumulate(p[o] * m / np.arange(m, 0, -1))
+    res = np.empty(m)
+    res[o] = np.minimum(adj, 1)
+    return(res)
+
+
+def p_adjust(p, method="fdr"):
+    """
+    Adjusted p-values (R's p.adjust), NaN p-values are kept and not counted
+    """
+    res = np.full(len(p), np.nan)
+    ok = ~np.isnan(p)
+    if method in ("fdr", "BH"):
+        res[ok] = p_adjust_bh(p[ok])
+    elif method == "bonferroni":
+        res[ok] = np.minimum(p[ok] * ok.sum(), 1)
+    elif method == "none":
+        res[ok] = p[ok]
+    else:
+        raise ValueError("Unknown correction method %s" % method)
+    return(res)
+
+
+def format_numbers(v):
+    """
+    Formats numbers like R's write.table, NaN as NA
+    """
+    return(["NA" if x != x else "%.15g" % x
+            for x in np.asarray(v, dtype=float).tolist()])
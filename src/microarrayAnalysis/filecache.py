@@ -0,0 +1,200 @@
+# vim:fileencoding=utf8
+
+"""Helpers shared by the scripts that cache derived data on disk.
+
+Cached files live under a cache directory (tmp/cache by default, relative to
+the project root where the pipeline runs) and are keyed by the content hash
+of the files they were derived from, so they are invalidated automatically
+when a source file changes.
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_DIR = "tmp/cache"
+BLOCK_SIZE = 1 << 20
+
+
+def file_digest(fname, cache_dir=DEFAULT_DIR):
+    """
+    Returns the SHA-1 of a file's content
+    Digests are remembered by (path, size, mtime) in cache_dir/digests.json,
+    so big files are only hashed again when they change
+    """
+    st = os.stat(fname)
+    stamp = [st.st_size, st.st_mtime_ns]
+    key = os.path.abspath(fname)
+    memo_fname = os.path.join(cache_dir, "digests.json")
+    try:
+        with open(memo_fname) as fh:
+            memo = json.load(fh)
+    except (OSError, ValueError):
+        memo = {}
+    if key in memo and memo[key][:2] == stamp:
+        return(memo[key][2])
+    sha = hashlib.sha1()
+    with open(fname, "rb") as fh:
+        for block in iter(lambda: fh.read(BLOCK_SIZE), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    memo[key] = stamp + [digest]
+    os.makedirs(cache_dir, exist_ok=True)
+    with atomic_write(memo_fname, "w") as fh:
+        json.dump(memo, fh)
+    return(digest)
+
+
+def cache_path(namespace, name, digest, suffix="", cache_dir=DEFAULT_DIR):
+    """
+    Returns the path cache_dir/namespace/name.digest+suffix
+    The namespace directory is created if it does not exists
+    """
+    dirname = os.path.join(cache_dir, namespace)
+    os.makedirs(dirname, exist_ok=True)
+    return(os.path.join(dirname, "%s.%s%s" % (name, digest, suffix)))
+
+
+def remove_stale(path, namespace, name, cache_dir=DEFAULT_DIR):
+    """
+    Removes the files cached for name under other digests than path's one
+    """
+    pattern = glob.escape(name) + "." + "[0-9a-f]" * 40 + "*"
+    for old in glob.glob(os.path.join(cache_dir, namespace, pattern)):
+        if os.path.abspath(old) != os.path.abspath(path) and \
+                not old.endswith(".tmp"):
+            os.remove(old)
+
+
+class atomic_write():
+    """
+    Context manager that writes to a temporary file and renames it to fname
+    on success, so readers never see partial files
+    """
+    def __init__(self, fname, mode="wb"):
+        self.fname = fname
+        self.mode = mode
+
+    def __enter__(self):
+        dirname = os.path.dirname(self.fname) or "."
+        fd, self.tmp_fname = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        os.close(fd)
+        self.fh = open(self.tmp_fname, self.mode)
+        return(self.fh)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fh.close()
+        if exc_type is None:
+            os.replace(self.tmp_fname, self.fname)
+        else:
+            os.remove(self.tmp_fname)
+        return(False)
+
+
+class ResultCache():
+    """
+    Content addressed store of results in cache_dir/namespace
+    Entries are keyed by the SHA-1 of their inputs (see key) and evicted by
+    age (max_age, in seconds) and by total size (max_bytes, least recently
+    used first). Hits, misses and bytes read and written are counted
+    """
+    def __init__(self, namespace, cache_dir=DEFAULT_DIR, max_bytes=None,
+                 max_age=None):
+        self.dirname = os.path.join(cache_dir, namespace)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_read": 0,
+                      "bytes_written": 0, "evicted": 0}
+
+    @staticmethod
+    def key(*parts):
+        """
+        Returns the key of a list of strings
+        """
+        sha = hashlib.sha1()
+        for part in parts:
+            sha.update(part.encode("utf-8"))
+            sha.update(b"\0")
+        return(sha.hexdigest())
+
+    def path(self, key):
+        return(os.path.join(self.dirname, key[:2], key))
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def has(self, key):
+        return(os.path.exists(self.path(key)))
+
+    def get(self, key):
+        """
+        Returns the cached bytes of key or None
+        """
+        fname = self.path(key)
+        try:
+            with open(fname, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            self.count("misses")
+            return(None)
+        os.utime(fname)  # recently used
+        self.count("hits")
+        self.count("bytes_read", len(data))
+        return(data)
+
+    def put(self, key, data):
+        fname = self.path(key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with atomic_write(fname, "wb") as fh:
+            fh.write(data)
+        self.count("bytes_written", len(data))
+
+    def entries(self):
+        """
+        Returns a list of (mtime, size, path) of the cached entries
+        """
+        entries = []
+        for fname in glob.glob(os.path.join(self.dirname, "??", "*")):
+            if fname.endswith(".tmp"):
+                continue
+            st = os.stat(fname)
+            entries.append((st.st_mtime, st.st_size, fname))
+        return(entries)
+
+    def evict(self):
+        """
+        Removes entries older than max_age, then the least recently used
+        ones until the cache is not bigger than max_bytes
+        """
+        entries = sorted(self.entries())
+        if self.max_age is not None:
+            oldest = time.time() - self.max_age
+            while entries and entries[0][0] < oldest:
+                os.remove(entries.pop(0)[2])
+                self.count("evicted")
+        if self.max_bytes is not None:
+            total = sum(size for mtime, size, fname in entries)
+            while entries and total > self.max_bytes:
+                mtime, size, fname = entries.pop(0)
+                os.remove(fname)
+                total -= size
+                self.count("evicted")
+
+    def report(self):
+        """
+        Returns the statistics and the current size of the cache as a string
+        """
+        entries = self.entries()
+        stats = dict(self.stats, entries=len(entries),
+                     size=sum(size for mtime, size, fname in entries))
+        return(" ".join("%s=%d" % kv for kv in stats.items()))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Filter the rows of an expression matrix
+
+Counterpart of filter.R: the rows are ordered by their mean or standard
+deviation (decreasing, missing values last) and the first --rows rows (or the
+proportion --prop of the rows) are kept. With --var-pvalue the rows kept are
+also filtered by the variance test of genefilter.R (an inverse gamma fitted
+to the variances of the rows kept: rows with a p-value below --var-pvalue).
+
+The input is read once in blocks of --chunk-size lines: the mean and the
+variance of each row are computed from each block, and only the statistics
+and the position of each line in the file are kept. The selected lines are
+then copied from the input in the order of the statistic, so the matrix is
+never held in memory. The input must be an uncompressed file.
+
+Usage:
+  filter.py INPUT OUTPUT --method=<value> (--prop=<value>|--rows=<value>) [--var-pvalue=<value>] [--annotation-cols=<value>...] [--chunk-size=<n>]
+  filter.py (-h | --help)
+  filter.py --version
+
+Options:
+  INPUT                      the input file containing expression values with samples in columns and genes/probes in rows
+  OUTPUT                     output file
+  -h --help                  show this help message
+  --version                  show program version
+  --annotation-cols=<value>  annotation columns [default: ProbeName]
+  --prop=<value>             proportion (a value between 0 and 1)
+  --rows=<value>             number of rows to be mantained
+  --method=<value>           method to be used for order rows (sd for standard deviation or mean for average)
+  --var-pvalue=<value>       keep only rows with variance p-value below this value
+  --chunk-size=<n>           lines per block [default: 10000]
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+from itertools import islice
+import numpy as np
+from scipy.special import gammainc
+import stagestats
+import tsvio
+
+METHODS = ("mean", "sd")
+
+
+def parse_block(lines, value_idx):
+    """
+    Returns the lines x values matrix of a block of lines (NA as NaN)
+    """
+    block = np.array([line.rstrip(b"\r\n").split(b"\t") for line in lines])
+    values = block[:, value_idx]
+    try:
+        return(np.where(np.isin(values, (b"", b"NA")), b"nan",
+                        values).astype(float))
+    except ValueError:
+        raise ValueError("Values are not numeric!")
+
+
+def row_stats(fh, annotation_cols, chunk_size=10000):
+    """
+    Reads a table (binary file handle) once
+    Returns the header line, the offset of each line and the mean and
+    variance (n - 1) of the values of each line, NaN if a value is missing
+    """
+    header = fh.readline()
+    columns = header.rstrip(b"\r\n").decode().split("\t")
+    value_idx = [i for i, c in enumerate(columns) if c not in annotation_cols]
+    offsets = []
+    means = []
+    variances = []
+    pos = len(header)
+
+    def lines():
+        nonlocal pos
+        for line in fh:
+            start = pos
+            pos += len(line)
+            if line.strip(b"\r\n"):
+                offsets.append(start)
+                yield line
+
+    rows = lines()
+    while True:
+        block = list(islice(rows, chunk_size))
+        if not block:
+            break
+        values = parse_block(block, value_idx)
+        mean = values.mean(axis=1)
+        means.append(mean)
+        variances.append(((values - mean[:, None]) ** 2).sum(axis=1) /
+                         (values.shape[1] - 1) if values.shape[1] > 1 else
+                         np.full(len(values), np.nan))
+    tsvio.rows_read += len(offsets)
+    empty = np.empty(0)
+    return(header, np.array(offsets, dtype=np.int64),
+           np.concatenate(means) if means else empty,
+           np.concatenate(variances) if variances else empty)
+
+
+def var_pvalue(v):
+    """
+    P-values of the variances from an inverse gamma distribution fitted by
+    the method of moments (doVar in genefilter.R)
+    """
+    e = v.mean()
+    e2 = (v ** 2).mean()
+    a = e ** 2 / (e2 - e ** 2) + 2
+    b = (a - 1) * (a - 2) * (e2 - e ** 2) / e
+    return(gammainc(a, b / v))
+
+
+def filter_rows(in_fname, out_fname, method, prop=None, rows=None,
+                annotation_cols=["ProbeName"], var_p=None, chunk_size=10000):
+    if method not in METHODS:
+        raise Exception("Wrong method!")
+    with open(in_fname, "rb") as fh:
+        header, offsets, means, variances = row_stats(fh, annotation_cols,
+                                                      chunk_size)
+        if prop is not None:
+            rows = int(np.floor(prop * len(offsets)))
+        rows = min(rows, len(offsets))
+        val = means if method == "mean" else np.sqrt(variances)
+        # stable, decreasing, NaN last (like R's order)
+        selected = np.argsort(-val, kind="stable")[:rows]
+        if var_p is not None:
+            selected = selected[var_pvalue(variances[selected]) < var_p]
+        with open(out_fname, "wb") as out:
+            out.write(header)
+            for i in selected.tolist():
+                fh.seek(offsets[i])
+                line = fh.readline()
+                out.write(line if line.endswith(b"\n") else line + b"\n")
+    tsvio.rows_written += len(selected)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    filter_rows(args["INPUT"], args["OUTPUT"], args["--method"],
+                float(args["--prop"]) if args["--prop"] else None,
+                int(args["--rows"]) if args["--rows"] else None,
+                args["--annotation-cols"],
+                float(args["--var-pvalue"]) if args["--var-pvalue"] else None,
+                int(args["--chunk-size"]))
@@ -0,0 +1,48 @@
+#!/bin/bash
+
+# Compares the LIMMA.rawp column of do_comparisons.py on the fixture, from
+# the repository root, with:
+#   limma_port.tsv  inmoose's port of limma (committed, see limma_port.py)
+#   limma.tsv       limma itself (see limma.R), when the file exists or R and
+#                   limma are installed to write it
+# The default eBayes p-values of limma.tsv are only reported: they differ
+# from do_comparisons.py when rows have missing values.
+
+fixture_dir=src/microarrayAnalysis/fixtures/limma
+
+references=$fixture_dir/limma_port.tsv
+if [ ! -f $fixture_dir/limma.tsv ] && command -v Rscript > /dev/null; then
+	Rscript $fixture_dir/limma.R || { echo "Unable to run limma"; exit 1; }
+fi
+if [ -f $fixture_dir/limma.tsv ]; then
+	references="$references $fixture_dir/limma.tsv"
+else
+	echo "R is not installed, comparing with limma_port.tsv only"
+fi
+
+stat=$(mktemp) || { echo "Unable to create a temporary file"; exit 1; }
+trap "rm -f $stat" EXIT
+
+src/microarrayAnalysis/do_comparisons.py --comp-file $fixture_dir/comparisons.tsv --norm-file $fixture_dir/expression.tsv --sample-annot $fixture_dir/sample_annotation.tsv --stat $stat 2> /dev/null || { echo "Unable to run do_comparisons.py"; exit 1; }
+
+for reference in $references; do
+	echo "$reference:"
+	python3 - $reference $stat <<'EOF' || { echo "LIMMA p-values differ from $reference"; exit 1; }
+import csv
+import sys
+ref, res = [{row["ProbeName"]: row for row in csv.DictReader(open(f), delimiter="\t")}
+            for f in sys.argv[1:]]
+failed = False
+for probe, row in ref.items():
+    expected = float(row["LIMMA.rawp"])
+    got = float(res[probe]["LIMMA.rawp"])
+    ok = abs(got - expected) <= 1e-8 * expected
+    failed |= not ok
+    print("%s\t%s\t%.15g\t%.15g\t%s" % (probe, "ok" if ok else "FAIL", got,
+                                       expected,
+                                       row.get("LIMMA.default.rawp", "")))
+sys.exit(failed)
+EOF
+done
+
+echo "LIMMA p-values match"
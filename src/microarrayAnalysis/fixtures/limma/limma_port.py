@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Writes limma_port.tsv, the p-values of the fixture from inmoose's port of
+limma (lmFit, contrasts.fit and eBayes), from the repository root:
+  src/microarrayAnalysis/fixtures/limma/limma_port.py
+
+The port fits the prior with fitFDist, like eBayes(legacy=TRUE), so its
+p-values are the LIMMA.rawp column of limma.tsv (see limma.R). It is the
+reference of check.sh where R and limma are not installed; it has no
+counterpart of LIMMA.default.rawp.
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+import csv
+import os
+import numpy as np
+import pandas as pd
+from inmoose.limma import contrasts_fit, eBayes, lmFit
+
+FIXTURE_DIR = "src/microarrayAnalysis/fixtures/limma"
+
+if __name__ == "__main__":
+    exprs = pd.read_csv(os.path.join(FIXTURE_DIR, "expression.tsv"),
+                        sep="\t", index_col=0)
+    with open(os.path.join(FIXTURE_DIR, "sample_annotation.tsv")) as fh:
+        classes = {row["Sample_geo_accession"]: row["Class"]
+                   for row in csv.DictReader(fh, delimiter="\t")}
+    test = np.array([classes[s] == "Dengue" for s in exprs.columns])
+    design = np.column_stack([~test, test]).astype(float)
+    fit = lmFit(exprs.values, design)
+    contrast = pd.DataFrame([[-1.0], [1.0]], index=fit.coefficients.columns)
+    fit2 = eBayes(contrasts_fit(fit, contrast))
+    pvalues = np.asarray(fit2.p_value).ravel()
+    with open(os.path.join(FIXTURE_DIR, "limma_port.tsv"), "w") as out:
+        out.write("ProbeName\tLIMMA.rawp\n")
+        for probe, p in zip(exprs.index, pvalues):
+            out.write("%s\t%.15g\n" % (probe, p))
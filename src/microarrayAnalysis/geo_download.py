@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Download series matrices and supplementary files from GEO
+
+The files of each series are listed from the GEO HTTP mirror (<base-url>/
+series/GSEnnn/<GEO>/matrix/ and .../suppl/) and downloaded concurrently by a
+pool of --jobs threads, with at most --per-host transfers to the same host.
+Series matrices are written to --matrix-dir (used by get_geo.R --matrix-dir)
+and supplementary files to --sup-dir/<GEO>/ (as getGEOSuppFiles does).
+
+Files are downloaded to <file>.part. An interrupted transfer is resumed from
+the size of the .part file with an HTTP range request (If-Range with the
+ETag or Last-Modified of the first response, so a file changed on the server
+is downloaded again from the start), and a failed request is retried (up
+to --retries times) with exponential backoff. A download is complete when its
+size is the size announced by the server and the archive checksums (CRC of
+gzip files, header checksums of tar files) are right. Then the file is
+renamed into place and its size and SHA-1 are recorded in the --manifest,
+with the list of files of each series: files whose size and SHA-1 match the
+manifest are never requested again, and series already listed are not listed
+again unless --refresh is given.
+
+Usage:
+  geo_download.py [--base-url=<url>] [--matrix-dir=<dir>] [--sup-dir=<dir>] [--manifest=<file>] [--jobs=<n>] [--per-host=<n>] [--retries=<n>] [--no-matrix] [--no-supplementary] [--refresh] <geo-id>...
+  geo_download.py (-h | --help)
+  geo_download.py --version
+
+Options:
+  -h --help                 Show this screen.
+  --version                 Show version.
+  --base-url=<url>          GEO HTTP mirror [default: https://ftp.ncbi.nlm.nih.gov/geo/]
+  --matrix-dir=<dir>        directory of the series matrices [default: data/geo_raw/series_matrix]
+  --sup-dir=<dir>           directory of the supplementary files [default: data/geo_raw/supplemental_data]
+  --manifest=<file>         manifest of the downloaded files [default: data/geo_raw/manifest.json]
+  --jobs=<n>                number of concurrent downloads [default: 8]
+  --per-host=<n>            maximum number of concurrent requests to a host [default: 2]
+  --retries=<n>             number of retries of a failed request [default: 5]
+  --no-matrix               do not download series matrices
+  --no-supplementary        do not download supplementary files
+  --refresh                 list the files of the series again
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import os
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from docopt import docopt
+import tarfile
+import threading
+import time
+import sys
+import urllib.parse
+import filecache
+import stagestats
+
+GEO_URL = "https://ftp.ncbi.nlm.nih.gov/geo/"
+BLOCK_SIZE = 1 << 20
+# bytes written at a time while downloading (at most this is lost and fetched
+# again when a transfer is interrupted)
+CHUNK_SIZE = 1 << 16
+KINDS = ("matrix", "suppl")
+
+
+class DownloadError(Exception):
+    pass
+
+
+def series_path(geo_id):
+    """
+    Returns the path of a series in the GEO mirror (GSE43777 ->
+    series/GSE43nnn/GSE43777/)
+    """
+    return("series/%s/%s/" % (re.sub(r"\d{1,3}$", "nnn", geo_id), geo_id))
+
+
+def list_links(html):
+    """
+    Returns the files linked by a directory listing (no subdirectories, parent
+    directory or sorting links)
+    """
+    names = []
+    for href in re.findall(r'href="([^"]+)"', html, re.IGNORECASE):
+        name = urllib.parse.unquote(href)
+        if name.startswith(("?", "/", "..")) or "://" in name or \
+                name.endswith("/"):
+            continue
+        if name not in names:
+            names.append(name)
+    return(names)
+
+
+def content_range(value):
+    """
+    Returns (first byte, total size) of a Content-Range header, total is None
+    if unknown
+    """
+    m = re.match(r"bytes (\d+|\*)(?:-\d+)?/(\d+|\*)", value or "")
+    if not m:
+        return(None, None)
+    return(int(m.group(1)) if m.group(1) != "*" else None,
+           int(m.group(2)) if m.group(2) != "*" else None)
+
+
+def check_archive(fname, name):
+    """
+    Checks the internal checksums of gzip (CRC-32 and size of each member)
+    and tar (header checksums) files, name gives the type
+    """
+    try:
+        if name.lower().endswith(".gz"):
+            with gzip.open(fname, "rb") as fh:
+                while fh.read(BLOCK_SIZE):
+                    pass
+        elif name.lower().endswith(".tar"):
+            with tarfile.open(fname, "r:") as tar:
+                tar.getmembers()
+    except (OSError, EOFError, tarfile.TarError) as e:
+        raise DownloadError("%s is corrupted: %s" % (name, e))
+
+
+def sha1(fname):
+    digest = hashlib.sha1()
+    with open(fname, "rb") as fh:
+        for block in iter(lambda: fh.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return(digest.hexdigest())
+
+
+class Manifest():
+    """
+    Record of the complete files (url, size, SHA-1) and of the files of each
+    series, saved (atomically) after every change
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+        try:
+            with open(fname) as fh:
+                self.data = json.load(fh)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault("files", {})
+        self.data.setdefault("series", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.fname) or ".", exist_ok=True)
+        with filecache.atomic_write(self.fname, "w") as fh:
+            json.dump(self.data, fh, indent=1, sort_keys=True)
+
+    def series(self, geo_id):
+        return(self.data["series"].get(geo_id))
+
+    def set_series(self, geo_id, files):
+        with self.lock:
+            self.data["series"][geo_id] = files
+            self.save()
+
+    def complete(self, fname, entry):
+        with self.lock:
+            self.data["files"][fname] = entry
+            self.save()
+
+    def verified(self, fname, url):
+        """
+        True if fname was downloaded from url and still has the size and the
+        SHA-1 recorded
+        """
+        entry = self.data["files"].get(fname)
+        if entry is None or entry["url"] != url or \
+                not os.path.exists(fname) or \
+                os.path.getsize(fname) != entry["size"]:
+            return(False)
+        return(filecache.file_digest(fname) == entry["sha1"])
+
+
+class GeoDownloader():
+    """
+    HTTP client of the GEO mirror
+    A single session pools the connections, a semaphore per host limits the
+    concurrent requests to each host to per_host
+    """
+    def __init__(self, base_url=GEO_URL, per_host=2, retries=5, backoff=1,
+                 max_backoff=60, timeout=60):
+        self.url = base_url if base_url.endswith("/") else base_url + "/"
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.hosts = {}
+        self.hosts_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.hosts_lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return(self.hosts[host])
+
+    def retry(self, func, what):
+        """
+        Calls func until it succeeds, retrying on connection errors, on 429
+        and 5xx responses and on incomplete downloads with exponential
+        backoff (other HTTP errors are not retried)
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return(func())
+            except requests.exceptions.HTTPError as e:
+                raise Exception("Unable to download %s: %s" % (what, e))
+            except (requests.exceptions.RequestException,
+                    DownloadError) as e:
+                error = e
+            if attempt == self.retries:
+                break
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+            print("%s: %s, retrying in %gs ..." % (what, error, delay),
+                  file=sys.stderr)
+            time.sleep(delay)
+        raise Exception("Unable to download %s: %s" % (what, error))
+
+    def check_status(self, response):
+        if response.status_code == 429 or response.status_code >= 500:
+            raise DownloadError("HTTP %d" % response.status_code)
+
+    def list_series(self, geo_id, kinds=KINDS):
+        """
+        Returns a dictionary kind -> names of the files of a series, a kind
+        missing on the server (404) has no files
+        """
+        files = {}
+        for kind in kinds:
+            url = self.url + series_path(geo_id) + kind + "/"
+
+            def get():
+                with self.slot(url):
+                    response = self.session.get(url, timeout=self.timeout)
+                self.check_status(response)
+                return(response)
+
+            response = self.retry(get, url)
+            if response.status_code == 404:
+                files[kind] = []
+                continue
+            response.raise_for_status()
+            files[kind] = list_links(response.text)
+        return(files)
+
+    def transfer(self, url, part):
+        """
+        Downloads url to part, resuming it if it exists
+        Returns the validator (ETag or Last-Modified) and the total size
+        """
+        meta_fname = part + ".json"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        try:
+            with open(meta_fname) as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            meta = {}
+        headers = {}
+        if offset and meta.get("url") == url and meta.get("validator"):
+            headers["Range"] = "bytes=%d-" % offset
+            headers["If-Range"] = meta["validator"]
+        with self.slot(url), self.session.get(url, headers=headers,
+                                              stream=True,
+                                              timeout=self.timeout) \
+                as response:
+            self.check_status(response)
+            if response.status_code == 416:
+                # the part file is complete (or bigger than the file)
+                first, total = content_range(
+                    response.headers.get("Content-Range"))
+                if total == offset:
+                    return(meta["validator"], total)
+                os.remove(part)
+                raise DownloadError("Range not satisfiable")
+            response.raise_for_status()
+            if response.status_code == 206:
+                first, total = content_range(
+                    response.headers.get("Content-Range"))
+                if first != offset:
+                    raise DownloadError("Unexpected range %s" %
+                                        response.headers.get("Content-Range"))
+                mode = "ab"
+            else:
+                offset = 0
+                total = response.headers.get("Content-Length")
+                total = int(total) if total is not None else None
+                mode = "wb"
+                validator = response.headers.get("ETag") or \
+                    response.headers.get("Last-Modified")
+                meta = {"url": url, "validator": validator}
+                with filecache.atomic_write(meta_fname, "w") as fh:
+                    json.dump(meta, fh)
+            with open(part, mode) as fh:
+                for block in response.iter_content(CHUNK_SIZE):
+                    fh.write(block)
+        size = os.path.getsize(part)
+        if total is not None and size != total:
+            if size > total:
+                os.remove(part)
+            raise DownloadError("Incomplete download (%d of %d bytes)" %
+                                (size, total))
+        return(meta.get("validator"), total)
+
+    def fetch(self, url, fname, manifest):
+        """
+        Downloads url to fname unless the manifest has it
+        Returns True if the file was downloaded
+        """
+        if manifest.verified(fname, url):
+            return(False)
+        os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+        part = fname + ".part"
+
+        def download():
+            validator, total = self.transfer(url, part)
+            try:
+                check_archive(part, fname)
+            except DownloadError:
+                for tmp in (part, part + ".json"):
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                raise
+            return(validator)
+
+        validator = self.retry(download, url)
+        entry = {"url": url, "size": os.path.getsize(part),
+                 "sha1": sha1(part), "validator": validator}
+        os.replace(part, fname)
+        os.remove(part + ".json")
+        manifest.complete(fname, entry)
+        return(True)
+
+
+def download_series(geo_ids, downloader, manifest, matrix_dir, sup_dir,
+                    kinds=KINDS, refresh=False, jobs=8):
+    """
+    Downloads the files of the series concurrently
+    Returns the files downloaded, verified by the manifest and failed
+    """
+    dirs = {"matrix": lambda geo_id: matrix_dir,
+            "suppl": lambda geo_id: os.path.join(sup_dir, geo_id)}
+    downloaded = []
+    verified = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        def listing(geo_id):
+            files = manifest.series(geo_id)
+            if refresh or files is None or \
+                    not all(kind in files for kind in kinds):
+                files = dict(files or {})
+                files.update(downloader.list_series(geo_id, kinds))
+                manifest.set_series(geo_id, files)
+            if not any(files[kind] for kind in kinds):
+                print("No files found for %s" % geo_id, file=sys.stderr)
+            return(files)
+
+        listings = {geo_id: pool.submit(listing, geo_id) for geo_id in geo_ids}
+        futures = {}
+        for geo_id, future in listings.items():
+            try:
+                files = future.result()
+            except Exception as e:
+                print("Unable to list %s: %s" % (geo_id, e), file=sys.stderr)
+                failed.append(geo_id)
+                continue
+            for kind in kinds:
+                for name in files[kind]:
+                    url = downloader.url + series_path(geo_id) + kind + "/" + \
+                        urllib.parse.quote(name)
+                    fname = os.path.join(dirs[kind](geo_id), name)
+                    futures[fname] = pool.submit(downloader.fetch, url, fname,
+                                                 manifest)
+        for fname, future in futures.items():
+            try:
+                if future.result():
+                    print("%s downloaded" % fname, file=sys.stderr)
+                    downloaded.append(fname)
+                else:
+                    verified.append(fname)
+            except Exception as e:
+                print(e, file=sys.stderr)
+                failed.append(fname)
+    return(downloaded, verified, failed)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    kinds = [kind for kind, skip in (("matrix", args["--no-matrix"]),
+                                     ("suppl", args["--no-supplementary"]))
+             if not skip]
+    downloader = GeoDownloader(args["--base-url"], int(args["--per-host"]),
+                               int(args["--retries"]))
+    manifest = Manifest(args["--manifest"])
+    downloaded, verified, failed = download_series(
+        args["<geo-id>"], downloader, manifest, args["--matrix-dir"],
+        args["--sup-dir"], kinds, args["--refresh"], int(args["--jobs"]))
+    print("%d files downloaded, %d verified by the manifest, %d failed" %
+          (len(downloaded), len(verified), len(failed)), file=sys.stderr)
+    if failed:
+        sys.exit(1)
@@ -4,8 +4,15 @@
 """Get modules (connected components) in a undirected graph represented by
 adjacency list in a table (TSV file).
 
+With --sweep-col the table is read once and the modules are reported for
+every --sweep-val threshold (rows below the threshold are not considered), as
+a long table with the columns Threshold, Module and Gene. With --prefix each
+threshold is also written to <prefix><threshold>.txt in the same format used
+without --sweep-col.
+
 Usage:
   get_modules.py --input=<file> --from-col=<value> --to-col=<value> [--output=<file>] [(--filter-col=<value> --filter-val=<value>)]
+  get_modules.py --input=<file> --from-col=<value> --to-col=<value> --sweep-col=<value> (--sweep-val=<value>...) [--output=<file>] [--prefix=<prefix>]
   get_modules.py (-h | --help)
   get_modules.py --version
 
@@ -18,6 +25,9 @@ Options:
   --to-col=<value>          column containing a node label (to)
   --filter-col=<value>      numeric coulumn to filter relations
   --filter-val=<value>      numeric value, if filter column is below this value that row will not be considered
+  --sweep-col=<value>       numeric column used to sweep thresholds
+  --sweep-val=<value>       threshold of the sweep, can be used more than once
+  --prefix=<prefix>         prefix of the per threshold module files
 """
 
 __author__ = "Matheus Carvalho Bürger"
@@ -25,7 +35,11 @@ __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
 from docopt import docopt
+from array import array
+import bisect
 import sys
+import tsvio
+import stagestats
 
 class Graph():
     """
@@ -116,6 +130,150 @@ def depth_search(first, visited, g):
                         i not in to_visit])
     return(mod)
 
+class UnionFind():
+    """
+    Disjoint-set forest over integer-encoded node labels
+    Labels are encoded once, parents and component sizes are kept in compact
+    arrays, so memory depends only on the number of nodes, not on the number
+    of edges
+    """
+    def __init__(self):
+        """
+        Initializer method
+        It creates a dictionary label -> id, a list id -> label and the
+        parent and size arrays
+        """
+        self.ids = {}
+        self.labels = []
+        self.parent = array("l")
+        self.size = array("l")
+
+    def get_id(self, label):
+        """
+        Returns the integer id of a label, creating it if it does not exists
+        """
+        idx = self.ids.get(label)
+        if idx is None:
+            idx = len(self.labels)
+            self.ids[label] = idx
+            self.labels.append(label)
+            self.parent.append(idx)
+            self.size.append(1)
+        return(idx)
+
+    def find(self, idx):
+        """
+        Returns the root of idx, compressing the path (path halving)
+        """
+        parent = self.parent
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return(idx)
+
+    def union(self, a, b):
+        """
+        Merges the sets containing a and b (union by size)
+        """
+        ra = self.find(a)
+        rb = self.find(b)
+        if ra == rb:
+            return(ra)
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+        return(ra)
+
+    def add_edge(self, labelA, labelB):
+        """
+        Adds an edge based on the node's name
+        """
+        self.union(self.get_id(labelA), self.get_id(labelB))
+
+    def components(self, nodes=None):
+        """
+        Returns the connected components as lists of labels
+        Components are ordered by their first seen node, like get_modules
+        If nodes (ids in the desired order) is given only these nodes are
+        reported
+        """
+        groups = {}
+        labels = self.labels
+        if nodes is None:
+            nodes = range(len(labels))
+        for idx in nodes:
+            root = self.find(idx)
+            mod = groups.get(root)
+            if mod is None:
+                mod = groups[root] = []
+            mod.append(labels[idx])
+        return(list(groups.values()))
+
+
+def read_edges(fh, from_col, to_col, filter_col=None, filter_val=None):
+    """
+    Streams (from, to) pairs from a TSV file handle
+    Rows where filter_col is below filter_val are skipped
+    """
+    where = None
+    if filter_col:
+        where = [(filter_col, lambda v: float(v) >= filter_val)]
+    yield from tsvio.TsvReader(fh).rows([from_col, to_col], where)
+
+
+def get_modules_uf(edges):
+    """
+    Receives an iterable of (from, to) pairs and returns modules i.e.
+    connected components, using union-find
+    """
+    uf = UnionFind()
+    for labelA, labelB in edges:
+        uf.add_edge(labelA, labelB)
+    return(uf.components())
+
+
+def sweep_modules(fh, from_col, to_col, sweep_col, thresholds):
+    """
+    Reads the edges once and yields (threshold, modules) for every threshold,
+    from the highest to the lowest
+    Each edge is put in the bucket of the highest threshold it reaches, then
+    buckets are added to a single union-find from the highest weight down.
+    Modules are the same (and in the same order) as get_modules_uf with
+    filter_col=sweep_col and filter_val=threshold
+    """
+    thresholds = sorted(set(thresholds))
+    uf = UnionFind()
+    # edges (as ids) and their row positions, one bucket per threshold
+    buckets = [(array("l"), array("l")) for t in thresholds]
+    rows = tsvio.TsvReader(fh).rows([from_col, to_col, sweep_col])
+    for pos, (labelA, labelB, weight) in enumerate(rows):
+        b = bisect.bisect_right(thresholds, float(weight)) - 1
+        if b < 0:
+            continue
+        ends, positions = buckets[b]
+        ends.append(uf.get_id(labelA))
+        ends.append(uf.get_id(labelB))
+        positions.append(pos)
+    # row where each node is first seen among the edges added so far
+    first_pos = {}
+    for b in range(len(thresholds) - 1, -1, -1):
+        ends, positions = buckets[b]
+        for i, pos in enumerate(positions):
+            a = ends[2*i]
+            c = ends[2*i+1]
+            uf.union(a, c)
+            # from-col is seen before to-col in the same row
+            for node, key in ((a, 2*pos), (c, 2*pos+1)):
+                if first_pos.get(node, key) >= key:
+                    first_pos[node] = key
+        # rows are added out of order: sort the nodes by first seen row
+        # to keep the order of get_modules_uf
+        nodes = sorted(first_pos, key=first_pos.__getitem__)
+        yield thresholds[b], uf.components(nodes)
+        buckets[b] = None
+
+
 def get_modules(g):
     """
     Receives a graph and returns modules i.e. connected components of a graph
@@ -134,6 +292,7 @@ def get_modules(g):
 
 if __name__ == "__main__":
     args = docopt(__doc__, version='1.0')
+    stagestats.track()
 
     in_fname = args["--input"]
     if args["--output"]:
@@ -144,25 +303,33 @@ if __name__ == "__main__":
     from_col = args["--from-col"]
     to_col = args["--to-col"]
     filter_col = args["--filter-col"]
+    filter_val = None
     if filter_col:
         filter_val = float(args["--filter-val"])
 
-    graph = Graph()
-    with open(in_fname) as cem:
-        header = cem.readline().strip("\n").split("\t")
-        g1_idx = header.index(from_col)
-        g2_idx = header.index(to_col)
-        if filter_col:
-            filter_idx = header.index(filter_col)
-        for i, line in enumerate(cem):
-            line = line.strip("\n")
-            values = line.split("\t")
-            if filter_col and float(values[filter_idx]) < filter_val:
-                continue
-            graph.add_edge(values[g1_idx], values[g2_idx])
-    modules = get_modules(graph)
-    modules.sort(key = lambda x: len(x), reverse=True)
-    for mod in modules:
-        print(*sorted(mod), sep="\t", file=out)
+    if args["--sweep-col"]:
+        thresholds = [float(v) for v in args["--sweep-val"]]
+        print("Threshold\tModule\tGene", file=out)
+        with tsvio.open_tsv(in_fname) as cem:
+            sweep = sweep_modules(cem, from_col, to_col, args["--sweep-col"],
+                                  thresholds)
+            for threshold, modules in sweep:
+                modules.sort(key = lambda x: len(x), reverse=True)
+                label = "%g" % threshold
+                lines = ["%s\tM%d\t%s\n" % (label, i+1, gene)
+                         for i, mod in enumerate(modules)
+                         for gene in sorted(mod)]
+                out.writelines(lines)
+                if args["--prefix"]:
+                    with open(args["--prefix"] + label + ".txt", "w") as fh:
+                        for mod in modules:
+                            print(*sorted(mod), sep="\t", file=fh)
+    else:
+        with tsvio.open_tsv(in_fname) as cem:
+            edges = read_edges(cem, from_col, to_col, filter_col, filter_val)
+            modules = get_modules_uf(edges)
+        modules.sort(key = lambda x: len(x), reverse=True)
+        for mod in modules:
+            print(*sorted(mod), sep="\t", file=out)
     if args["--output"]:
         out.close()
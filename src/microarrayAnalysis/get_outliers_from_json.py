@@ -23,10 +23,12 @@ __license__ = "GPL"
 
 from docopt import docopt
 import json
+import stagestats
 
 
 if __name__ == "__main__":
     args = docopt(__doc__, version='Get outliers from JSON')
+    stagestats.track()
     counts_min = int(args["--counts"])
     json_file = args["JSON"]
     js = json.load(open(json_file))
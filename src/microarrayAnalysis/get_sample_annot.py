@@ -3,8 +3,17 @@
 
 """Get Sample Annotation
 
+SOFT documents are fetched concurrently, reusing one connection per thread,
+and cached in --cache-dir by accession. Cached documents are used as they are
+unless --revalidate is given, in which case GEO is asked whether they changed.
+
+Each SOFT line is one field: a field with an empty value (e.g.
+"!Sample_title = ") is written empty. The multiline regex used before took
+the next line as its value ("!Sample_source_name_ch1 = blood") and lost that
+field.
+
 Usage:
-  get_sample_annot.py [--out=<out-file>] <geo-id> ...
+  get_sample_annot.py [--out=<out-file>] [--geo-url=<url>] [--threads=<n>] [--cache-dir=<dir> | --no-cache] [--revalidate] <geo-id> ...
   get_sample_annot.py (-h | --help)
   get_sample_annot.py --version
 
@@ -12,6 +21,11 @@ Options:
   -h --help                Show this screen.
   --version                Show version.
   -o=<file> --out=<file>   output file
+  --geo-url=<url>          GEO query URL [default: https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi]
+  --threads=<n>            number of concurrent requests [default: 4]
+  --cache-dir=<dir>        directory of the SOFT cache [default: tmp/cache]
+  --no-cache               do not cache SOFT documents
+  --revalidate             revalidate cached documents with GEO
 
 """
 
@@ -21,12 +35,20 @@ __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
 
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import io
+import json
+import os
+import queue
 import re
 import sys
-import urllib.request
-from Bio import Entrez
-Entrez.email = "sysbio-usp@googlegroups.com"
+import threading
+import urllib.parse
 from docopt import docopt
+import stagestats
+
+GEO_URL = "https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi"
 
 
 def create_dict(mapping):
@@ -40,7 +62,135 @@ def create_dict(mapping):
     return d
 
 
+class GeoClient():
+    """
+    Fetches SOFT documents from GEO
+    Each thread keeps its own keep-alive connection, documents are cached in
+    cache_dir/geo by accession and target, with their ETag and Last-Modified
+    headers used to revalidate them
+    """
+    def __init__(self, geo_url=GEO_URL, cache_dir=None, revalidate=False,
+                 timeout=60):
+        self.url = urllib.parse.urlsplit(geo_url)
+        self.cache_dir = cache_dir
+        self.revalidate = revalidate
+        self.timeout = timeout
+        self.local = threading.local()
+        if cache_dir:
+            os.makedirs(os.path.join(cache_dir, "geo"), exist_ok=True)
+
+    def connection(self):
+        """
+        Returns the connection of the current thread
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            if self.url.scheme == "https":
+                conn = http.client.HTTPSConnection(self.url.netloc,
+                                                   timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.url.netloc,
+                                                  timeout=self.timeout)
+            self.local.conn = conn
+        return(conn)
+
+    def request(self, query, headers):
+        """
+        GET query, reconnecting once if the kept-alive connection was closed
+        """
+        path = self.url.path + "?" + urllib.parse.urlencode(query)
+        for attempt in range(2):
+            conn = self.connection()
+            try:
+                conn.request("GET", path, headers=headers)
+                return(conn.getresponse())
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+    def cache_fname(self, acc, targ):
+        return(os.path.join(self.cache_dir, "geo", "%s_%s.soft" % (acc, targ)))
+
+    def open(self, acc, targ="self"):
+        """
+        Requests the SOFT document (brief view) of an accession
+        targ is self (the accession itself) or gsm (samples of a series)
+        Returns (response, fname), response is None if the cached file fname
+        is up to date
+        """
+        query = {"acc": acc, "targ": targ, "form": "text", "view": "brief"}
+        headers = {}
+        fname = None
+        if self.cache_dir:
+            fname = self.cache_fname(acc, targ)
+            if os.path.exists(fname):
+                if not self.revalidate:
+                    return(None, fname)
+                try:
+                    with open(fname + ".json") as fh:
+                        meta = json.load(fh)
+                except (OSError, ValueError):
+                    meta = {}
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+        response = self.request(query, headers)
+        if response.status == 304:
+            response.read()
+            return(None, fname)
+        if response.status != 200:
+            response.read()
+            raise Exception("GEO returned %d %s for %s" %
+                            (response.status, response.reason, acc))
+        return(response, fname)
+
+    def stream(self, acc, targ="self"):
+        """
+        Yields the lines (bytes) of the SOFT document of an accession as they
+        arrive, writing them to the cache on the way
+        """
+        response, fname = self.open(acc, targ)
+        if response is None:
+            with open(fname, "rb") as fh:
+                yield from fh
+            return
+        conn = self.connection()
+        complete = False
+        cache = open(fname + ".tmp", "wb") if fname else None
+        try:
+            for line in iter(response.readline, b""):
+                if cache:
+                    cache.write(line)
+                yield line
+            complete = True
+        finally:
+            if cache:
+                cache.close()
+                if complete:
+                    with open(fname + ".json", "w") as fh:
+                        json.dump({"etag": response.getheader("ETag"),
+                                   "last_modified":
+                                   response.getheader("Last-Modified")}, fh)
+                    os.replace(fname + ".tmp", fname)
+                else:
+                    os.remove(fname + ".tmp")
+            if not complete:
+                # unread data left in the connection, it can not be reused
+                conn.close()
+
+    def fetch(self, acc, targ="self"):
+        """
+        Returns the SOFT document of an accession as bytes
+        """
+        return(b"".join(self.stream(acc, targ)))
+
+
 def get_accessions(accessions):
+    from Bio import Entrez
+    Entrez.email = "sysbio-usp@googlegroups.com"
     retmax = int(1e9)   # parameter to retrieve all results
     acc_re = re.compile("Accession:\s*(?P<acc>\S+)\s+ID:\s*(?P<id>\d+)")
     accs = []
@@ -60,13 +210,10 @@ def get_accessions(accessions):
     return(accs)
 
 
-def get_sample_info_old(sample):
+def get_sample_info_old(sample, client):
     block_init_re = re.compile("^\^SAMPLE\s*=\s*(?P<sample>\S+)")
     soft_re = re.compile("^\!(\S+)\s*=\s*(.*)$", flags=re.MULTILINE)
-    url_base = "http://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?"
-    url = url_base+"acc=%s&targ=self&form=text&view=brief"
-    response = urllib.request.urlopen(url % sample)
-    soft = response.read().decode().replace("\r", "")
+    soft = client.fetch(sample, "self").decode().replace("\r", "")
     match_init = block_init_re.match(soft)
     if match_init:
         if match_init.group("sample") == sample:
@@ -79,45 +226,88 @@ def get_sample_info_old(sample):
     return sample_info
 
 
-def get_soft(study):
-    url_base = "http://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?"
-    url = url_base+"acc=%s&targ=gsm&form=text&view=brief"
-    response = urllib.request.urlopen(url % study)
-    soft = response.read().decode().replace("\r", "")
+def get_soft(study, client):
+    soft = client.fetch(study, "gsm").decode().replace("\r", "")
     return(soft)
 
 
+def stream_soft(study, client):
+    """
+    Yields the decoded lines of the SOFT document of a series as they arrive
+    """
+    for line in client.stream(study, "gsm"):
+        yield line.decode().replace("\r", "")
+
+
 def get_sample_info(soft):
-    block_re = re.compile(r"""^\^SAMPLE\s*=\s* # block init
-                          (?P<sample>\S+)      # sample name
-                          \n
-                          (?P<info>(\!.+\n)+)  # sample information
-                          """, flags=re.VERBOSE+re.MULTILINE)
-    field_re = re.compile("^\!(\S+)\s*=\s*(.*)$", flags=re.MULTILINE)
-    field_iter = block_re.finditer(soft)
-    for block in field_iter:
-        # sample = block.group("sample")
-        info = block.group("info")
-        fields_match = field_re.findall(info)
-        sample_info = create_dict(fields_match)
-        yield sample_info
+    """
+    Line oriented SOFT parser
+    soft is a string or an iterable of lines (e.g. stream_soft), the fields of
+    each ^SAMPLE block are yielded as soon as the block ends
+    A block is a ^SAMPLE line followed by one or more !field lines, each
+    line is one field (empty values stay empty)
+    """
+    if isinstance(soft, str):
+        soft = io.StringIO(soft)
+    block_init_re = re.compile(r"^\^SAMPLE\s*=\s*(?P<sample>\S+)$")
+    field_re = re.compile(r"^\!(\S+)\s*=\s*(.*)$")
+    info = None
+    for line in soft:
+        if info is not None:
+            if line.startswith("!") and len(line) > 2 and line[-1] == "\n":
+                info.append(line[:-1])
+                continue
+            if info:
+                fields_match = [m.groups() for m in map(field_re.match, info)
+                                if m]
+                yield create_dict(fields_match)
+            info = None
+        if line[-1:] == "\n" and block_init_re.match(line[:-1]):
+            info = []
+    if info:
+        fields_match = [m.groups() for m in map(field_re.match, info) if m]
+        yield create_dict(fields_match)
+
+
+def stream_rows(study, client, int_cols, rows):
+    """
+    Puts the TSV line of each sample of a series in the queue rows, followed
+    by None (or by the exception raised)
+    """
+    try:
+        for sample_info in get_sample_info(stream_soft(study, client)):
+            line = [sample_info.get(cols, "NA") for cols in int_cols]
+            rows.put("\t".join(line))
+    except Exception as e:
+        rows.put(e)
+    rows.put(None)
 
 
 if __name__ == "__main__":
     args = docopt(__doc__, version='Get sample annot 0.1')
+    stagestats.track()
     if args["--out"]:
         out = open(args["--out"], "w")
     else:
         out = sys.stdout
     studies = args["<geo-id>"]
-    samples = get_accessions(studies)
+    cache_dir = None if args["--no-cache"] else args["--cache-dir"]
+    client = GeoClient(args["--geo-url"], cache_dir, args["--revalidate"])
     int_cols = ["Sample_series_id", "Sample_geo_accession",
                 "Sample_platform_id", "Sample_supplementary_file",
                 "Sample_title", "Sample_source_name_ch1",
                 "Sample_characteristics_ch1"]
     print("\t".join(int_cols), file=out)
-    for study in studies:
-        soft = get_soft(study)
-        for sample_info in get_sample_info(soft):
-            line = [sample_info.get(cols, "NA") for cols in int_cols]
-            print("\t".join(line), file=out)
+    # series are parsed while they are downloaded, rows are written in the
+    # order of the series as soon as they are available
+    queues = [queue.Queue() for study in studies]
+    with ThreadPoolExecutor(max_workers=int(args["--threads"])) as pool:
+        for study, rows in zip(studies, queues):
+            pool.submit(stream_rows, study, client, int_cols, rows)
+        for rows in queues:
+            for line in iter(rows.get, None):
+                if isinstance(line, Exception):
+                    raise line
+                print(line, file=out)
+                if rows.empty():
+                    out.flush()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Join CEMiTool results (modules files)
+
+Counterpart of join_cemitool.R: two genes are connected in a study when they
+are in the same module (modules named --not-correlated are ignored), and the
+output has a row for every pair of genes connected in at least one study,
+with a column per study (TRUE or NA) and the number of studies (Sum), sorted
+by Sum (decreasing) and then by the order the pairs appear in the studies.
+Genes and modules are sorted by code point (C1QA before C1orf112), while
+join_cemitool.R sorts them with R's sort and split, in the collation of the
+locale. So for such genes Gene1 and Gene2 are swapped with respect to
+join_cemitool.R, and rows with the same Sum can come in another order (the
+pairs, study columns and Sum are the same).
+
+The genes are integer encoded (in sorted order, so that Gene1 < Gene2) and
+each study is kept as a module x gene indicator (the sorted gene codes of
+each module). The pairs of each module are packed in 64 bit keys
+(Gene1 * genes + Gene2) with a bit per study, the keys of all studies are
+sorted once and the bits of equal keys are or-ed, so no table of pairs of
+gene names is ever built. Pairs in less than --min-sum studies are dropped
+before the output is formatted, which is written in blocks of rows.
+
+The output can be used by get_modules.py (--from-col Gene1 --to-col Gene2
+--filter-col Sum or --sweep-col Sum).
+
+Usage:
+  join_cemitool.py (--input=<file>...) --output=<file> [--names=<v>...] [--modules-column=<v>] [--genes-column=<v>] [--not-correlated=<v>] [--min-sum=<n>]
+  join_cemitool.py (-h | --help)
+  join_cemitool.py --version
+
+Options:
+  -h --help                  show this help message
+  --version                  show program version
+  --input=<file>             input file name (at least 2)
+  --output=<file>            output file name
+  --names=<v>                name of each input file (same order that input files), S1, S2, ... by default
+  --modules-column=<v>       name of the column containing the modules [default: modules]
+  --genes-column=<v>         name of the columns containing the genes [default: genes]
+  --not-correlated=<v>       name of the module of genes not correlated [default: Not.Correlated]
+  --min-sum=<n>              write only pairs connected in at least n studies [default: 1]
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import numpy as np
+import sys
+import stagestats
+import tsvio
+
+BLOCK_ROWS = 100000
+
+
+def read_modules(fname, modules_col, genes_col, not_correlated):
+    """
+    Returns a dictionary module -> list of genes
+    """
+    modules = {}
+    with tsvio.open_tsv(fname) as fh:
+        for module, gene in tsvio.TsvReader(fh).rows([modules_col, genes_col]):
+            if module != not_correlated:
+                modules.setdefault(module, []).append(gene)
+    return(modules)
+
+
+def study_keys(modules, gene_code, n_genes):
+    """
+    Returns the packed keys (Gene1 * n_genes + Gene2) of the pairs of genes
+    in the same module, modules in sorted order
+    """
+    keys = []
+    for module in sorted(modules):
+        codes = np.unique([gene_code[g] for g in modules[module]]).astype(
+            np.uint64)
+        if len(codes) < 2:
+            continue
+        i, j = np.triu_indices(len(codes), 1)
+        keys.append(codes[i] * np.uint64(n_genes) + codes[j])
+    return(np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64))
+
+
+def join_keys(study_keys):
+    """
+    Returns the distinct keys of all studies, their flags (bit s set if the
+    pair is in study s) and the position each key first appears at
+    """
+    keys = np.concatenate(study_keys)
+    bits = np.concatenate([np.full(len(k), 1 << s, dtype=np.int64)
+                           for s, k in enumerate(study_keys)])
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) \
+        if len(keys) else np.empty(0, dtype=np.int64)
+    flags = np.bitwise_or.reduceat(bits[order], starts) if len(keys) else \
+        np.empty(0, dtype=np.int64)
+    return(keys[starts], flags, order[starts])
+
+
+def join_cemitool(fnames, names, out_fname, modules_col="modules",
+                  genes_col="genes", not_correlated="Not.Correlated",
+                  min_sum=1):
+    if len(names) != len(fnames):
+        raise Exception("The number of names (%d) is different from the "
+                        "number of input files (%d)" % (len(names),
+                                                        len(fnames)))
+    studies = [read_modules(f, modules_col, genes_col, not_correlated)
+               for f in fnames]
+    genes = np.array(sorted({g for modules in studies
+                             for members in modules.values()
+                             for g in members}))
+    gene_code = {g: i for i, g in enumerate(genes.tolist())}
+    keys, flags, first = join_keys([study_keys(modules, gene_code, len(genes))
+                                    for modules in studies])
+    in_study = [(flags >> s) & 1 == 1 for s in range(len(fnames))]
+    total = np.sum(in_study, axis=0, dtype=np.int64) if in_study else \
+        np.zeros(len(keys), dtype=np.int64)
+    keep = np.flatnonzero(total >= min_sum)
+    keep = keep[np.lexsort((first[keep], -total[keep]))]
+    print("%d genes, %d pairs, %d with Sum >= %d" %
+          (len(genes), len(keys), len(keep), min_sum), file=sys.stderr)
+    flag_values = np.array(["NA", "TRUE"])
+    with tsvio.TsvWriter(out_fname, ["Gene1", "Gene2"] + names + ["Sum"]) \
+            as out:
+        for start in range(0, len(keep), BLOCK_ROWS):
+            block = keep[start:start + BLOCK_ROWS]
+            gene1, gene2 = np.divmod(keys[block], np.uint64(len(genes)))
+            columns = [genes[gene1.astype(np.int64)].tolist(),
+                       genes[gene2.astype(np.int64)].tolist()] + \
+                [flag_values[s[block].astype(int)].tolist()
+                 for s in in_study] + [total[block].astype(str).tolist()]
+            out.write_rows(zip(*columns))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    names = args["--names"] or ["S%d" % (i + 1)
+                                for i in range(len(args["--input"]))]
+    join_cemitool(args["--input"], names, args["--output"],
+                  args["--modules-column"], args["--genes-column"],
+                  args["--not-correlated"], int(args["--min-sum"]))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Join statistics of several studies and combine their p-values
+
+Vectorized counterpart of join_stats.R: the DEG tables (--input) are read
+row by row into a full outer join on the key columns (comparison, probe,
+--key-col and gene), building a keys x studies matrix of each maintained
+column (Log2FC, raw and adjusted p-values and --maintain-col), renamed to
+<column>.<file name without extension>. The "_PM" suffix is removed from the
+probe names so that probes of the same platform match.
+
+The p-values of the studies in each row are then combined by the methods of
+the metap package, all rows at once as column-wise array operations (values
+outside the range accepted by a method are ignored, rows with less than two
+valid values are NA):
+
+  logitp      logit method (Mudholkar and George, t distribution)
+  meanp       mean of the p-values (at least four valid values)
+  minimump    Tippett's minimum p (Wilkinson, r = 1)
+  sumlog      Fisher's method (chi-squared, 2k degrees of freedom)
+  sump        Edgington's sum of p-values (Irwin-Hall distribution)
+  sumz        Stouffer's method (sum of z, unweighted)
+  votep       vote counting (binomial test of p < 0.5 against p > 0.5)
+
+followed by the minimum and maximum p-value, for the raw (rawp.*) and
+adjusted (adjp.*) p-values, and by the mean of the Log2FCs (mean.lfc) and
+the Log2FC closest to zero (min.lfc). Rows are sorted by the key columns,
+missing keys first.
+
+Usage:
+  join_stats.py OUTPUT [--comp-col=<value>] [--probe-col=<value>] [--gene-col=<value>] [--lfc-col=<value>] [--pv-col=<value>] [--padj-col=<value>] [--cores=<value>] [--key-col=<value>...] [--maintain-col=<value>...] (--input=<file>...)
+  join_stats.py (-h | --help)
+  join_stats.py --version
+
+Options:
+  OUTPUT                     output file
+  -h --help                  show this help message
+  --version                  show program version
+  --input=<file>             The input file containing the statistics values (Log2FC, p-value, ...)
+  --comp-col=<value>         Column containing the comparison [default: title]
+  --probe-col=<value>        Column containing the probe name
+  --gene-col=<value>         Column containing the gene symbol
+  --lfc-col=<value>          Column containing Log2(fold-change) [default: Log2FC]
+  --pv-col=<value>           Column containing raw p-values [default: LIMMA.rawp]
+  --padj-col=<value>         Column containing adjusted p-values [default: LIMMA.adjp]
+  --cores=<value>            Ignored, kept for compatibility with join_stats.R
+  --key-col=<value>          Column to use as key on full join operation
+  --maintain-col=<value>     Column to maintain after full join operation
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import numpy as np
+import os
+import re
+import sys
+from scipy.special import bdtrc, chdtrc, gammaln, ndtr, ndtri, stdtr
+from exprio import format_numbers
+import stagestats
+import tsvio
+
+METHODS = ["logitp", "meanp", "minimump", "sumlog", "sump", "sumz", "votep"]
+NA_VALUES = ("", "NA")
+
+
+def study_name(fname):
+    """
+    File name without extension (like str_match "(\\S+)\\.\\S+")
+    """
+    m = re.match(r"(\S+)\.\S+", os.path.basename(fname))
+    return(m.group(1) if m else None)
+
+
+def join_stats(fnames, maintain_cols, key_cols, probe_cols):
+    """
+    Full outer join of the tables on the key columns
+    Returns the sorted keys (tuples, "" for missing values) and a
+    dictionary of columns (<column>.<study> -> list of strings, None where
+    the study has no row for the key), in the order of the files
+    """
+    keys = {}
+    columns = {}
+    value_cols = [c for c in maintain_cols if c not in key_cols]
+    for fname in fnames:
+        name = study_name(fname)
+        new_cols = ["%s.%s" % (c, name) for c in value_cols]
+        for c in new_cols:
+            columns[c] = [None] * len(keys)
+        study = [columns[c] for c in new_cols]
+        with tsvio.open_tsv(fname) as fh:
+            reader = tsvio.TsvReader(fh)
+            probe_idx = [i for i, c in enumerate(key_cols) if c in probe_cols]
+            seen = set()
+            for row in reader.rows(key_cols + value_cols):
+                key = ["" if v == "NA" else v for v in row[:len(key_cols)]]
+                for i in probe_idx:
+                    key[i] = key[i].replace("_PM", "", 1)
+                key = tuple(key)
+                if key in seen:
+                    raise Exception("Key %s duplicated in %s" %
+                                    (", ".join(key), fname))
+                seen.add(key)
+                pos = keys.get(key)
+                if pos is None:
+                    pos = keys[key] = len(keys)
+                    for col in columns.values():
+                        col.append(None)
+                for col, v in zip(study, row[len(key_cols):]):
+                    col[pos] = v
+        print("%s: %d rows, %d keys joined" % (fname, len(seen), len(keys)),
+              file=sys.stderr)
+    # missing values ("") are sorted first
+    keys = list(keys)
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return([keys[i] for i in order],
+           {c: [v[i] for i in order] for c, v in columns.items()})
+
+
+def to_matrix(columns):
+    """
+    Returns the rows x columns matrix of a list of columns of strings, None
+    and NA as NaN
+    """
+    if not columns:
+        return(np.empty((0, 0)))
+    return(np.column_stack([np.array(["nan" if v is None or v in NA_VALUES
+                                      else v for v in col], dtype=float)
+                            for col in columns]))
+
+
+def valid(p, lower_open, upper_open):
+    """
+    Mask of the p-values accepted by a method (NaN are never valid)
+    """
+    with np.errstate(invalid="ignore"):
+        ok = (p > 0) if lower_open else (p >= 0)
+        ok &= (p < 1) if upper_open else (p <= 1)
+    return(ok)
+
+
+def sumlog(p):
+    ok = valid(p, True, False)
+    k = ok.sum(axis=1)
+    chisq = -2 * np.where(ok, np.log(np.where(ok, p, 1)), 0).sum(axis=1)
+    return(np.where(k >= 2, chdtrc(2 * k, chisq), np.nan))
+
+
+def sumz(p):
+    ok = valid(p, True, True)
+    k = ok.sum(axis=1)
+    z = np.where(ok, -ndtri(np.where(ok, p, 0.5)), 0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        res = ndtr(-z / np.sqrt(k))
+    return(np.where(k >= 2, res, np.nan))
+
+
+def minimump(p):
+    ok = valid(p, False, False)
+    k = ok.sum(axis=1)
+    pmin = np.where(ok, p, 1).min(axis=1, initial=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        res = -np.expm1(k * np.log1p(-pmin))
+    return(np.where(k >= 2, res, np.nan))
+
+
+def sump(p):
+    """
+    Irwin-Hall distribution of the sum: sum over j <= floor(s) of
+    (-1)^j choose(k, j) (s - j)^k / k!
+    """
+    ok = valid(p, False, False)
+    k = ok.sum(axis=1)
+    s = np.where(ok, p, 0).sum(axis=1)
+    res = np.zeros(len(p))
+    log_fact = gammaln(k + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for j in range(int(k.max(initial=0)) + 1):
+            use = (j <= np.floor(s)) & (j <= k)
+            log_choose = log_fact - gammaln(j + 1) - gammaln(k - j + 1)
+            term = np.exp(log_choose + k * np.log(s - j) - log_fact)
+            res += np.where(use, (-1) ** j * term, 0)
+    return(np.where(k >= 2, res, np.nan))
+
+
+def logitp(p):
+    ok = valid(p, True, True)
+    k = ok.sum(axis=1)
+    q = np.where(ok, p, 0.5)
+    logits = np.where(ok, np.log(q / (1 - q)), 0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mult = -1 / np.sqrt(k * np.pi ** 2 * (5 * k + 2) / (3 * (5 * k + 4)))
+        res = stdtr(5 * k + 4, -mult * logits)
+    return(np.where(k >= 2, res, np.nan))
+
+
+def meanp(p):
+    ok = valid(p, False, False)
+    k = ok.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(ok, p, 0).sum(axis=1) / k
+    z = (0.5 - mean) * np.sqrt(12 * k)
+    return(np.where(k >= 4, ndtr(-z), np.nan))
+
+
+def votep(p, alpha=0.5):
+    ok = valid(p, False, False)
+    k = ok.sum(axis=1)
+    hi = 1 - alpha if alpha < 0.5 else alpha
+    lo = 1 - hi
+    with np.errstate(invalid="ignore"):
+        pos = (ok & (p < lo)).sum(axis=1)
+        neg = (ok & (p > hi)).sum(axis=1)
+    # binomial test, alternative "greater": P(X >= pos), 1 with no votes
+    res = np.where(pos > 0, bdtrc(np.maximum(pos - 1, 0), pos + neg, 0.5), 1.0)
+    return(np.where(k >= 2, res, np.nan))
+
+
+def combine_pvalues(p):
+    """
+    Combined p-values of each row of a rows x studies matrix of p-values
+    Returns a list of (name, values), the METHODS followed by minp and maxp
+    """
+    res = [(m + ".metap", globals()[m](p)) for m in METHODS]
+    has = ~np.isnan(p).all(axis=1)
+    safe = np.where(np.isnan(p), np.inf, p)
+    res.append(("minp", np.where(has, safe.min(axis=1, initial=np.inf),
+                                 np.nan)))
+    safe = np.where(np.isnan(p), -np.inf, p)
+    res.append(("maxp", np.where(has, safe.max(axis=1, initial=-np.inf),
+                                 np.nan)))
+    return(res)
+
+
+def combine_lfc(lfc):
+    """
+    Mean of the Log2FCs of each row and the Log2FC closest to zero
+    """
+    has = ~np.isnan(lfc).all(axis=1)
+    n = (~np.isnan(lfc)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(np.isnan(lfc), 0, lfc).sum(axis=1) / n
+    closest = np.where(np.isnan(lfc), np.inf, np.abs(lfc)).argmin(axis=1) \
+        if lfc.shape[1] else np.zeros(len(lfc), dtype=int)
+    lowest = lfc[np.arange(len(lfc)), closest] if lfc.shape[1] else \
+        np.full(len(lfc), np.nan)
+    return(np.where(has, mean, np.nan), np.where(has, lowest, np.nan))
+
+
+def combine_stats(columns, pv_col, padj_col, lfc_col):
+    """
+    Returns the combined statistics (list of (name, values)) of the joined
+    columns whose names start with the p-value, adjusted p-value and Log2FC
+    columns
+    """
+    res = []
+    for col, prefix in ((pv_col, "rawp."), (padj_col, "adjp.")):
+        p = to_matrix([v for c, v in columns.items() if c.startswith(col)])
+        if not p.size:
+            continue
+        res.extend((prefix + name, v) for name, v in combine_pvalues(p))
+    lfc = to_matrix([v for c, v in columns.items() if c.startswith(lfc_col)])
+    if lfc.size:
+        mean, lowest = combine_lfc(lfc)
+        res.extend([("mean.lfc", mean), ("min.lfc", lowest)])
+    return(res)
+
+
+def main(out_fname, fnames, key_cols, maintain_cols, probe_cols, pv_col,
+         padj_col, lfc_col):
+    print("Using as key following columns: %s" % ", ".join(key_cols),
+          file=sys.stderr)
+    print("Will maintain following columns: %s" % ", ".join(maintain_cols),
+          file=sys.stderr)
+    keys, columns = join_stats(fnames, maintain_cols, key_cols, probe_cols)
+    stats = combine_stats(columns, pv_col, padj_col, lfc_col)
+    header = key_cols + list(columns) + [name for name, v in stats]
+    out_columns = [[k[i] or "NA" for k in keys]
+                   for i in range(len(key_cols))] + \
+        [["NA" if v is None else v for v in col] for col in columns.values()] + \
+        [format_numbers(v) for name, v in stats]
+    with tsvio.TsvWriter(out_fname, header) as out:
+        out.write_rows(zip(*out_columns))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    key_cols = []
+    for c in [args["--comp-col"], args["--probe-col"]] + args["--key-col"] + \
+            [args["--gene-col"]]:
+        if c is not None and c not in key_cols:
+            key_cols.append(c)
+    maintain_cols = [args["--lfc-col"], args["--pv-col"], args["--padj-col"]] + \
+        args["--maintain-col"]
+    probe_cols = [args["--probe-col"]] if args["--probe-col"] else []
+    main(args["OUTPUT"], args["--input"], key_cols, maintain_cols, probe_cols,
+         args["--pv-col"], args["--padj-col"], args["--lfc-col"])
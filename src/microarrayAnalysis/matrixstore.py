@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Binary store of expression matrices shared by the pipeline stages
+
+build converts an expression table (<dir>/<name>.tsv, annotation columns
+followed by the samples) into the files below. They are written to
+store/<dir>/ beside the directory of the table
+(data/processed/filtered/GSE13052.tsv is stored as
+data/processed/store/filtered/GSE13052.*), so the directories of the tables
+only hold tables:
+
+  <name>.f64         values, float64 row-major (rows x samples), NaN for NA
+  <name>.rows.txt    first annotation column (probe or gene), one per line
+  <name>.cols.txt    sample names, one per line
+  <name>.annot.txt   all annotation columns (tab separated)
+  <name>.json        shape, annotation columns, the SHA-1 of the values and
+                     the digest of the table it was built from
+
+The table is read in blocks of --chunk-size rows and the files are renamed
+into place only when complete (the .json last), so readers never see a
+partial store. Readers (open_table, MatrixStore) memory map the values:
+rows, columns and blocks are NumPy views of the page cache, shared by every
+process reading the same matrix, and nothing is parsed. A store is only used
+while the digest of its table is unchanged. The values are float64, parsed
+as exprio.read_expression parses the table, so the readers of exprio
+(do_comparisons.py, cor_lnc.py and module_scores.py) get the same numbers
+with or without a store.
+
+export writes a store back to TSV (values with 15 significant digits, as
+R's write.table) and info shows its metadata.
+
+Usage:
+  matrixstore.py build INPUT... [--annotation-cols=<value>...] [--chunk-size=<n>]
+  matrixstore.py export STORE OUTPUT
+  matrixstore.py info STORE
+  matrixstore.py (-h | --help)
+
+Options:
+  -h --help                   Show this screen.
+  --annotation-cols=<value>   annotation columns [default: ProbeName]
+  --chunk-size=<n>            rows read at once [default: 10000]
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import hashlib
+import json
+import numpy as np
+import os
+import sys
+import filecache
+import stagestats
+import tsvio
+
+SUFFIXES = [".f64", ".rows.txt", ".cols.txt", ".annot.txt"]
+DTYPE = "float64"
+STORE_DIR = "store"
+
+
+def store_base(fname):
+    """
+    Returns the name of the store of a table (in STORE_DIR, see above) or of
+    a store file without suffix
+    """
+    if fname.endswith(".tsv"):
+        dirname, name = os.path.split(fname[:-len(".tsv")])
+        return(os.path.join(os.path.dirname(dirname), STORE_DIR,
+                            os.path.basename(dirname), name))
+    for suffix in [".json"] + SUFFIXES:
+        if fname.endswith(suffix):
+            return(fname[:-len(suffix)])
+    return(fname)
+
+
+class MatrixStore():
+    """
+    Read only, memory mapped view of a stored matrix
+    """
+    def __init__(self, base):
+        self.base = store_base(base)
+        with open(self.base + ".json") as fh:
+            self.meta = json.load(fh)
+        if self.meta.get("dtype") != DTYPE:
+            raise ValueError("Store %s is not %s" % (self.base, DTYPE))
+        self.shape = tuple(self.meta["shape"])
+        self.annotation_cols = self.meta["annotation_cols"]
+        self.digest = self.meta["digest"]
+        if self.shape[0] * self.shape[1]:
+            self.values = np.memmap(self.base + ".f64", dtype=DTYPE,
+                                    mode="r", shape=self.shape)
+        else:
+            self.values = np.empty(self.shape, dtype=DTYPE)
+        self.rows = read_lines(self.base + ".rows.txt")
+        self.cols = read_lines(self.base + ".cols.txt")
+        self._annot = None
+
+    def annotation(self, col=None):
+        """
+        Returns an annotation column (or all of them, as a dictionary) as
+        arrays of strings
+        """
+        if self._annot is None:
+            with tsvio.open_tsv(self.base + ".annot.txt") as fh:
+                reader = tsvio.TsvReader(fh)
+                rows = list(reader.rows())
+            cols = list(zip(*rows)) if rows else [[] for h in reader.header]
+            self._annot = {h: np.array(c, dtype=object)
+                           for h, c in zip(reader.header, cols)}
+        return(self._annot if col is None else self._annot[col])
+
+    def row_index(self, names):
+        index = {r: i for i, r in enumerate(self.rows)}
+        return([index[n] for n in names])
+
+    def col_index(self, names):
+        index = {c: i for i, c in enumerate(self.cols)}
+        return([index[n] for n in names])
+
+    def select(self, rows=None, cols=None):
+        """
+        Returns the values of some rows and columns (positions or slices),
+        a view without copy when slices are used
+        """
+        res = self.values
+        if rows is not None:
+            res = res[rows]
+        if cols is not None:
+            res = res[:, cols]
+        return(res)
+
+    def to_tsv(self, fname, chunk_size=10000):
+        annot = self.annotation()
+        with tsvio.TsvWriter(fname, self.annotation_cols + self.cols) as out:
+            for start in range(0, self.shape[0], chunk_size):
+                block = np.asarray(self.values[start:start + chunk_size])
+                values = np.where(np.isnan(block), "NA",
+                                  np.char.mod("%.15g", block))
+                out.write_rows(zip(*[annot[c][start:start + chunk_size]
+                                     for c in self.annotation_cols],
+                                   *values.T.tolist()))
+
+
+def read_lines(fname):
+    with open(fname) as fh:
+        return(fh.read().splitlines())
+
+
+def open_table(fname, annotation_cols=None, cache_dir=filecache.DEFAULT_DIR):
+    """
+    Returns the store of a table if it exists, is up to date and has the
+    annotation columns (if given, in any order), else None
+    Other annotation columns would change which columns are samples
+    """
+    base = store_base(fname)
+    try:
+        store = MatrixStore(base)
+    except (OSError, ValueError, KeyError):
+        return(None)
+    if annotation_cols is not None and \
+            set(annotation_cols) != set(store.annotation_cols):
+        return(None)
+    if os.path.exists(fname) and fname != base + ".json" and \
+            filecache.file_digest(fname, cache_dir) != \
+            store.meta["source_digest"]:
+        return(None)
+    return(store)
+
+
+def build(fname, annotation_cols, chunk_size=10000,
+          cache_dir=filecache.DEFAULT_DIR):
+    """
+    Builds the store of a table, returns its metadata
+    """
+    base = store_base(fname)
+    os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+    sha = hashlib.sha1()
+    n_rows = 0
+    with tsvio.open_tsv(fname) as fh:
+        reader = tsvio.TsvReader(fh)
+        annot_idx = reader.index(annotation_cols)
+        value_idx = [i for i in range(len(reader.header))
+                     if i not in annot_idx]
+        samples = [reader.header[i] for i in value_idx]
+        with filecache.atomic_write(base + ".f64", "wb") as f64, \
+                filecache.atomic_write(base + ".rows.txt", "w") as rows, \
+                filecache.atomic_write(base + ".annot.txt", "w") as annot_fh:
+            annot = tsvio.TsvWriter(annot_fh, annotation_cols)
+            for block in reader.chunks(size=chunk_size):
+                try:
+                    values = np.where(np.isin(block[:, value_idx], ("", "NA")),
+                                      "nan", block[:, value_idx]
+                                      ).astype(DTYPE)
+                except ValueError:
+                    raise ValueError("Values of %s are not numeric (missing "
+                                     "annotation columns?)" % fname)
+                data = np.ascontiguousarray(values).tobytes()
+                sha.update(data)
+                f64.write(data)
+                rows.write("\n".join(block[:, annot_idx[0]].tolist()) + "\n")
+                annot.write_rows(block[:, annot_idx].tolist())
+                n_rows += len(block)
+            annot.close()
+    with filecache.atomic_write(base + ".cols.txt", "w") as cols:
+        cols.write("".join(s + "\n" for s in samples))
+    meta = {"shape": [n_rows, len(samples)], "dtype": DTYPE,
+            "annotation_cols": annotation_cols, "digest": sha.hexdigest(),
+            "source": os.path.basename(fname),
+            "source_digest": filecache.file_digest(fname, cache_dir)}
+    with filecache.atomic_write(base + ".json", "w") as fh:
+        json.dump(meta, fh, indent=1)
+    return(meta)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    stagestats.track()
+    if args["build"]:
+        for fname in args["INPUT"]:
+            meta = build(fname, args["--annotation-cols"],
+                         int(args["--chunk-size"]))
+            print("%s: %d x %d, %s" % (fname, meta["shape"][0],
+                                       meta["shape"][1], meta["digest"]),
+                  file=sys.stderr)
+    elif args["export"]:
+        MatrixStore(args["STORE"]).to_tsv(args["OUTPUT"])
+    elif args["info"]:
+        store = MatrixStore(args["STORE"])
+        for k, v in store.meta.items():
+            print("%s\t%s" % (k, v))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Activity of gene sets (modules) in each sample
+
+The gene sets of a GMT file (CEMiTool joined modules, BTM, Reactome) are
+loaded once into a sparse genes x sets indicator matrix, and the activity of
+every set in every sample is the average over its genes of the expression
+transformed by --method:
+
+  zscore    z-score of each gene across the samples (R's scale)
+  rank      rank of the gene within the sample, divided by the number of genes
+  mean      expression values as they are
+
+computed for all sets and samples with one sparse-dense matrix product
+(genes with missing values are not counted). With --sample-annotation the
+samples are restricted to those with a class (--class-col), as in
+fgsea_zscore.R, and the mean activity of the samples of each class is
+written to the --output-class file.
+
+The values are read from the matrix store of the expression file
+(matrixstore.py, the same float64 values as parsed from the table) when it
+is up to date, and only the genes and samples used are copied from it.
+
+Scores are cached in --cache-dir by the content of the expression matrix
+(and the samples used) and by the genes of each set: when the GMT file
+changes only the sets whose genes changed are scored again.
+
+Usage:
+  module_scores.py --expression=<file> --gmt=<file> --output=<file> [--method=<value>] [--symbols=<value>] [--annotation-cols=<value>...] [--sample-annotation=<file> --output-class=<file>] [--sample-name-col=<value>] [--class-col=<value>] [--cache-dir=<dir> | --no-cache]
+  module_scores.py (-h | --help)
+  module_scores.py --version
+
+Options:
+  -h --help                   Show this screen.
+  --version                   Show version.
+  --expression=<file>         expression file (genes x samples)
+  --gmt=<file>                gene sets (GMT format)
+  --output=<file>             output file, sets x samples
+  --method=<value>            zscore, rank or mean [default: zscore]
+  --symbols=<value>           column containing the genes of the sets [default: Symbol]
+  --annotation-cols=<value>   other annotation columns of the expression file
+  --sample-annotation=<file>  sample annotation file
+  --output-class=<file>       output file, sets x classes
+  --sample-name-col=<value>   column containing the sample names [default: Sample_geo_accession]
+  --class-col=<value>         column containing the classes [default: Class]
+  --cache-dir=<dir>           directory of the scores cache [default: tmp/cache]
+  --no-cache                  do not cache scores
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import numpy as np
+import os
+import sys
+from scipy import sparse
+from scipy.stats import rankdata
+from exprio import (format_numbers, read_expression, read_gmt,
+                    read_sample_annot)
+import filecache
+import stagestats
+import tsvio
+
+METHODS = ("zscore", "rank", "mean")
+
+
+def transform(values, method):
+    """
+    Transforms a genes x samples matrix for scoring, NaN are kept
+    """
+    if method == "zscore":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nanmean(values, axis=1, keepdims=True)
+            sd = np.nanstd(values, axis=1, ddof=1, keepdims=True)
+            return((values - mean) / sd)
+    if method == "rank":
+        ranks = rankdata(values, axis=0, nan_policy="omit")
+        return(ranks / (~np.isnan(values)).sum(axis=0))
+    if method == "mean":
+        return(values)
+    raise ValueError("Unknown method %s (use %s)" % (method, ", ".join(METHODS)))
+
+
+def set_matrix(sets, gene_index):
+    """
+    Returns the sparse genes x sets indicator of a list of gene lists
+    (genes not in gene_index are ignored) and the number of genes of each
+    set found
+    """
+    rows = []
+    cols = []
+    for j, genes in enumerate(sets):
+        found = {gene_index[g] for g in genes if g in gene_index}
+        rows.extend(found)
+        cols.extend([j] * len(found))
+    mat = sparse.csc_matrix((np.ones(len(rows)), (rows, cols)),
+                            shape=(len(gene_index), len(sets)))
+    return(mat, np.asarray(mat.sum(axis=0)).ravel().astype(int))
+
+
+def score_sets(mat, x):
+    """
+    Mean of x (genes x samples) over the genes of each set of mat (genes x
+    sets) in each sample, ignoring missing values
+    Sums and counts come from a single product with [x | not missing]
+    """
+    ok = ~np.isnan(x)
+    prod = mat.T @ np.hstack([np.where(ok, x, 0), ok])
+    n = x.shape[1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return(prod[:, :n] / prod[:, n:])
+
+
+def set_key(genes):
+    return(filecache.ResultCache.key(*sorted(set(genes))))
+
+
+def cached_scores(fname, digest, method, sets, compute, cache_dir):
+    """
+    Returns the scores of the sets (dictionary name -> genes), computing
+    with compute(names) only the sets not cached for the matrix
+    The cache keeps the scores of the last GMT scored by set content
+    """
+    name = "%s.%s" % (os.path.basename(fname), method)
+    path = filecache.cache_path("module_scores", name, digest, ".npz",
+                                cache_dir)
+    keys = {s: set_key(genes) for s, genes in sets.items()}
+    cached = {}
+    if os.path.exists(path):
+        with np.load(path) as data:
+            cached = dict(zip(data["keys"].tolist(), data["scores"]))
+    missing = [s for s in sets if keys[s] not in cached]
+    if missing:
+        for s, row in zip(missing, compute(missing)):
+            cached[keys[s]] = row
+    print("%d sets, %d scored, %d cached" %
+          (len(sets), len(missing), len(sets) - len(missing)), file=sys.stderr)
+    scores = np.array([cached[keys[s]] for s in sets])
+    if missing:
+        with filecache.atomic_write(path, "wb") as fh:
+            np.savez(fh, keys=np.array([keys[s] for s in sets]),
+                     scores=scores)
+        filecache.remove_stale(path, "module_scores", name, cache_dir)
+    return(scores)
+
+
+def class_samples(annot_fname, samples, sample_name_col, class_col):
+    """
+    Returns the classes (in order of appearance) and their samples, only
+    samples of the expression matrix with a class are used
+    """
+    annot = read_sample_annot(annot_fname)
+    for col in (sample_name_col, class_col):
+        if col not in annot:
+            raise Exception("Column %s not found in %s" % (col, annot_fname))
+    in_matrix = set(samples)
+    classes = {}
+    for sample, cls in zip(annot[sample_name_col], annot[class_col]):
+        if cls not in ("", "NA") and sample in in_matrix:
+            classes.setdefault(cls, []).append(sample)
+    return(classes)
+
+
+def module_scores(exp_fname, gmt_fname, out_fname, method="zscore",
+                  symbols="Symbol", annotation_cols=[], annot_fname=None,
+                  class_fname=None, sample_name_col="Sample_geo_accession",
+                  class_col="Class", cache_dir=filecache.DEFAULT_DIR):
+    if method not in METHODS:
+        raise ValueError("Unknown method %s (use %s)" %
+                         (method, ", ".join(METHODS)))
+    annot, samples, values = read_expression(exp_fname,
+                                             [symbols] + annotation_cols)
+    classes = None
+    if annot_fname:
+        classes = class_samples(annot_fname, samples, sample_name_col,
+                                class_col)
+        used = set(s for members in classes.values() for s in members)
+        cols = [i for i, s in enumerate(samples) if s in used]
+        samples = [samples[i] for i in cols]
+        values = values[:, cols]
+    gene_index = {}
+    for i, g in enumerate(annot[symbols].tolist()):
+        if g not in ("", "NA"):
+            gene_index.setdefault(g, i)
+    rows = list(gene_index.values())
+    gene_index = {g: k for k, g in enumerate(gene_index)}
+    sets = read_gmt(gmt_fname)
+    x = None
+
+    def compute(names):
+        nonlocal x
+        if x is None:
+            x = transform(np.asarray(values[rows], dtype=float), method)
+        mat, sizes = set_matrix([sets[s] for s in names], gene_index)
+        return(np.column_stack([sizes, score_sets(mat, x)]))
+
+    if cache_dir is None:
+        scores = compute(list(sets))
+    else:
+        digest = filecache.ResultCache.key(
+            filecache.file_digest(exp_fname, cache_dir), symbols, *samples)
+        scores = cached_scores(exp_fname, digest, method, sets, compute,
+                               cache_dir)
+    scores = scores.reshape(len(sets), len(samples) + 1)
+    sizes = scores[:, 0].astype(int).astype(str).tolist()
+    scores = scores[:, 1:]
+    write_scores(out_fname, list(sets), sizes, samples, scores)
+    if classes is not None:
+        col_of = {s: i for i, s in enumerate(samples)}
+        with np.errstate(invalid="ignore"):
+            means = np.column_stack(
+                [np.nanmean(scores[:, [col_of[s] for s in members]], axis=1)
+                 for members in classes.values()]) if classes else \
+                np.empty((len(sets), 0))
+        write_scores(class_fname, list(sets), sizes, list(classes), means)
+
+
+def write_scores(fname, names, sizes, columns, scores):
+    with tsvio.TsvWriter(fname, ["pathway", "size"] + columns) as out:
+        out.write_rows(zip(names, sizes, *[format_numbers(scores[:, j])
+                                           for j in range(len(columns))]))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    module_scores(args["--expression"], args["--gmt"], args["--output"],
+                  args["--method"], args["--symbols"],
+                  args["--annotation-cols"], args["--sample-annotation"],
+                  args["--output-class"], args["--sample-name-col"],
+                  args["--class-col"],
+                  None if args["--no-cache"] else args["--cache-dir"])
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Over representation analysis of many gene lists at once
+
+Vectorized counterpart of do_ora.R --genes: each GMT file is loaded once in a
+sparse genes x terms matrix, the overlaps of all gene lists with all terms
+come from one sparse product and the hypergeometric p-values, adjusted
+p-values (BH) and q-values are computed for all pairs at once. As in
+clusterProfiler's enricher (used by do_ora.R), the universe is all genes in
+the GMT file, only terms with 10 to 500 genes and at least one gene of the
+list are reported, and the q-value is estimated with lambda = 0.05.
+
+The output file of each list and GMT is given by the --output pattern, where
+{gmt} is replaced by the GMT name and {list} by the gene list name (both
+without extension). The columns are the ones written by do_ora.R.
+
+Usage:
+  ora.py (--gmt=<file>...) --output=<pattern> [--min-size=<n>] [--max-size=<n>] <genes>...
+  ora.py (-h | --help)
+  ora.py --version
+
+Options:
+  -h --help                 Show this screen.
+  --version                 Show version.
+  --gmt=<file>              GMT (gene matrix transposed) file
+  --output=<pattern>        output file pattern, e.g. results/do_ora/{gmt}/{list}.tsv
+  --min-size=<n>            minimum number of genes in a term [default: 10]
+  --max-size=<n>            maximum number of genes in a term [default: 500]
+  <genes>                   gene list files, one gene per line
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import numpy as np
+import os
+from scipy import sparse
+from scipy.special import gammaln
+from exprio import p_adjust_bh
+import stagestats
+
+COLUMNS = ["title", "direction", "ID", "Description", "GeneRatio", "BgRatio",
+           "pvalue", "p.adjust", "qvalue", "geneID", "Count"]
+# do_ora.R writes this header when nothing is enriched
+EMPTY_COLUMNS = ["title", "direction", "Module", "ID", "Description",
+                 "GeneRatio", "BgRatio", "pvalue", "p.adjust", "qvalue",
+                 "geneID", "Count"]
+
+
+class GeneSetLibrary():
+    """
+    GMT file as a sparse genes x terms membership matrix
+    """
+    def __init__(self, fname):
+        self.terms = []
+        self.desc = []
+        self.genes = {}
+        rows = []
+        cols = []
+        with open(fname) as gmt:
+            for line in gmt:
+                values = line.rstrip("\n").split("\t")
+                if len(values) < 2:
+                    continue
+                j = len(self.terms)
+                self.terms.append(values[0])
+                self.desc.append(values[1])
+                for gene in dict.fromkeys(values[2:]):
+                    if gene:
+                        rows.append(self.genes.setdefault(gene, len(self.genes)))
+                        cols.append(j)
+        self.gene_names = list(self.genes)
+        shape = (len(self.genes), len(self.terms))
+        self.matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32),
+                                         (rows, cols)), shape=shape)
+        self.sizes = np.asarray(self.matrix.sum(axis=0)).ravel()
+
+
+def log_choose(n, k):
+    return(gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1))
+
+
+def phyper_upper(k, m, n, big_n, tol=1e-17):
+    """
+    P(X >= k) for X ~ Hypergeometric(big_n genes, m in the term, n drawn),
+    vectorized over arrays (R's phyper(k - 1, m, big_n - m, n,
+    lower.tail=FALSE))
+    The tail on the side of k away from the mode is summed from k outwards,
+    with the ratio between consecutive probabilities, until the terms are
+    negligible; when k is below the mode 1 - P(X < k) is returned
+    """
+    k, m, n, big_n = [np.asarray(v, dtype=float) for v in
+                      np.broadcast_arrays(k, m, n, big_n)]
+    lo = np.maximum(0, n + m - big_n)
+    hi = np.minimum(m, n)
+    mode = np.floor((n + 1) * (m + 1) / (big_n + 2))
+    upper = k > mode
+    # first term of each sum: P(X = k) for the upper tail, P(X = k-1) below
+    x = np.where(upper, k, k - 1)
+    x = np.clip(x, lo, hi)
+    log_total = log_choose(big_n, n)
+    term = np.exp(log_choose(m, x) + log_choose(big_n - m, n - x) - log_total)
+    total = np.where(upper, term, np.where(k - 1 >= lo, term, 0))
+    active = np.where(upper, x < hi, x > lo) & (total > 0)
+    while active.any():
+        xa = x[active]
+        ma = m[active]
+        na = n[active]
+        nb = big_n[active] - ma
+        up = upper[active]
+        # P(X = x+1) / P(X = x) going up, P(X = x-1) / P(X = x) going down
+        ratio = np.where(up,
+                         (ma - xa) * (na - xa) / ((xa + 1) * (nb - na + xa + 1)),
+                         xa * (nb - na + xa) / ((ma - xa + 1) * (na - xa + 1)))
+        term[active] *= ratio
+        x[active] = np.where(up, xa + 1, xa - 1)
+        total[active] += term[active]
+        active[active] = np.where(up, x[active] < hi[active],
+                                  x[active] > lo[active]) & \
+            (term[active] > tol * total[active])
+    res = np.where(upper, total, 1 - total)
+    res[k <= lo] = 1
+    res[k > hi] = 0
+    return(np.clip(res, 0, 1))
+
+
+def qvalue(p, lambda_=0.05):
+    """
+    q-values with a single lambda (qvalue::qvalue(p, lambda=0.05)), None when
+    the estimated pi0 is not positive
+    """
+    pi0 = min(np.mean(p >= lambda_) / (1 - lambda_), 1)
+    if pi0 <= 0:
+        return(None)
+    return(pi0 * p_adjust_bh(p))
+
+
+def format_numbers(v):
+    """
+    Formats numbers like R's write.table
+    """
+    return(np.char.mod("%.15g", v).tolist())
+
+
+def ora(lib, gene_lists, min_size=10, max_size=500):
+    """
+    Runs the ORA of every gene list against every term of lib
+    Returns, for each list, a dictionary of columns (COLUMNS, as strings)
+    sorted by p-value, or None when nothing could be tested
+    """
+    # query matrix: lists x genes, only genes in the library, in list order
+    queries = []
+    for genes in gene_lists:
+        idx = [lib.genes[g] for g in dict.fromkeys(genes) if g in lib.genes]
+        queries.append(np.array(idx, dtype=np.int64))
+    rows = np.repeat(np.arange(len(queries)), [len(q) for q in queries])
+    cols = np.concatenate(queries) if queries else np.array([], dtype=np.int64)
+    q = sparse.csr_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                          shape=(len(queries), len(lib.genes)))
+    overlap = (q @ lib.matrix).toarray()
+    big_n = len(lib.genes)
+    n = np.diff(q.indptr)
+    valid = (lib.sizes >= min_size) & (lib.sizes <= max_size)
+    # terms in ID order, then stable sort by p-value (like enricher)
+    term_order = np.array(sorted(range(len(lib.terms)),
+                                 key=lambda j: lib.terms[j]), dtype=np.int64)
+    tested = (overlap[:, term_order] > 0) & valid[term_order][None, :]
+    list_idx, pos = np.nonzero(tested)
+    term_idx = term_order[pos]
+    k = overlap[list_idx, term_idx]
+    pvalues = phyper_upper(k, lib.sizes[term_idx], n[list_idx], big_n)
+    bounds = np.searchsorted(list_idx, np.arange(len(queries) + 1))
+    terms_arr = np.array(lib.terms, dtype=object)
+    desc_arr = np.array(lib.desc, dtype=object)
+    results = []
+    for i, query in enumerate(queries):
+        start, end = bounds[i], bounds[i+1]
+        if start == end:
+            results.append(None)
+            continue
+        o = start + np.argsort(pvalues[start:end], kind="stable")
+        terms = term_idx[o]
+        p = pvalues[o]
+        qvals = qvalue(pvalues[start:end])
+        members = lib.matrix[query][:, terms].tocsc()
+        gene_names = np.array(lib.gene_names, dtype=object)[query]
+        gene_ids = ["/".join(gene_names[members.indices[a:b]])
+                    for a, b in zip(members.indptr[:-1], members.indptr[1:])]
+        counts = k[o]
+        m = len(o)
+        results.append({
+            "title": ["NA"] * m, "direction": ["NA"] * m,
+            "ID": terms_arr[terms].tolist(),
+            "Description": desc_arr[terms].tolist(),
+            "GeneRatio": ["%d/%d" % (c, n[i]) for c in counts],
+            "BgRatio": ["%d/%d" % (s, big_n) for s in lib.sizes[terms]],
+            "pvalue": format_numbers(p),
+            "p.adjust": format_numbers(p_adjust_bh(pvalues[start:end])[o - start]),
+            "qvalue": ["NA"] * m if qvals is None else
+                      format_numbers(qvals[o - start]),
+            "geneID": gene_ids,
+            "Count": counts.astype(str).tolist()})
+    return(results)
+
+
+def write_result(fname, result):
+    with open(fname, "w") as out:
+        if result is None:
+            out.write("\t".join(EMPTY_COLUMNS) + "\n")
+            return
+        out.write("\t".join(COLUMNS) + "\n")
+        out.writelines("\t".join(row) + "\n"
+                       for row in zip(*[result[c] for c in COLUMNS]))
+
+
+def read_genes(fname):
+    with open(fname) as fh:
+        return([line.rstrip("\n") for line in fh])
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version='1.0')
+    stagestats.track()
+    names = [os.path.splitext(os.path.basename(f))[0] for f in args["<genes>"]]
+    gene_lists = [read_genes(f) for f in args["<genes>"]]
+    for gmt_fname in args["--gmt"]:
+        gmt_name = os.path.splitext(os.path.basename(gmt_fname))[0]
+        lib = GeneSetLibrary(gmt_fname)
+        results = ora(lib, gene_lists, int(args["--min-size"]),
+                      int(args["--max-size"]))
+        for name, result in zip(names, results):
+            fname = args["--output"].format(gmt=gmt_name, list=name)
+            write_result(fname, result)
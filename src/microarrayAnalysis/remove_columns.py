@@ -22,21 +22,52 @@ __license__ = "GPL"
 
 
 from docopt import docopt
+from operator import itemgetter
+import sys
+import tsvio
+import stagestats
 
 
-def remove_idx(vals, idx):
-    return([v for i, v in enumerate(vals) if i not in idx])
+def project(lines, keep, drop, width):
+    """
+    Yields the values of each line without the removed positions
+    Lines with the header's number of columns are projected with one
+    itemgetter call, shorter or longer lines and blank lines are passed
+    through without the removed positions that they have
+    """
+    if len(keep) == 1:
+        get = itemgetter(slice(keep[0], keep[0] + 1))
+    elif keep:
+        get = itemgetter(*keep)
+    else:
+        get = lambda values: []
+    n = 0
+    try:
+        for line in lines:
+            n += 1
+            values = line.rstrip("\r\n").split("\t")
+            if len(values) == width:
+                yield get(values)
+            else:
+                yield [v for i, v in enumerate(values) if i not in drop]
+    finally:
+        tsvio.rows_read += n
+
+
+def remove_columns(fname, out, columns):
+    """
+    Writes the table fname to out (file handle or name) without columns
+    """
+    columns = set(columns)
+    with tsvio.open_tsv(fname) as fh:
+        header = tsvio.TsvReader(fh).header
+        drop = set(i for i, v in enumerate(header) if v in columns)
+        keep = [i for i in range(len(header)) if i not in drop]
+        with tsvio.TsvWriter(out, [header[i] for i in keep]) as writer:
+            writer.write_rows(project(fh, keep, drop, len(header)))
+
 
 if __name__ == "__main__":
     args = docopt(__doc__, version='Get outliers from JSON')
-    columns = args["--columns"]
-    filename = args["INPUT"]
-    with open(filename) as fh:
-        header_line = fh.readline().strip("\n")
-        header = header_line.split("\t")
-        idx = [i for i, v in enumerate(header) if v in columns]
-        print("\t".join(remove_idx(header, idx)))
-        for line in fh:
-            line = line.strip("\n")
-            values = line.split("\t")
-            print("\t".join(remove_idx(values, idx)))
+    stagestats.track()
+    remove_columns(args["INPUT"], sys.stdout, args["--columns"])
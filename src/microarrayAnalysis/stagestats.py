@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Timing and memory records of the pipeline stages and Python tools
+
+Every job run by pipeline.py is measured by run_command: wall time, CPU time
+(user + system of all the processes it started), peak resident memory of its
+largest process and bytes read and written (including the page cache, from
+/proc/<pid>/io). The Python tools call track() when they start, which adds a
+record of their own process (with the rows read and written through tsvio)
+when they run inside a job (STAGESTATS_RECORDS is set). Records are appended
+as JSON lines to log/stages.jsonl.
+
+summary ranks the stages (and the tools inside them) of a run by a metric,
+compare shows the change of each stage between two runs (the last two by
+default) and runs lists the runs recorded.
+
+Usage:
+  stagestats.py summary [--records=<file>] [--run=<id>] [--sort=<metric>] [--top=<n>]
+  stagestats.py compare [--records=<file>] [<run1> <run2>]
+  stagestats.py runs [--records=<file>]
+  stagestats.py (-h | --help)
+
+Options:
+  -h --help                 Show this screen.
+  --records=<file>          JSON lines records [default: log/stages.jsonl]
+  --run=<id>                run to summarize, the last one by default
+  --sort=<metric>           wall, cpu, max_rss_mb, read_mb or write_mb [default: wall]
+  --top=<n>                 show only the first n stages
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from docopt import docopt
+import atexit
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+DEFAULT_RECORDS = "log/stages.jsonl"
+METRICS = ["wall", "cpu", "max_rss_mb", "read_mb", "write_mb"]
+MB = float(1 << 20)
+
+
+def read_io(pid="self"):
+    """
+    Returns the bytes read and written by a process (and the children it
+    waited for), or (None, None) if /proc is not available
+    """
+    try:
+        with open("/proc/%s/io" % pid) as fh:
+            io = dict(line.split(": ") for line in fh.read().splitlines())
+    except OSError:
+        return((None, None))
+    return((int(io["rchar"]), int(io["wchar"])))
+
+
+def usage_record(ru, rbytes, wbytes):
+    """
+    Returns the CPU time, peak memory and I/O fields of a record
+    """
+    if rbytes is None:
+        rbytes = ru.ru_inblock * 512
+        wbytes = ru.ru_oublock * 512
+    return({"cpu": round(ru.ru_utime + ru.ru_stime, 3),
+            "max_rss_mb": round(ru.ru_maxrss / 1024, 1),
+            "read_mb": round(rbytes / MB, 1),
+            "write_mb": round(wbytes / MB, 1)})
+
+
+def run_command(cmd, out, env=None, profile=None):
+    """
+    Runs a bash command writing stdout and stderr to out
+    If profile is given, Python processes are sampled by py-spy and the
+    profile written to this file (speedscope format)
+    Returns the exit status and the record of the command
+    """
+    args = ["bash", "-c", cmd]
+    if profile is not None:
+        if shutil.which("py-spy") is None:
+            raise Exception("py-spy is needed to profile a stage")
+        args = ["py-spy", "record", "--subprocesses", "--format",
+                "speedscope", "--output", profile, "--"] + args
+    record = {"start": time.strftime("%Y-%m-%dT%H:%M:%S"), "cmd": cmd}
+    start = time.perf_counter()
+    proc = subprocess.Popen(args, stdout=out, stderr=subprocess.STDOUT,
+                            env=env)
+    # /proc/<pid>/io is only readable before the process is reaped
+    os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    rbytes, wbytes = read_io(proc.pid)
+    pid, status, ru = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    record["wall"] = round(time.perf_counter() - start, 3)
+    record.update(usage_record(ru, rbytes, wbytes))
+    record["status"] = proc.returncode
+    return((proc.returncode, record))
+
+
+def append_record(record, fname=DEFAULT_RECORDS):
+    os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+    with open(fname, "a") as fh:
+        fh.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def track():
+    """
+    Records this process when it exits if it runs inside a pipeline job
+    """
+    fname = os.environ.get("STAGESTATS_RECORDS")
+    if not fname:
+        return
+    record = {"run": os.environ.get("STAGESTATS_RUN"),
+              "stage": os.environ.get("STAGESTATS_STAGE"),
+              "script": os.path.basename(sys.argv[0]),
+              "cmd": " ".join(sys.argv),
+              "start": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    start = time.perf_counter()
+
+    def write():
+        record["wall"] = round(time.perf_counter() - start, 3)
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        rbytes, wbytes = read_io()
+        record.update(usage_record(own, rbytes, wbytes))
+        record["cpu"] = round(record["cpu"] + children.ru_utime +
+                              children.ru_stime, 3)
+        record["max_rss_mb"] = round(max(own.ru_maxrss, children.ru_maxrss) /
+                                     1024, 1)
+        tsvio = sys.modules.get("tsvio")
+        if tsvio is not None:
+            record["rows_read"] = tsvio.rows_read
+            record["rows_written"] = tsvio.rows_written
+        append_record(record, fname)
+    atexit.register(write)
+
+
+def read_records(fname=DEFAULT_RECORDS):
+    records = []
+    with open(fname) as fh:
+        for line in fh:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # line cut by an interrupted run
+                continue
+    return(records)
+
+
+def run_ids(records):
+    """
+    Returns the run ids in the order they were recorded
+    """
+    ids = []
+    for rec in records:
+        if rec.get("run") not in ids:
+            ids.append(rec.get("run"))
+    return(ids)
+
+
+def aggregate(records):
+    """
+    Returns a dictionary (stage, script) -> totals of the records (the
+    maximum for max_rss_mb), script is None for the stages
+    """
+    totals = {}
+    for rec in records:
+        key = (rec.get("stage"), rec.get("script"))
+        tot = totals.setdefault(key, {"n": 0, "rows_read": None,
+                                      "rows_written": None,
+                                      **{m: 0 for m in METRICS}})
+        tot["n"] += 1
+        for m in METRICS:
+            if m == "max_rss_mb":
+                tot[m] = max(tot[m], rec.get(m) or 0)
+            else:
+                tot[m] += rec.get(m) or 0
+        for m in ("rows_read", "rows_written"):
+            if rec.get(m) is not None:
+                tot[m] = (tot[m] or 0) + rec[m]
+    return(totals)
+
+
+def fmt(value):
+    if value is None:
+        return("NA")
+    if isinstance(value, float):
+        return("%.1f" % value)
+    return(str(value))
+
+
+def summary(records, run=None, sort="wall", top=None):
+    """
+    Prints the stages of a run sorted by a metric, each followed by the
+    Python tools run inside it
+    """
+    if sort not in METRICS:
+        raise Exception("Unknown metric %s (use %s)" % (sort, ", ".join(METRICS)))
+    if run is None:
+        run = run_ids(records)[-1]
+    totals = aggregate(rec for rec in records if rec.get("run") == run)
+    stages = sorted((k for k in totals if k[1] is None),
+                    key=lambda k: -totals[k][sort])
+    total = sum(totals[k][sort] for k in stages) or 1
+    print("# run %s" % run)
+    print("\t".join(["stage", "script", "n", "share"] + METRICS +
+                    ["rows_read", "rows_written"]))
+    for key in stages[:top]:
+        scripts = sorted((k for k in totals if k[0] == key[0] and k[1]),
+                         key=lambda k: -totals[k][sort])
+        for k in [key] + scripts:
+            tot = totals[k]
+            share = "%.1f%%" % (100 * tot[sort] / total) if k == key else ""
+            print("\t".join([k[0], k[1] or "", str(tot["n"]), share] +
+                            [fmt(tot[m]) for m in METRICS] +
+                            [fmt(tot["rows_read"]), fmt(tot["rows_written"])]))
+
+
+def compare(records, run1=None, run2=None):
+    """
+    Prints the wall time, CPU time and peak memory of each stage and tool in
+    two runs, largest changes of wall time first
+    """
+    if run1 is None:
+        ids = run_ids(records)
+        if len(ids) < 2:
+            raise Exception("At least two runs are needed to compare")
+        run1, run2 = ids[-2:]
+    tot1 = aggregate(rec for rec in records if rec.get("run") == run1)
+    tot2 = aggregate(rec for rec in records if rec.get("run") == run2)
+    keys = sorted(set(tot1) | set(tot2), key=lambda k: (
+        -abs(tot2.get(k, {}).get("wall", 0) - tot1.get(k, {}).get("wall", 0)),
+        k[0] or "", k[1] or ""))
+    print("# %s -> %s" % (run1, run2))
+    print("\t".join(["stage", "script", "wall1", "wall2", "ratio", "cpu1",
+                     "cpu2", "max_rss_mb1", "max_rss_mb2"]))
+    for k in keys:
+        a = tot1.get(k, {})
+        b = tot2.get(k, {})
+        ratio = "%.2f" % (b["wall"] / a["wall"]) if a.get("wall") and b \
+            else "NA"
+        print("\t".join([k[0] or "", k[1] or "", fmt(a.get("wall")),
+                         fmt(b.get("wall")), ratio, fmt(a.get("cpu")),
+                         fmt(b.get("cpu")), fmt(a.get("max_rss_mb")),
+                         fmt(b.get("max_rss_mb"))]))
+
+
+def list_runs(records):
+    print("run\tstart\tstages\twall")
+    for run in run_ids(records):
+        stages = [rec for rec in records
+                  if rec.get("run") == run and not rec.get("script")]
+        print("%s\t%s\t%d\t%.1f" % (run, min((r["start"] for r in stages),
+                                             default="NA"),
+                                    len(stages), sum(r["wall"] for r in stages)))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    records = read_records(args["--records"])
+    if not records:
+        sys.exit("No records in %s" % args["--records"])
+    if args["summary"]:
+        top = int(args["--top"]) if args["--top"] else None
+        summary(records, args["--run"], args["--sort"], top)
+    elif args["compare"]:
+        compare(records, args["<run1>"], args["<run2>"])
+    elif args["runs"]:
+        list_runs(records)
@@ -0,0 +1,204 @@
+# vim:fileencoding=utf8
+
+"""Reading and writing of TSV tables shared by the Python tools.
+
+TsvReader projects the columns a script needs (splitting each line only up
+to the last column used), filters rows with per column predicates and can
+materialize blocks of rows as NumPy arrays. TsvWriter buffers lines and
+writes them in large batches. open_tsv handles gzip compressed files and '-'
+(stdin/stdout) transparently.
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from itertools import islice
+from operator import itemgetter
+import gzip
+import io
+import sys
+
+BUFFER_SIZE = 1 << 20
+BUFFER_LINES = 65536
+
+# rows read and written by this process (reported by stagestats)
+rows_read = 0
+rows_written = 0
+
+
+def open_tsv(fname, mode="r"):
+    """
+    Opens a text file for reading ("r") or writing ("w")
+    Files ending in .gz are (de)compressed, "-" is stdin or stdout
+    """
+    if fname == "-":
+        return(sys.stdin if mode == "r" else sys.stdout)
+    if fname.endswith(".gz"):
+        return(io.TextIOWrapper(io.BufferedReader(gzip.open(fname, mode + "b"))
+                                if mode == "r" else gzip.open(fname, mode + "b"),
+                                encoding="utf-8"))
+    return(open(fname, mode, buffering=BUFFER_SIZE))
+
+
+class TsvReader():
+    """
+    Reads a table from a file handle (or file name)
+    The first line is the header unless header is given
+    """
+    def __init__(self, fh, header=None):
+        if isinstance(fh, str):
+            fh = open_tsv(fh)
+        self.fh = fh
+        self.first_line = 1
+        if header is None:
+            header = fh.readline().rstrip("\r\n").split("\t")
+            self.first_line = 2
+        self.header = header
+
+    def index(self, columns):
+        """
+        Returns the positions of a list of column names (integers are taken
+        as positions)
+        """
+        idx = []
+        for col in columns:
+            if isinstance(col, int):
+                idx.append(col)
+                continue
+            try:
+                idx.append(self.header.index(col))
+            except ValueError:
+                raise ValueError("Column %s not found in header" % col)
+        return(idx)
+
+    def rows(self, columns=None, where=None, strip=False):
+        """
+        Yields the rows (sequences of strings) with only the given columns (all
+        columns if None), empty lines are skipped
+        where is a list of (column, predicate) pairs, rows where a predicate
+        returns False for the column's value are skipped
+        If strip is True, the values returned are stripped
+        Lines are only split up to the last column used, a line without one
+        of the columns used raises ValueError (with the file and line number)
+        """
+        where = where or []
+        preds = list(zip(self.index([c for c, f in where]),
+                         [f for c, f in where]))
+        if columns is None:
+            get = None
+            last = -1
+        else:
+            idx = self.index(columns)
+            last = max(idx + [i for i, f in preds] + [0]) + 1
+            if len(idx) == 1:
+                get = itemgetter(slice(idx[0], idx[0] + 1))
+            elif idx:
+                get = itemgetter(*idx)
+            else:
+                get = lambda values: []
+        global rows_read
+        n = 0
+        lineno = self.first_line - 1
+        try:
+            for lineno, line in enumerate(self.fh, self.first_line):
+                line = line.rstrip("\r\n")
+                if not line:
+                    continue
+                n += 1
+                values = line.split("\t", last)
+                if preds:
+                    for i, f in preds:
+                        if not f(values[i]):
+                            break
+                    else:
+                        row = values if get is None else get(values)
+                        yield list(map(str.strip, row)) if strip else row
+                    continue
+                row = values if get is None else get(values)
+                yield list(map(str.strip, row)) if strip else row
+        except IndexError:
+            raise ValueError("%s, line %d: %d columns, %d expected" %
+                             (getattr(self.fh, "name", "<table>"), lineno,
+                              len(values), len(self.header)))
+        finally:
+            rows_read += n
+
+    def chunks(self, columns=None, size=10000, dtype=None, where=None,
+               strip=False):
+        """
+        Yields blocks of at most size rows as 2D NumPy arrays (of strings,
+        or converted to dtype), empty values become NaN when dtype is given
+        """
+        import numpy as np
+        rows = self.rows(columns, where, strip)
+        while True:
+            block = list(islice(rows, size))
+            if not block:
+                break
+            try:
+                block = np.array(block)
+            except ValueError:
+                raise ValueError("Rows with different number of columns")
+            if dtype is not None:
+                block = np.where(block == "", "nan", block).astype(dtype)
+            yield block
+
+
+class TsvWriter():
+    """
+    Writes a table to a file handle (or file name) in batches of lines
+    """
+    def __init__(self, fh, header=None, buffer_lines=BUFFER_LINES):
+        self.close_fh = isinstance(fh, str)
+        if self.close_fh:
+            fh = open_tsv(fh, "w")
+        self.fh = fh
+        self.buffer = []
+        self.buffer_lines = buffer_lines
+        if header is not None:
+            self.buffer.append("\t".join(header) + "\n")
+
+    def write_row(self, values):
+        global rows_written
+        rows_written += 1
+        self.buffer.append("\t".join(values) + "\n")
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+
+    def write_rows(self, rows):
+        """
+        Writes the rows in batches, the rows read before an error raised by
+        rows are written too
+        """
+        global rows_written
+        rows = iter(rows)
+        while True:
+            lines = []
+            try:
+                lines.extend(map("\t".join, islice(rows, self.buffer_lines)))
+            finally:
+                if lines:
+                    rows_written += len(lines)
+                    self.buffer.append("\n".join(lines) + "\n")
+                    self.flush()
+            if not lines:
+                break
+
+    def flush(self):
+        self.fh.write("".join(self.buffer))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.close_fh:
+            self.fh.close()
+        else:
+            self.fh.flush()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return(False)
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# vim:fileencoding=utf8
+
+"""Run the analysis pipeline
+
+Every job of the pipeline (see build_jobs) declares its command, the files
+it reads (inputs), the files it writes (outputs), the jobs it runs after and
+how many cores it uses. Jobs run as soon as the jobs before them finish, as
+many at once as fit in --cores. A job is skipped when its command and the
+content of its inputs and of the code it runs did not change since its
+last successful run (the signatures are kept in --state) and its outputs
+exist. The code of a job is found from its command: the scripts it names,
+the scripts these call or source and the local modules the Python scripts
+import (see script_closure). Changing one comparison file reruns the DEG
+job of its study and every job downstream of it: the join of its platform,
+cut_degs, enrichment, gsea (which reads all DEG tables), cemitool (which
+reads the GSEA input) and their figures, but not the preprocessing, the
+other DEG jobs or the correlations. Each job writes its output to
+log/<group>/<job>.log and its wall time, CPU time, peak memory and I/O to
+the file given by --records (see stagestats.py, which summarizes and
+compares runs). The Python processes of one job can be sampled with py-spy
+(--profile, written to log/<group>/<job>.speedscope.json).
+
+With --with-outliers the sample annotation including the outlier samples is
+restored before running. Jobs can be selected with glob patterns (e.g.
+'deg:*'), the jobs they run after are selected as well.
+
+Usage:
+  pipeline.py [--cores=<n>] [--with-outliers] [--force] [--dry-run] [--state=<file>] [--records=<file>] [--profile=<job>] [<job>...]
+  pipeline.py --list
+  pipeline.py (-h | --help)
+
+Options:
+  -h --help                Show this screen.
+  --list                   list the jobs and their dependencies
+  --cores=<n>              number of cores used at once, all cores by default
+  --with-outliers          include the outlier samples again
+  --force                  run the selected jobs even if nothing changed
+  --dry-run                only show which jobs would run
+  --state=<file>           signatures of the last runs [default: tmp/cache/pipeline.json]
+  --records=<file>         timing and memory records [default: log/stages.jsonl]
+  --profile=<job>          sample the Python processes of this job with py-spy
+  <job>                    run only these jobs (glob patterns)
+"""
+
+__author__ = "Matheus Carvalho Bürger"
+__email__ = "matheus.cburger@gmail.com"
+__license__ = "GPL"
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from docopt import docopt
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "microarrayAnalysis"))
+import filecache
+import stagestats
+
+SAMPLE_ANNOT_DIR = "config/sample_annotation"
+LOG_DIRS = ["preprocess", "getdata", "degs", "correlation", "cemitool",
+            "enrichment", "figures", "gsea"]
+# studies whose DEGs are joined (GPL13158 shares the probes of GPL570)
+PLATFORMS = {"GPL2700": ["GSE13052", "GSE28405"],
+             "GPL570": ["GSE43777", "GSE51808"]}
+# scripts named in commands, shell and R scripts (src/...)
+SCRIPT_RE = re.compile(r"src/[\w./-]+\.(?:py|R|sh)\b")
+# modules imported by Python scripts
+IMPORT_RE = re.compile(r"^\s*(?:from\s+(\w+)\s+import|import\s+([\w, ]+))",
+                       re.MULTILINE)
+MODULE_DIRS = ["src/microarrayAnalysis"]
+
+
+class Job():
+    """
+    A command of the pipeline
+    cmd is run by bash from the project root, with {cores} replaced by the
+    number of cores of the job; inputs and outputs are glob patterns
+    (directories stand for every file inside them)
+    """
+    def __init__(self, name, cmd, inputs=(), outputs=(), after=(), cores=1,
+                 group="pipeline"):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.cores = cores
+        self.group = group
+
+    def log_fname(self):
+        return(os.path.join("log", self.group,
+                            self.name.replace(":", "_") + ".log"))
+
+    def scripts(self):
+        """
+        Returns the code the job runs (see script_closure) besides its inputs
+        """
+        return(script_closure(SCRIPT_RE.findall(self.cmd) +
+                              [f for pattern in self.inputs
+                               for f in expand(pattern)
+                               if f.endswith((".py", ".R", ".sh"))]))
+
+    def signature(self, cache_dir=filecache.DEFAULT_DIR):
+        """
+        SHA-1 of the command, of the names and contents of the inputs and of
+        the contents of the scripts it runs
+        """
+        sha = hashlib.sha1()
+        sha.update(self.cmd.encode("utf-8"))
+        for pattern in self.inputs:
+            sha.update(b"\0" + pattern.encode("utf-8"))
+            for fname in expand(pattern):
+                digest = filecache.file_digest(fname, cache_dir)
+                sha.update(("\0%s\0%s" % (fname, digest)).encode("utf-8"))
+        sha.update(b"\0scripts")
+        for fname in self.scripts():
+            digest = filecache.file_digest(fname, cache_dir)
+            sha.update(("\0%s\0%s" % (fname, digest)).encode("utf-8"))
+        return(sha.hexdigest())
+
+    def outputs_exist(self):
+        return(all(expand(pattern) for pattern in self.outputs))
+
+
+def script_closure(scripts):
+    """
+    Returns the scripts (sorted) and, recursively, the scripts they call
+    (src/... paths in their text, e.g. the tools called by a shell script or
+    sourced by an R script) and the local modules the Python scripts import
+    (from their own directory or MODULE_DIRS)
+    """
+    seen = set()
+    stack = list(scripts)
+    while stack:
+        fname = os.path.normpath(stack.pop())
+        if fname in seen or not os.path.isfile(fname):
+            continue
+        seen.add(fname)
+        with open(fname, errors="replace") as fh:
+            text = fh.read()
+        stack.extend(SCRIPT_RE.findall(text))
+        if not fname.endswith(".py"):
+            continue
+        dirs = [os.path.dirname(fname)] + MODULE_DIRS
+        for from_name, names in IMPORT_RE.findall(text):
+            for name in [from_name] if from_name else \
+                    [n.split()[0] for n in names.split(",") if n.strip()]:
+                for d in dirs:
+                    path = os.path.join(d, name + ".py")
+                    if os.path.isfile(path):
+                        stack.append(path)
+                        break
+    return(sorted(seen))
+
+
+def expand(pattern):
+    """
+    Returns the files matching a glob pattern, sorted, with directories
+    replaced by the files inside them
+    """
+    fnames = []
+    for path in sorted(glob.glob(pattern)):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                fnames.extend(os.path.join(root, f) for f in sorted(files))
+        else:
+            fnames.append(path)
+    return(fnames)
+
+
+def build_jobs(platforms=PLATFORMS):
+    """
+    Returns the jobs of the pipeline (in the order of run.sh), with one DEG
+    and one correlation job for each study with a comparisons file
+    """
+    studies = [os.path.basename(f)[:-len(".tsv")]
+               for f in sorted(glob.glob("config/comparisons/GSE*.tsv"))]
+    sample_annot = [os.path.join(SAMPLE_ANNOT_DIR, s + ".tsv")
+                    for s in studies]
+    jobs = []
+    jobs.append(Job(
+        "getdata", "src/getData.sh",
+        inputs=["src/getData.sh", "src/getSupplementaryData.py",
+                "src/microarrayAnalysis/geo_download.py",
+                "src/microarrayAnalysis/get_geo.R",
+                "src/getDataGSE*.py", "src/get_annotation.py",
+                "config/studies.tsv"],
+        outputs=["data/raw_data", "data/geo_raw"], group="getdata"))
+    jobs.append(Job(
+        "preprocess", "src/preprocess.sh",
+        inputs=["src/preprocess*.sh", "src/final_preprocess.sh",
+                "src/remove_outliers_*.sh", "src/microarrayAnalysis/filter.py",
+                "src/microarrayAnalysis/collapse.py",
+                "src/microarrayAnalysis/matrixstore.py", "data/raw_data",
+                "data/geo_raw",
+                "config/reannotation/annotation_long.tsv"] + sample_annot,
+        outputs=["data/processed/filtered/%s.tsv" % s for s in studies] +
+                ["data/processed/collapsed/%s.tsv" % s for s in studies] +
+                ["data/processed/store"],
+        after=["getdata"], cores=10, group="preprocess"))
+
+    # differential expression, one job per study and one join per platform
+    for s in studies:
+        jobs.append(Job(
+            "deg:" + s,
+            "mkdir -p results/DEG && "
+            "src/microarrayAnalysis/do_comparisons.py "
+            "--comp-file config/comparisons/{s}.tsv "
+            "--norm-file data/processed/filtered/{s}.tsv "
+            "--stat results/DEG/{s}.tsv "
+            "--sample-annot config/sample_annotation/{s}.tsv "
+            "--annotation-cols ProbeName --annotation-cols Symbol".format(s=s),
+            inputs=["src/microarrayAnalysis/do_comparisons.py",
+                    "config/comparisons/%s.tsv" % s,
+                    "data/processed/filtered/%s.tsv" % s,
+                    "config/sample_annotation/%s.tsv" % s],
+            outputs=["results/DEG/%s.tsv" % s],
+            after=["preprocess"], group="degs"))
+    for gpl in sorted(platforms):
+        degs = ["results/DEG/%s.tsv" % s for s in platforms[gpl]]
+        jobs.append(Job(
+            "join_deg:" + gpl,
+            "src/microarrayAnalysis/join_stats.py results/%s_joined_DEG.tsv "
+            "--probe-col ProbeName --gene-col Symbol %s" %
+            (gpl, " ".join("--input " + d for d in degs)),
+            inputs=["src/microarrayAnalysis/join_stats.py"] + degs,
+            outputs=["results/%s_joined_DEG.tsv" % gpl],
+            after=["deg:" + s for s in platforms[gpl]], group="degs"))
+    jobs.append(Job(
+        "cut_degs", "R CMD BATCH src/cutDEGs.R && mv cutDEGs.Rout log/degs/",
+        inputs=["src/cutDEGs.R", "results/GPL*_joined_DEG.tsv",
+                "config/reannotation/annotation_long.tsv"],
+        outputs=["results/joined_DEG.tsv", "results/DEG_stats.tsv",
+                 "results/DEG_stats_by_group.tsv"],
+        after=["join_deg:" + gpl for gpl in sorted(platforms)],
+        group="degs"))
+
+    jobs.append(Job(
+        "enrichment", "src/enrichment.sh",
+        inputs=["src/enrichment.sh", "src/microarrayAnalysis/ora.py",
+                "results/joined_DEG.tsv", "config/pathways/*.gmt"],
+        outputs=["results/enrichment/do_ora", "results/joined_degs/genes"],
+        after=["cut_degs"], group="enrichment"))
+    jobs.append(Job(
+        "gsea", "src/gsea.sh",
+        inputs=["src/gsea.sh", "src/microarrayAnalysis/collapse.py",
+                "results/DEG/*.tsv", "data/processed/filtered/*.tsv",
+                "config/pathways/*.gmt"] + sample_annot,
+        outputs=["tmp/fgsea/Log2FC", "results/fgsea"],
+        after=["deg:" + s for s in studies], cores=10, group="gsea"))
+
+    # correlation between lncRNAs and coding genes, one job per study
+    for s in studies:
+        jobs.append(Job(
+            "corr:" + s,
+            "mkdir -p results/correlation/byprobe && "
+            "src/microarrayAnalysis/cor_lnc.py pairs "
+            "--ovlp config/reannotation/ovlp_lnc.tsv "
+            "--exp data/processed/filtered/{s}.tsv "
+            "--output results/correlation/byprobe/{s}.tsv "
+            "--method spearman --cores {{cores}}".format(s=s),
+            inputs=["src/microarrayAnalysis/cor_lnc.py",
+                    "config/reannotation/ovlp_lnc.tsv",
+                    "data/processed/filtered/%s.tsv" % s],
+            outputs=["results/correlation/byprobe/%s.tsv" % s],
+            after=["preprocess"], cores=4, group="correlation"))
+    jobs.append(Job(
+        "join_corr",
+        "mkdir -p results/correlation/bygene && R CMD BATCH src/join_corr.R "
+        "log/correlation/join_corr.Rout",
+        inputs=["src/join_corr.R", "results/correlation/byprobe"],
+        outputs=["results/correlation/all.tsv"],
+        after=["corr:" + s for s in studies], group="correlation"))
+
+    jobs.append(Job(
+        "cemitool", "src/CEMiTool.sh",
+        inputs=["src/CEMiTool.sh", "src/plot_CEMiTool_joined.py",
+                "src/microarrayAnalysis/join_cemitool.py",
+                "src/microarrayAnalysis/module_scores.py",
+                "data/processed/collapsed/*.tsv", "tmp/fgsea/Log2FC",
+                "config/pathways/BTM.gmt", "config/reannotation/biotypes.tsv",
+                "config/reannotation/gencode_annotation.tsv"] + sample_annot,
+        outputs=["results/CEMiTool_joined.tsv",
+                 "results/CEMiTool_joined_modules.gmt"],
+        after=["preprocess", "gsea"], cores=10, group="cemitool"))
+
+    # figures, one job per script
+    figures = {
+        "CEMiTool_joined_corrplot.R": (["results/CEMiTool_joined/fgsea"],
+                                       ["cemitool"]),
+        "DEG_cutoff.R": (["results/GPL*_joined_DEG.tsv"], ["cut_degs"]),
+        "StudyInformation.R": (sample_annot, []),
+        "correlation.R": (["results/correlation/all.tsv",
+                           "data/processed/filtered/*.tsv"] + sample_annot,
+                          ["join_corr"]),
+        "deg_stats.R": (["results/DEG_stats_by_group.tsv"], ["cut_degs"]),
+        "enrichment_cemitool_modules.sh": (
+            ["results/CEMiTool_joined/enrichment"], ["cemitool"]),
+        "enrichment_degs.sh": (["results/enrichment/do_ora"], ["enrichment"]),
+        "filter_sd_CEMiTool.R": (["data/processed/collapsed/*.tsv"],
+                                 ["preprocess"]),
+        "gsea_corrplot.R": (["results/fgsea"], ["gsea"]),
+        "heatmap_lncDEGs.R": (["results/joined_DEG.tsv",
+                               "data/processed/filtered/*.tsv"] + sample_annot,
+                              ["cut_degs"]),
+        "platstats.R": ([], []),
+        "platstatsjoined.R": ([], []),
+        "rnaseq.R": (["config/rnaseq_data", "config/reannotation/biotypes.tsv",
+                      "config/reannotation/gencode_annotation.tsv"], []),
+        "venn.R": (["results/joined_DEG.tsv"], ["cut_degs"]),
+        "volcano_plots.sh": (["results/DEG/*.tsv"],
+                             ["deg:" + s for s in studies]),
+    }
+    for script in sorted(glob.glob("src/figures/*")):
+        base = os.path.basename(script)
+        inputs, after = figures.get(base, (["results", "data/processed"],
+                                           ["cemitool", "join_corr",
+                                            "enrichment", "gsea"]))
+        jobs.append(Job(
+            "figures:" + base, script,
+            inputs=[script, "config/reannotation/annotation_long.tsv"] +
+                   inputs,
+            after=after, group="figures"))
+    return(jobs)
+
+
+def select_jobs(jobs, patterns):
+    """
+    Returns the jobs matching any of the patterns and the jobs they run
+    after, in the order of jobs
+    """
+    by_name = {job.name: job for job in jobs}
+    if not patterns:
+        return(jobs)
+    selected = set()
+    stack = [job.name for job in jobs
+             if any(fnmatch.fnmatch(job.name, p) for p in patterns)]
+    if not stack:
+        raise Exception("No job matches %s" % " ".join(patterns))
+    while stack:
+        name = stack.pop()
+        if name not in selected:
+            selected.add(name)
+            stack.extend(by_name[name].after)
+    return([job for job in jobs if job.name in selected])
+
+
+def load_state(state_fname):
+    try:
+        with open(state_fname) as fh:
+            return(json.load(fh))
+    except (OSError, ValueError):
+        return({})
+
+
+def save_state(state, state_fname):
+    os.makedirs(os.path.dirname(state_fname) or ".", exist_ok=True)
+    with filecache.atomic_write(state_fname, "w") as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+
+
+def log(msg):
+    print(time.strftime("%d-%m-%Y:%H:%M:%S"), msg, flush=True)
+
+
+def run_job(job, cores, run_id, records_fname, profile=False):
+    """
+    Runs the command of a job, writing its output to its log file and its
+    timing and memory record to records_fname (the Python tools it runs add
+    their own records)
+    Returns the record
+    """
+    os.makedirs(os.path.dirname(job.log_fname()), exist_ok=True)
+    env = dict(os.environ, STAGESTATS_RECORDS=os.path.abspath(records_fname),
+               STAGESTATS_RUN=run_id, STAGESTATS_STAGE=job.name)
+    profile_fname = job.log_fname()[:-len(".log")] + ".speedscope.json" \
+        if profile else None
+    with open(job.log_fname(), "w") as out:
+        status, record = stagestats.run_command(job.cmd.format(cores=cores),
+                                                out, env, profile_fname)
+    record.update(run=run_id, stage=job.name, cores=cores)
+    stagestats.append_record(record, records_fname)
+    return(record)
+
+
+def run(jobs, max_cores, state, state_fname, force=False, dry_run=False,
+        records_fname=stagestats.DEFAULT_RECORDS, profile=None):
+    """
+    Runs the jobs after the jobs they depend on, up to max_cores cores at
+    once, skipping the ones that did not change
+    The job named profile is sampled with py-spy
+    Returns the names of the jobs that failed or could not run
+    """
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    names = set(job.name for job in jobs)
+    waiting = list(jobs)
+    done = set()
+    rerun = set()  # jobs that ran (or would run, with dry_run)
+    failed = []
+    running = {}
+    free = max_cores
+    with ThreadPoolExecutor(max_workers=len(jobs) or 1) as pool:
+        while waiting or running:
+            for job in list(waiting):
+                deps = [d for d in job.after if d in names]
+                if any(d in failed for d in deps):
+                    waiting.remove(job)
+                    failed.append(job.name)
+                    log("Skipping %s (a job it depends on failed)" % job.name)
+                    continue
+                if not all(d in done for d in deps):
+                    continue
+                cores = min(job.cores, max_cores)
+                if dry_run:
+                    sig = None if any(d in rerun for d in deps) \
+                        else job.signature()
+                else:
+                    if cores > free:
+                        continue
+                    sig = job.signature()
+                if not force and sig is not None and \
+                        state.get(job.name) == sig and job.outputs_exist():
+                    waiting.remove(job)
+                    done.add(job.name)
+                    log("%s is up to date" % job.name)
+                    continue
+                waiting.remove(job)
+                rerun.add(job.name)
+                if dry_run:
+                    done.add(job.name)
+                    log("Would run %s" % job.name)
+                    continue
+                log("Running %s (%d cores) ..." % (job.name, cores))
+                free -= cores
+                running[pool.submit(run_job, job, cores, run_id, records_fname,
+                                    job.name == profile)] = (job, cores, sig)
+            if not running:
+                if waiting and not dry_run:
+                    # the jobs left depend on jobs that were not selected
+                    failed.extend(job.name for job in waiting)
+                break
+            finished, pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, cores, sig = running.pop(future)
+                free += cores
+                record = future.result()
+                if record["status"] == 0:
+                    done.add(job.name)
+                    # inputs written while the job ran make it run again
+                    if job.signature() != sig:
+                        sig = None
+                    state[job.name] = sig
+                    save_state(state, state_fname)
+                    log("%s done (%.1fs, %.1f MB)." %
+                        (job.name, record["wall"], record["max_rss_mb"]))
+                else:
+                    failed.append(job.name)
+                    log("Unable to run %s, see %s" %
+                        (job.name, job.log_fname()))
+    return(failed)
+
+
+def include_outliers():
+    """
+    Restores the sample annotation files including the outlier samples
+    """
+    outliers_fname = os.path.join(SAMPLE_ANNOT_DIR, "outliers.txt")
+    if os.path.exists(outliers_fname):
+        log("Removing outliers.txt file ...")
+        os.remove(outliers_fname)
+    log("Copying sample annotation files including outlier samples ...")
+    for fname in glob.glob(os.path.join(SAMPLE_ANNOT_DIR, "with_outliers", "*")):
+        shutil.copy(fname, SAMPLE_ANNOT_DIR)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    jobs = build_jobs()
+    if args["--list"]:
+        for job in jobs:
+            print("%s\t%d\t%s" % (job.name, job.cores, ",".join(job.after)))
+        sys.exit(0)
+    jobs = select_jobs(jobs, args["<job>"])
+    if not args["--dry-run"]:
+        for dirname in LOG_DIRS:
+            os.makedirs(os.path.join("log", dirname), exist_ok=True)
+        if args["--with-outliers"]:
+            include_outliers()
+    if args["--profile"]:
+        if args["--profile"] not in [job.name for job in jobs]:
+            sys.exit("Unknown job %s" % args["--profile"])
+        if shutil.which("py-spy") is None:
+            sys.exit("py-spy is needed to profile a job")
+    cores = int(args["--cores"]) if args["--cores"] else os.cpu_count()
+    state = load_state(args["--state"])
+    failed = run(jobs, cores, state, args["--state"], args["--force"],
+                 args["--dry-run"], args["--records"], args["--profile"])
+    if failed:
+        log("Failed: " + " ".join(failed))
+        sys.exit(1)
+    log("Done.")
@@ -1,32 +1,111 @@
 #!/usr/bin/env python3
 # vim:fileencoding=utf8
 
+"""Plot the joined CEMiTool graph colored by each clustering
+
+One PNG is drawn for every clustering (vertex property) and every minimum
+Sum (1, 2 and 3): <prefix><clustering>_get<n>.png. The sfdp layout is saved
+next to the GraphML (<graphml>.<hash>.layout.npy), keyed by the hash of the
+graph's vertices and edges, so it is only computed again when the graph
+changes (not when only the clusterings do). The figures are drawn
+concurrently by <cores> processes (all cores by default), straight to files,
+so no display is needed.
+
+Usage:
+  plot_CEMiTool_joined.py <graphml> <prefix> [<cores>]
+"""
+
 __author__ = "Matheus Carvalho Bürger"
 __email__ = "matheus.cburger@gmail.com"
 __license__ = "GPL"
 
+from concurrent.futures import ProcessPoolExecutor
 import graph_tool.all
+import hashlib
+import multiprocessing
+import numpy as np
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "microarrayAnalysis"))
+import filecache
+
+FILTERS = 3
+
+# graph and layout of each drawing process
+graph = None
+layout = None
+
+
+def graph_digest(g):
+    """
+    SHA-1 of the vertex names and edges of a graph
+    """
+    sha = hashlib.sha1()
+    sha.update("\0".join(g.vertex_properties["name"]).encode("utf-8"))
+    sha.update(np.ascontiguousarray(g.get_edges()).tobytes())
+    return(sha.hexdigest())
+
+
+def get_layout(g, graphml):
+    """
+    Returns the sfdp layout of g as a vertices x 2 array, read from (or
+    saved to) the file next to graphml with the hash of g
+    """
+    dirname = os.path.dirname(graphml) or "."
+    name = os.path.basename(graphml)
+    fname = filecache.cache_path("", name, graph_digest(g), ".layout.npy",
+                                 dirname)
+    if os.path.exists(fname):
+        return(np.load(fname))
+    pos = graph_tool.all.sfdp_layout(g).get_2d_array([0, 1]).T
+    with filecache.atomic_write(fname, "wb") as fh:
+        np.save(fh, pos)
+    filecache.remove_stale(fname, "", name, dirname)
+    return(pos)
+
+
+def init_worker(graphml, pos):
+    """
+    Loads the graph once in each drawing process
+    """
+    global graph, layout
+    graph_tool.all.openmp_set_num_threads(1)
+    graph = graph_tool.all.load_graph(graphml)
+    layout = graph.new_vertex_property("vector<double>")
+    layout.set_2d_array(pos.T)
+
+
+def draw(cluster, min_sum, output):
+    weights = graph.edge_properties["Sum"]
+    efilt = graph.new_edge_property("bool", vals=weights.a >= min_sum)
+    view = graph_tool.all.GraphView(graph, efilt=efilt)
+    graph_tool.all.graph_draw(view, pos=layout, bg_color=[1, 1, 1, 1],
+                              output=output,
+                              vertex_fill_color=graph.vertex_properties[cluster],
+                              edge_pen_width=weights)
+    return(output)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        sys.exit(__doc__)
     graphml = sys.argv[1]
     prefix = sys.argv[2]
     g = graph_tool.all.load_graph(graphml)
     clusters = [k for k in g.vertex_properties.keys() if not k.startswith("_")
                 and k != "name"]
-    pos = graph_tool.all.sfdp_layout(g)
-
-    bool_filt = []
-    view_filt = []
-    for i in range(3):
-        bool_filt.append([e >= i+1 for e in g.edge_properties["Sum"]])
-        view_filt.append(graph_tool.all.GraphView(g, efilt=bool_filt[i]))
-
-    for c in clusters:
-        for i in range(3):
-            graph_tool.all.graph_draw(view_filt[i], pos=pos,
-                                      bg_color=[1, 1, 1, 1],
-                                      output=prefix + c + "_get" + str(i+1) +
-                                      ".png",
-                                      vertex_fill_color=g.vertex_properties[c],
-                                      edge_pen_width=g.edge_properties["Sum"])
+    pos = get_layout(g, graphml)
+
+    cores = int(sys.argv[3]) if len(sys.argv) == 4 else None
+    # graph-tool uses OpenMP, so drawing processes are spawned, not forked
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=cores, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(graphml, pos)) as pool:
+        futures = [pool.submit(draw, c, i+1, prefix + c + "_get" + str(i+1) +
+                               ".png")
+                   for c in clusters for i in range(FILTERS)]
+        for future in futures:
+            future.result()